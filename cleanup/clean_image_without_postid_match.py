@@ -9,6 +9,12 @@ import sys
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+# Shared modules live in the project-root common/ directory
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+from common.paginate import iter_rows_keyset
+
 # --- Configuration ---
 BUCKET_NAME = "xhs_image"  # Replace with your actual bucket name if different
 # --- End Configuration ---
@@ -72,27 +78,10 @@ def get_all_post_ids(supabase: Client) -> set[str]:
     print("Fetching all post_ids from 'posts' table...")
     post_ids = set()
     try:
-        # Paginate through results if necessary
-        current_page = 0
-        page_size = 1000 # Adjust page size as needed
-        while True:
-            range_start = current_page * page_size
-            range_end = range_start + page_size - 1
-            response = supabase.table('posts').select('post_id').range(range_start, range_end).execute()
-
-            if hasattr(response, 'data') and response.data:
-                fetched_ids = {str(item['post_id']) for item in response.data if item.get('post_id') is not None}
-                post_ids.update(fetched_ids)
-                if len(response.data) < page_size:
-                    break # Last page
-                current_page += 1
-            else:
-                # Handle potential API error structure or empty response
-                if hasattr(response, 'error') and response.error:
-                     print(f"Error fetching post_ids: {response.error}")
-                elif not hasattr(response, 'data'):
-                     print(f"Unexpected response structure: {response}")
-                break # Exit loop if no data or error
+        # Keyset pagination on the primary key (streams pages instead of offset scans)
+        for item in iter_rows_keyset(supabase, 'posts', 'post_id', key='post_id'):
+            if item.get('post_id') is not None:
+                post_ids.add(str(item['post_id']))
 
         print(f"Found {len(post_ids)} unique post_ids.")
         # print(f"Post IDs: {post_ids}") # Uncomment for debugging
@@ -218,12 +218,21 @@ FOOD_RELATED_KEYWORDS = [
 # Updated: Added pagination to fetch all posts, not just the first 1000.
 # Updated: Fixed issue with column name containing spaces.
 # Updated: Added logic to only update if 'is related' is NULL.
+# Updated: Keyset pagination on post_id. Offset pagination over the NULL filter skipped rows,
+#          because every processed chunk drops out of the filter before the next page is read.
 
 import os
+import sys
 import argparse
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+# Shared modules live in the project-root common/ directory
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+from common.paginate import iter_pages_keyset
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -252,7 +261,6 @@ def check_and_update_posts(debug=False, test_post_id=None):
         debug (bool): If True, prints additional debug information during processing.
         test_post_id (str, optional): If provided, only process this specific post ID (if 'is related' is NULL).
     """
-    start_index = 0
     chunk_size = 1000 # Fetch 1000 posts at a time (Supabase default limit)
     total_processed = 0
     total_updated_successfully = 0
@@ -290,26 +298,19 @@ def check_and_update_posts(debug=False, test_post_id=None):
             return
 
     # Normal processing for posts where 'is related' is NULL
-    while True:
-        try:
-            # Fetch a chunk of posts where 'is related' is NULL
-            print(f"Fetching posts from index {start_index} where '{IS_RELATED_COLUMN}' is NULL...", end=" ")
-            response = supabase.table(TABLE_NAME)\
-                             .select(f'{PRIMARY_KEY_COLUMN}, {CONTENT_COLUMN}, "{IS_RELATED_COLUMN}"')\
-                             .is_(IS_RELATED_COLUMN, 'null')\
-                             .range(start_index, start_index + chunk_size - 1)\
-                             .execute()
-
-            if not response.data:
-                print("No more posts found with NULL 'is related'.")
-                break  # Exit loop if no more data
-
-            posts_in_chunk = len(response.data)
+    try:
+        pages = iter_pages_keyset(supabase, TABLE_NAME,
+                                  f'{PRIMARY_KEY_COLUMN}, {CONTENT_COLUMN}, "{IS_RELATED_COLUMN}"',
+                                  key=PRIMARY_KEY_COLUMN,
+                                  filters=lambda query: query.is_(IS_RELATED_COLUMN, 'null'),
+                                  page_size=chunk_size)
+        for posts in pages:
+            posts_in_chunk = len(posts)
             total_processed += posts_in_chunk
-            print(f"Fetched {posts_in_chunk} posts.")
+            print(f"Fetched {posts_in_chunk} posts where '{IS_RELATED_COLUMN}' is NULL (starting at post_id {posts[0][PRIMARY_KEY_COLUMN]}).")
 
             # Process the current chunk of posts
-            chunk_stats = process_posts(response.data, debug)
+            chunk_stats = process_posts(posts, debug)
             
             # Update statistics
             total_updated_successfully += chunk_stats['updated']
@@ -317,21 +318,12 @@ def check_and_update_posts(debug=False, test_post_id=None):
             total_related += chunk_stats['related']
             total_not_related += chunk_stats['not_related']
             total_already_set += chunk_stats['already_set'] # Add count for already set posts
-            
-            # Since we filter by NULL, we don't need to paginate in the traditional sense
-            # If a chunk had less than chunk_size, it means we've processed all NULL ones.
-            if len(response.data) < chunk_size:
-                print("Processed the last chunk of NULL 'is related' posts.")
-                break
-            
-            # If we fetched a full chunk, there might be more, so continue pagination
-            start_index += chunk_size 
+        print("No more posts found with NULL 'is related'.")
 
-        except Exception as e:
-            print(f"\nAn error occurred during fetching/processing chunk starting at index {start_index}: {e}")
-            total_errors += 1 # Count this as an error if fetching fails
-            print("Stopping further processing due to error.")
-            break
+    except Exception as e:
+        print(f"\nAn error occurred during fetching/processing posts: {e}")
+        total_errors += 1 # Count this as an error if fetching fails
+        print("Stopping further processing due to error.")
 
     print(f"\n\nProcessing complete.")
     print(f"Total posts checked (where '{IS_RELATED_COLUMN}' was NULL): {total_processed}")
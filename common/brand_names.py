@@ -0,0 +1,98 @@
+# common/brand_names.py
+# One brand-name normalization shared by dzdp_crawler/Upload.py, dzdp_crawler/refresh.py,
+# xhs_crawler/get_brand.py and xhs_crawler/upload.py.
+#   display_name(name)  the stored form: NFKC (full-width -> half-width), collapsed whitespace,
+#                       branch suffix removed ("海底捞(南山店)" -> "海底捞", "黑丁·烤肉" -> "黑丁"),
+#                       aliases resolved to their canonical brand.
+#   brand_key(name)     lookup key: display_name() case-folded. Two names are the same brand
+#                       exactly when their keys are equal.
+# Aliases (typos, renamed brands, spelling variants) live in brand_aliases.json next to this file:
+#   {"canonical brand": ["alias", "another alias"], ...}
+# The alias index is a dict built once per process, so every lookup is O(1).
+
+import os
+import re
+import json
+import unicodedata
+
+ALIASES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "brand_aliases.json")
+
+# Everything from the first branch delimiter on is a branch/location suffix.
+# After NFKC, full-width "（" and "【" variants are already their half-width forms where they exist.
+_BRANCH_SUFFIX = re.compile(r"\s*[·・•(\[【].*$", re.S)
+_WHITESPACE = re.compile(r"\s+")
+
+_alias_index = None
+
+
+def _clean(name):
+    """NFKC, branch suffix removal and whitespace collapsing (no alias resolution)."""
+    if name is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(name))
+    text = _WHITESPACE.sub(" ", text).strip()
+    stripped = _BRANCH_SUFFIX.sub("", text).strip()
+    # A name that starts with a delimiter has no brand part; keep it as it is
+    return stripped or text
+
+
+def _fold(text):
+    return text.casefold()
+
+
+def load_alias_index(path=ALIASES_FILE):
+    """Builds {folded alias: canonical display name} from the aliases file."""
+    index = {}
+    if not os.path.exists(path):
+        return index
+    with open(path, 'r', encoding='utf-8') as f:
+        aliases = json.load(f)
+    for canonical, variants in aliases.items():
+        canonical_display = _clean(canonical)
+        for variant in [canonical] + list(variants):
+            index[_fold(_clean(variant))] = canonical_display
+    return index
+
+
+def get_alias_index():
+    global _alias_index
+    if _alias_index is None:
+        _alias_index = load_alias_index()
+    return _alias_index
+
+
+def add_alias(alias, canonical, path=ALIASES_FILE):
+    """Persists alias -> canonical in the aliases file and updates the in-memory index."""
+    aliases = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            aliases = json.load(f)
+    variants = aliases.setdefault(_clean(canonical), [])
+    if alias not in variants:
+        variants.append(alias)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(aliases, f, ensure_ascii=False, indent=4)
+    get_alias_index()[_fold(_clean(alias))] = _clean(canonical)
+
+
+def display_name(name):
+    """Canonical display form of a brand or shop name (see module header)."""
+    cleaned = _clean(name)
+    return get_alias_index().get(_fold(cleaned), cleaned)
+
+
+def brand_key(name):
+    """Lookup key: equal keys mean the same brand."""
+    return _fold(display_name(name))
+
+
+def dedupe_names(names):
+    """Returns the names with one entry per brand key (first occurrence wins), in input order."""
+    seen = set()
+    unique = []
+    for name in names:
+        key = brand_key(name)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(name)
+    return unique
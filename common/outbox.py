@@ -0,0 +1,414 @@
+# common/outbox.py
+# Durable local outbox for Supabase writes.
+# Pipeline stages append rows to a local SQLite database (WAL mode) together with an
+# idempotency key and return immediately; a background flusher thread drains pending rows
+# to Supabase in large batches. Rows stay in the outbox until Supabase accepted them, so after
+# a network drop or a restart flushing resumes exactly where it stopped.
+# Failures are handled by kind (is_rejection):
+#   transient (connection errors, timeouts, 5xx, 408/429)  the batch is retried with exponential
+#       backoff as often as it takes; this never counts against a row.
+#   rejection (4xx, PostgREST/Postgres errors such as an unknown column or a constraint violation)
+#       the batch is bisected until the rejected rows are isolated, the rest is sent. A row
+#       rejected max_attempts times on its own is parked as failed, so it no longer blocks the
+#       rows behind it. requeue_failed() puts parked rows back (the upload scripts do so on start).
+# Each script uses its own database file, so a bad row of one pipeline never holds up another.
+#
+# Usage:
+#   outbox = Outbox(client_factory=get_supabase_client, db_path=".../outbox.sqlite3")
+#   outbox.start()
+#   outbox.enqueue("dzdpdata", records, key_fields=["榜单", "品牌", "create_date"])
+#   outbox.enqueue("posts", [{"post_id": ..., "likes": ...}], key_fields=["post_id"], op="update", match_on=["post_id"])
+#   outbox.close(timeout=600)   # drain what is pending; anything left is sent on the next run
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_DB_PATH = os.path.join(PROJECT_ROOT, "outbox.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    on_conflict TEXT NOT NULL DEFAULT '',
+    columns TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    failed_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (sent_at, id);
+"""
+
+SUPPORTED_OPS = ("upsert", "insert", "update")
+UPDATE_IN_CHUNK = 200 # Values per "col in (...)" filter of a grouped update (keeps request URLs short)
+
+# HTTP statuses that are worth retrying even though they are 4xx
+TRANSIENT_HTTP_STATUSES = {408, 425, 429}
+# Postgres error classes that are transient: connection, transaction rollback (deadlock,
+# serialization), insufficient resources, operator intervention (statement timeout, shutdown)
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+
+
+def http_status(error):
+    """HTTP status of a failed request if the error carries one (httpx/requests response or a numeric APIError code)."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    if isinstance(code, str) and len(code) == 3 and code.isdigit():
+        return int(code)
+    return None
+
+
+def is_rejection(error):
+    """
+    True if the server definitively rejected the rows (retrying the same rows fails again);
+    False for transient errors (network, timeouts, 5xx) that should just be retried.
+    """
+    status = http_status(error)
+    if status is not None:
+        return 400 <= status < 500 and status not in TRANSIENT_HTTP_STATUSES
+    code = getattr(error, "code", None)
+    if isinstance(code, str) and code:
+        if code.startswith("PGRST0"):
+            return False # PGRST000-003: PostgREST could not reach the database or timed out
+        return not code.startswith(TRANSIENT_SQLSTATE_CLASSES)
+    # postgrest.exceptions.APIError without a code (and the SQLite stand-in's APIError)
+    return type(error).__name__ == "APIError"
+
+
+class Outbox:
+    """SQLite-backed write queue with a background flusher (see module docstring)."""
+
+    def __init__(self, client_factory, db_path=DEFAULT_DB_PATH, batch_size=500, max_pending=50000,
+                 retry_base_seconds=2, retry_max_seconds=300, max_attempts=3, poll_interval=1.0,
+                 retention_seconds=7 * 24 * 3600):
+        self.client_factory = client_factory
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_attempts = max_attempts # Rejections of a single row before it is parked
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.sent_rows = 0
+        self.failed_batches = 0
+        self.failed_rows = 0 # Rows parked as failed during this run
+        self._transient_failures = 0 # Consecutive transient failures (backoff exponent)
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # Sent rows are kept for a while so re-enqueuing identical rows is a no-op
+        conn.execute("DELETE FROM outbox WHERE sent_at IS NOT NULL AND sent_at < ?",
+                     (time.time() - self.retention_seconds,))
+        conn.commit()
+
+    def _conn(self):
+        """One connection per thread; WAL lets the flusher read while stages append."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Producer side ---
+
+    def enqueue(self, table_name, rows, key_fields, op="upsert", on_conflict=None, match_on=None):
+        """
+        Appends rows for table_name. key_fields plus the row's column set identify a row
+        (idempotency key): enqueuing a row whose key is already pending replaces its payload,
+        and enqueuing a row identical to one already sent (or parked as failed) is a no-op. Partial-column rows for
+        the same key (e.g. counter updates) therefore never overwrite a pending full row.
+        op="update" changes existing rows only (UPDATE ... WHERE match_on columns equal the row's
+        values; the other columns are set), unlike a partial upsert, which Postgres checks against
+        the NOT NULL columns the row leaves out. match_on is stored where upserts keep on_conflict.
+        Blocks while the outbox holds max_pending unsent rows and the flusher is running
+        (backpressure). Returns the number of rows written.
+        """
+        if op not in SUPPORTED_OPS:
+            raise ValueError(f"Unsupported outbox operation: {op}")
+        if op == "update":
+            if not match_on:
+                raise ValueError("Outbox updates need match_on columns")
+            on_conflict = ",".join(match_on)
+        if not rows:
+            return 0
+
+        self._wait_for_capacity()
+        now = time.time()
+        values = []
+        for row in rows:
+            key = json.dumps([row.get(field) for field in key_fields], ensure_ascii=False, default=str)
+            columns = ",".join(sorted(row.keys()))
+            values.append((
+                f"{table_name}|{op}|{columns}|{key}",
+                table_name,
+                op,
+                on_conflict or "",
+                columns,
+                json.dumps(row, ensure_ascii=False, sort_keys=True, default=str),
+                now,
+            ))
+
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT INTO outbox (idem_key, table_name, op, on_conflict, columns, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (idem_key) DO UPDATE SET
+                    on_conflict = excluded.on_conflict,
+                    payload = excluded.payload,
+                    attempts = 0,
+                    next_attempt_at = 0,
+                    last_error = NULL,
+                    sent_at = NULL,
+                    failed_at = NULL
+                WHERE (outbox.sent_at IS NULL AND outbox.failed_at IS NULL) OR outbox.payload != excluded.payload
+            """, values)
+        self._wakeup.set()
+        return len(values)
+
+    def _wait_for_capacity(self):
+        while self.is_running() and self.pending_count() >= self.max_pending:
+            self._wakeup.set()
+            time.sleep(0.2)
+
+    def pending_count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND failed_at IS NULL").fetchone()[0]
+
+    def unsent_payloads(self, table_name):
+        """Payloads of table_name that have not reached Supabase (pending or parked as failed)."""
+        rows = self._conn().execute("SELECT payload FROM outbox WHERE table_name = ? AND sent_at IS NULL", (table_name,))
+        return [json.loads(row[0]) for row in rows]
+
+    def failed_count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM outbox WHERE failed_at IS NOT NULL").fetchone()[0]
+
+    def requeue_failed(self, table_name=None):
+        """Puts rows parked as failed back in the queue (e.g. after fixing the table). Returns the number of rows."""
+        conn = self._conn()
+        query = "UPDATE outbox SET failed_at = NULL, attempts = 0, next_attempt_at = 0, last_error = NULL WHERE failed_at IS NOT NULL"
+        params = ()
+        if table_name:
+            query += " AND table_name = ?"
+            params = (table_name,)
+        with conn:
+            requeued = conn.execute(query, params).rowcount
+        self._wakeup.set()
+        return requeued
+
+    # --- Flusher side ---
+
+    def _next_batch(self):
+        """
+        Oldest pending row plus up to batch_size-1 more rows that can share its request.
+        The oldest row gates the queue (nothing is sent while it waits for its retry), so
+        rows reach Supabase in the order they were enqueued, e.g. a new post before a later
+        counter update of the same post. A row that Supabase already rejected on its own is
+        retried alone, so it does not drag a full batch through another bisection.
+        """
+        conn = self._conn()
+        head = conn.execute("""
+            SELECT table_name, op, on_conflict, columns, next_attempt_at, attempts FROM outbox
+            WHERE sent_at IS NULL AND failed_at IS NULL
+            ORDER BY id LIMIT 1
+        """).fetchone()
+        if head is None or head[4] > time.time():
+            return None, []
+        limit = 1 if head[5] else self.batch_size
+        head = head[:4]
+        rows = conn.execute("""
+            SELECT id, payload, attempts FROM outbox
+            WHERE sent_at IS NULL AND failed_at IS NULL
+              AND table_name = ? AND op = ? AND on_conflict = ? AND columns = ?
+            ORDER BY id LIMIT ?
+        """, (*head, limit)).fetchall()
+        return head, rows
+
+    def _send(self, table_name, op, on_conflict, payloads):
+        if op == "update":
+            self._send_updates(table_name, on_conflict.split(","), payloads)
+            return
+        query = self.client_factory().table(table_name)
+        if op == "insert":
+            query = query.insert(payloads)
+        elif on_conflict:
+            query = query.upsert(payloads, on_conflict=on_conflict)
+        else:
+            query = query.upsert(payloads)
+        query.execute()
+
+    def _send_updates(self, table_name, match_on, payloads):
+        """
+        PostgREST has no bulk update, so rows that set the same values and agree on all but the
+        last match column share one request: UPDATE ... WHERE leading columns = ... AND last IN (...).
+        Rows with individual values (e.g. likes) take one request each.
+        """
+        groups = {}
+        for payload in payloads:
+            values = {column: value for column, value in payload.items() if column not in match_on}
+            leading = [payload.get(column) for column in match_on[:-1]]
+            group_key = json.dumps([values, leading], ensure_ascii=False, sort_keys=True, default=str)
+            groups.setdefault(group_key, (values, leading, []))[2].append(payload.get(match_on[-1]))
+        client = self.client_factory()
+        for values, leading, last_values in groups.values():
+            for i in range(0, len(last_values), UPDATE_IN_CHUNK):
+                query = client.table(table_name).update(values)
+                for column, value in zip(match_on, leading):
+                    query = query.eq(column, value)
+                chunk = last_values[i:i + UPDATE_IN_CHUNK]
+                query = query.eq(match_on[-1], chunk[0]) if len(chunk) == 1 else query.in_(match_on[-1], chunk)
+                query.execute()
+
+    def _backoff(self, exponent):
+        return min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (exponent - 1))
+
+    def _send_bisecting(self, head, rows):
+        """
+        Sends rows; if Supabase rejects them, sends each half separately until the rejected
+        rows are isolated. Returns the number of rows sent. Transient errors propagate.
+        """
+        table_name, op, on_conflict, _ = head
+        try:
+            self._send(table_name, op, on_conflict, [json.loads(row[1]) for row in rows])
+        except Exception as e:
+            if not is_rejection(e):
+                raise
+            if len(rows) > 1:
+                middle = len(rows) // 2
+                print(f"[outbox] {op} of {len(rows)} rows into '{table_name}' rejected, splitting the batch: {e}")
+                return self._send_bisecting(head, rows[:middle]) + self._send_bisecting(head, rows[middle:])
+            self._reject(head, rows[0], e)
+            return 0
+
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE outbox SET sent_at = ? WHERE id = ?", [(time.time(), row[0]) for row in rows])
+        self._transient_failures = 0
+        self.sent_rows += len(rows)
+        return len(rows)
+
+    def _reject(self, head, row, error):
+        """Counts a rejection of a single row; parks it after max_attempts, else retries it later."""
+        table_name, op, _, _ = head
+        row_id, _, attempts = row
+        attempts += 1
+        conn = self._conn()
+        if attempts >= self.max_attempts:
+            self.failed_rows += 1
+            print(f"[outbox] {op} of row {row_id} into '{table_name}' rejected {attempts} times, parking as failed: {error}")
+            with conn:
+                conn.execute("UPDATE outbox SET attempts = ?, failed_at = ?, last_error = ? WHERE id = ?",
+                             (attempts, time.time(), str(error)[:500], row_id))
+            return
+        delay = self._backoff(attempts)
+        print(f"[outbox] {op} of row {row_id} into '{table_name}' rejected (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+        with conn:
+            conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                         (attempts, time.time() + delay, str(error)[:500], row_id))
+
+    def flush_once(self):
+        """Sends one batch. Returns the number of rows sent (0 if nothing was due or it failed)."""
+        head, rows = self._next_batch()
+        if not rows:
+            return 0
+        table_name, op, _, _ = head
+        sent_before = self.sent_rows
+        try:
+            sent = self._send_bisecting(head, rows)
+        except Exception as e:
+            # Transient: back off without counting it against the rows
+            self.failed_batches += 1
+            self._transient_failures += 1
+            delay = self._backoff(self._transient_failures)
+            print(f"[outbox] {op} into '{table_name}' failed ({e}), retrying in {delay:.0f}s")
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE id = ? AND sent_at IS NULL",
+                    [(time.time() + delay, str(e)[:500], row[0]) for row in rows])
+            return self.sent_rows - sent_before
+        if sent:
+            print(f"[outbox] Sent {sent} rows to '{table_name}' ({op}). Pending: {self.pending_count()}")
+        return sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.flush_once()
+            except Exception as e:
+                print(f"[outbox] Flusher error: {e}")
+                sent = 0
+            if not sent:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        # The thread's connection is only used by this thread
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+
+    def start(self):
+        """Starts the background flusher (resuming any rows left pending by earlier runs)."""
+        if self.is_running():
+            return
+        pending = self.pending_count()
+        if pending:
+            print(f"[outbox] Resuming with {pending} pending rows from {self.db_path}")
+        failed = self.failed_count()
+        if failed:
+            print(f"[outbox] {failed} rows in {self.db_path} are parked as failed (see last_error; requeue_failed() retries them)")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def drain(self, timeout=None):
+        """Waits until nothing is pending. Returns True if drained, False on timeout."""
+        if not self.is_running():
+            self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending_count() > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.5)
+        return True
+
+    def close(self, drain=True, timeout=None):
+        """Optionally drains, then stops the flusher. Returns the number of rows still pending."""
+        if drain:
+            self.drain(timeout)
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        pending = self.pending_count()
+        if pending:
+            print(f"[outbox] {pending} rows still pending in {self.db_path}; they will be sent on the next run.")
+        if self.failed_rows:
+            print(f"[outbox] {self.failed_rows} rows were rejected and parked as failed in {self.db_path}.")
+        return pending
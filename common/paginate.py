@@ -0,0 +1,100 @@
+# common/paginate.py
+# Paginated readers for Supabase/PostgREST tables, shared by the DZDP, XHS and cleanup scripts.
+# Both readers are generators that yield one page (list of rows) at a time, so callers never
+# hold the whole table in memory:
+#   iter_pages()        exact count first, then range() pages fetched concurrently by a bounded
+#                       worker pool and yielded in order (needs a deterministic order).
+#   iter_pages_keyset() "key > last seen key" pages on a unique, indexed column. Stable while
+#                       rows are being updated or drop out of the filter (e.g. the labeling loop).
+# iter_rows() / iter_rows_keyset() flatten the pages.
+#
+# filters is an optional callable that adds filters to a query builder, e.g.
+#   iter_rows(supabase, "dzdpdata", "品牌", filters=lambda q: q.gte("create_date", since), order=["create_date", "品牌"])
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PAGE_SIZE = 1000 # Supabase default max rows per request
+DEFAULT_WORKERS = 4 # Concurrent page requests
+
+
+def _apply(query, filters):
+    return filters(query) if filters else query
+
+
+def count_rows(client, table_name, filters=None):
+    """Returns the exact number of rows matching filters."""
+    query = _apply(client.table(table_name).select("*", count="exact"), filters)
+    response = query.limit(1).execute()
+    return response.count or 0
+
+
+def _fetch_page(client, table_name, columns, filters, order, page, page_size):
+    query = _apply(client.table(table_name).select(columns), filters)
+    for column in order:
+        query = query.order(column)
+    start = page * page_size
+    return query.range(start, start + page_size - 1).execute().data or []
+
+
+def iter_pages(client, table_name, columns, filters=None, order=None, page_size=DEFAULT_PAGE_SIZE, workers=DEFAULT_WORKERS):
+    """
+    Yields pages of rows using offset pagination. The exact count decides how many pages are
+    requested up front; at most `workers` requests are in flight and pages are yielded in order.
+    order (column name or list of names) should make the ordering unique so pages don't overlap.
+    """
+    order = [order] if isinstance(order, str) else list(order or [])
+    total = count_rows(client, table_name, filters)
+    page_count = -(-total // page_size)
+
+    page = 0
+    last_page_size = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = []
+        while page < page_count or in_flight:
+            # Keep the pool busy without queueing more pages than it can run
+            while page < page_count and len(in_flight) < max(1, workers):
+                in_flight.append(executor.submit(_fetch_page, client, table_name, columns, filters, order, page, page_size))
+                page += 1
+            rows = in_flight.pop(0).result()
+            last_page_size = len(rows)
+            if rows:
+                yield rows
+
+    # Rows added after the count: continue sequentially until a short page
+    while page_count and last_page_size == page_size:
+        rows = _fetch_page(client, table_name, columns, filters, order, page, page_size)
+        last_page_size = len(rows)
+        page += 1
+        if rows:
+            yield rows
+
+
+def iter_pages_keyset(client, table_name, columns, key, filters=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yields pages of rows ordered by key, each page starting after the last key of the previous
+    one. key must be unique and is added to columns if missing.
+    """
+    selected = [c.strip() for c in columns.split(",")] if columns.strip() != "*" else ["*"]
+    if "*" not in selected and key not in selected:
+        selected.append(key)
+    last_key = None
+    while True:
+        query = _apply(client.table(table_name).select(", ".join(selected)), filters)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        rows = query.order(key).limit(page_size).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            break
+        last_key = rows[-1][key]
+
+
+def iter_rows(client, table_name, columns, filters=None, order=None, page_size=DEFAULT_PAGE_SIZE, workers=DEFAULT_WORKERS):
+    for rows in iter_pages(client, table_name, columns, filters, order, page_size, workers):
+        yield from rows
+
+
+def iter_rows_keyset(client, table_name, columns, key, filters=None, page_size=DEFAULT_PAGE_SIZE):
+    for rows in iter_pages_keyset(client, table_name, columns, key, filters, page_size):
+        yield from rows
@@ -0,0 +1,438 @@
+# common/sqlite_rest.py
+# SQLite-backed stand-in for the supabase-py client, for running the pipeline logic offline.
+# It implements the subset of the PostgREST query builder used in this repo:
+#   client.table(name).select(columns, count='exact') / insert / upsert / update / delete
+#   filters: eq, neq, gt, gte, lt, lte, in_, is_, like, ilike, not_, or_
+#   modifiers: order, limit, range, maybe_single, single
+#   client.rpc(name, params) for the SQL functions in sql/ (re-implemented in RPC_FUNCTIONS)
+# Responses have .data and .count like the real client. Lists and dicts are stored as JSON text.
+#
+# Usage (dzdp_crawler/clients.py does this when SUPABASE_URL starts with "sqlite:"):
+#   client = create_client("sqlite:///tmp/pipeline.db")
+#   client.table("brand").select("name").execute().data
+
+import re
+import json
+import sqlite3
+import threading
+
+# Tables used by the pipeline, mirroring the Supabase schema (see sql/)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dzdpdata (
+    "榜单" TEXT NOT NULL,
+    "排名" INTEGER,
+    "店铺名称" TEXT,
+    "品牌" TEXT NOT NULL,
+    "评分" REAL,
+    "位置" TEXT,
+    "细分榜单" TEXT,
+    "价格" REAL,
+    "城市" TEXT,
+    create_date TEXT NOT NULL,
+    last_seen_date TEXT,
+    PRIMARY KEY ("榜单", "品牌", create_date)
+);
+CREATE TABLE IF NOT EXISTS brand (
+    brand_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    name_key TEXT
+);
+CREATE TABLE IF NOT EXISTS posts (
+    post_id TEXT PRIMARY KEY,
+    likes INTEGER,
+    title TEXT,
+    author TEXT,
+    publish_date TEXT,
+    content TEXT,
+    images TEXT,
+    collections INTEGER,
+    comments INTEGER,
+    "is related" INTEGER
+);
+CREATE TABLE IF NOT EXISTS post_brand (
+    post_id TEXT NOT NULL,
+    brand_id INTEGER NOT NULL,
+    PRIMARY KEY (post_id, brand_id)
+);
+"""
+
+FILTER_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+
+
+class APIError(Exception):
+    """Raised for invalid queries, like postgrest.exceptions.APIError."""
+
+
+class APIResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def quote_identifier(name):
+    name = name.strip()
+    if name.startswith('"') and name.endswith('"'):
+        name = name[1:-1]
+    return '"' + name.replace('"', '""') + '"'
+
+
+def to_sql_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def from_sql_value(value):
+    if isinstance(value, str) and value[:1] in ("[", "{"):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def split_top_level(text):
+    """Splits a PostgREST logic string on commas that are not inside parentheses."""
+    parts = []
+    depth = 0
+    current = ""
+    for ch in text:
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += (ch == "(") - (ch == ")")
+        current += ch
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_logic(expression):
+    """
+    Translates a PostgREST or/and filter string (e.g. "a.eq.1,and(b.is.null,c.gte.2)")
+    into (sql, params).
+    """
+    expression = expression.strip()
+    match = re.fullmatch(r"(not\.)?(and|or)\((.*)\)", expression, re.S)
+    if match:
+        negate, joiner, inner = match.groups()
+        sql, params = combine([parse_logic(part) for part in split_top_level(inner)], joiner.upper())
+        return (f"NOT ({sql})" if negate else sql), params
+
+    column, rest = expression.split(".", 1)
+    negate = rest.startswith("not.")
+    if negate:
+        rest = rest[4:]
+    operator, value = rest.split(".", 1)
+    if operator == "in":
+        values = [v.strip().strip('"') for v in split_top_level(value.strip()[1:-1])]
+        sql, params = build_in(column, values)
+    elif operator == "is":
+        sql, params = build_is(column, value)
+    else:
+        sql, params = build_comparison(column, operator, value.replace("*", "%") if "like" in operator else value)
+    return (f"NOT ({sql})" if negate else sql), params
+
+
+def combine(clauses, joiner):
+    if not clauses:
+        return ("1=1" if joiner == "AND" else "1=0"), []
+    sql = f" {joiner} ".join(f"({clause[0]})" for clause in clauses)
+    params = [param for clause in clauses for param in clause[1]]
+    return sql, params
+
+
+def build_comparison(column, operator, value):
+    if operator not in FILTER_OPERATORS:
+        raise APIError(f"Unsupported filter operator: {operator}")
+    if operator == "ilike":
+        return f"LOWER({quote_identifier(column)}) LIKE LOWER(?)", [value]
+    return f"{quote_identifier(column)} {FILTER_OPERATORS[operator]} ?", [to_sql_value(value)]
+
+
+def build_in(column, values):
+    values = list(values)
+    if not values:
+        return "1=0", []
+    return f"{quote_identifier(column)} IN ({', '.join('?' for _ in values)})", [to_sql_value(v) for v in values]
+
+
+def build_is(column, value):
+    value = str(value).lower() if value is not None else "null"
+    if value not in ("null", "true", "false"):
+        raise APIError(f"Unsupported is_ value: {value}")
+    keyword = {"null": "NULL", "true": "1", "false": "0"}[value]
+    return (f"{quote_identifier(column)} IS {keyword}" if keyword == "NULL" else f"{quote_identifier(column)} = {keyword}"), []
+
+
+class QueryBuilder:
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.mode = None
+        self.columns = "*"
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.filters = []
+        self.orders = []
+        self.limit_value = None
+        self.offset_value = None
+        self.single_mode = None
+        self._negate_next = False
+
+    # --- Operations ---
+
+    def select(self, columns="*", count=None):
+        self.mode = "select"
+        self.columns = columns
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.mode = "insert"
+        self.payload = rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.mode = "upsert"
+        self.payload = rows
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.mode = "update"
+        self.payload = values
+        return self
+
+    def delete(self):
+        self.mode = "delete"
+        return self
+
+    # --- Filters ---
+
+    def _add_filter(self, clause):
+        sql, params = clause
+        if self._negate_next:
+            sql = f"NOT ({sql})"
+            self._negate_next = False
+        self.filters.append((sql, params))
+        return self
+
+    @property
+    def not_(self):
+        self._negate_next = True
+        return self
+
+    def eq(self, column, value):
+        return self._add_filter(build_comparison(column, "eq", value))
+
+    def neq(self, column, value):
+        return self._add_filter(build_comparison(column, "neq", value))
+
+    def gt(self, column, value):
+        return self._add_filter(build_comparison(column, "gt", value))
+
+    def gte(self, column, value):
+        return self._add_filter(build_comparison(column, "gte", value))
+
+    def lt(self, column, value):
+        return self._add_filter(build_comparison(column, "lt", value))
+
+    def lte(self, column, value):
+        return self._add_filter(build_comparison(column, "lte", value))
+
+    def like(self, column, pattern):
+        return self._add_filter(build_comparison(column, "like", pattern.replace("*", "%")))
+
+    def ilike(self, column, pattern):
+        return self._add_filter(build_comparison(column, "ilike", pattern.replace("*", "%")))
+
+    def in_(self, column, values):
+        return self._add_filter(build_in(column, values))
+
+    def is_(self, column, value):
+        return self._add_filter(build_is(column, value))
+
+    def or_(self, filters):
+        return self._add_filter(parse_logic(f"or({filters})"))
+
+    # --- Modifiers ---
+
+    def order(self, column, desc=False):
+        self.orders.append(f"{quote_identifier(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size):
+        self.limit_value = size
+        return self
+
+    def range(self, start, end):
+        self.offset_value = start
+        self.limit_value = end - start + 1
+        return self
+
+    def maybe_single(self):
+        self.single_mode = "maybe"
+        return self
+
+    def single(self):
+        self.single_mode = "single"
+        return self
+
+    # --- Execution ---
+
+    def _where(self):
+        sql, params = combine(self.filters, "AND")
+        return f" WHERE {sql}" if self.filters else "", params
+
+    def _select_columns(self):
+        if self.columns.strip() == "*":
+            return "*"
+        return ", ".join(quote_identifier(c) for c in split_top_level(self.columns))
+
+    def execute(self):
+        with self.client.lock:
+            conn = self.client.conn
+            try:
+                with conn:
+                    if self.mode == "select":
+                        response = self._execute_select(conn)
+                    elif self.mode in ("insert", "upsert"):
+                        response = self._execute_write(conn)
+                    elif self.mode == "update":
+                        response = self._execute_update(conn)
+                    elif self.mode == "delete":
+                        response = self._execute_delete(conn)
+                    else:
+                        raise APIError("No operation (select/insert/upsert/update/delete) was specified")
+            except sqlite3.Error as e:
+                raise APIError(str(e)) from e
+
+        if self.single_mode:
+            if len(response.data) > 1 or (self.single_mode == "single" and not response.data):
+                raise APIError(f"Expected a single row, got {len(response.data)}")
+            return APIResponse(response.data[0] if response.data else None, response.count)
+        return response
+
+    def _rows(self, cursor):
+        names = [d[0] for d in cursor.description]
+        return [{name: from_sql_value(value) for name, value in zip(names, row)} for row in cursor.fetchall()]
+
+    def _execute_select(self, conn):
+        where, params = self._where()
+        count = None
+        if self.count:
+            count = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(self.table_name)}{where}", params).fetchone()[0]
+        sql = f"SELECT {self._select_columns()} FROM {quote_identifier(self.table_name)}{where}"
+        if self.orders:
+            sql += " ORDER BY " + ", ".join(self.orders)
+        if self.limit_value is not None or self.offset_value is not None:
+            sql += f" LIMIT {int(self.limit_value if self.limit_value is not None else -1)} OFFSET {int(self.offset_value or 0)}"
+        return APIResponse(self._rows(conn.execute(sql, params)), count)
+
+    def _conflict_target(self, conn):
+        if self.on_conflict:
+            return [c.strip() for c in self.on_conflict.split(",")]
+        info = conn.execute(f"PRAGMA table_info({quote_identifier(self.table_name)})").fetchall()
+        return [row[1] for row in sorted(info, key=lambda r: r[5]) if row[5] > 0]
+
+    def _execute_write(self, conn):
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        target = self._conflict_target(conn) if self.mode == "upsert" else []
+        written = []
+        for row in rows:
+            columns = list(row.keys())
+            sql = (f"INSERT INTO {quote_identifier(self.table_name)} ({', '.join(quote_identifier(c) for c in columns)}) "
+                   f"VALUES ({', '.join('?' for _ in columns)})")
+            if self.mode == "upsert":
+                updates = [c for c in columns if c not in target]
+                conflict = f" ON CONFLICT ({', '.join(quote_identifier(c) for c in target)})"
+                if self.ignore_duplicates or not updates:
+                    sql += conflict + " DO NOTHING"
+                else:
+                    sql += conflict + " DO UPDATE SET " + ", ".join(f"{quote_identifier(c)} = excluded.{quote_identifier(c)}" for c in updates)
+            cursor = conn.execute(sql + " RETURNING *", [to_sql_value(row[c]) for c in columns])
+            written.extend(self._rows(cursor))
+        return APIResponse(written)
+
+    def _execute_update(self, conn):
+        where, params = self._where()
+        columns = list(self.payload.keys())
+        sql = (f"UPDATE {quote_identifier(self.table_name)} SET "
+               + ", ".join(f"{quote_identifier(c)} = ?" for c in columns) + where + " RETURNING *")
+        return APIResponse(self._rows(conn.execute(sql, [to_sql_value(self.payload[c]) for c in columns] + params)))
+
+    def _execute_delete(self, conn):
+        where, params = self._where()
+        return APIResponse(self._rows(conn.execute(f"DELETE FROM {quote_identifier(self.table_name)}{where} RETURNING *", params)))
+
+
+class RPCBuilder:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params or {}
+
+    def execute(self):
+        function = RPC_FUNCTIONS.get(self.name)
+        if function is None:
+            raise APIError(f"Could not find the function public.{self.name}")
+        with self.client.lock:
+            with self.client.conn:
+                return APIResponse(function(self.client.conn, **self.params))
+
+
+# --- SQL functions from sql/, re-implemented for SQLite ---
+
+MISSING_BRAND_NAMES_SQL = """
+    SELECT DISTINCT d."品牌" AS name
+    FROM dzdpdata d
+    WHERE d."品牌" IS NOT NULL AND TRIM(d."品牌") <> ''
+      AND (:since IS NULL OR d.create_date >= :since)
+      AND NOT EXISTS (SELECT 1 FROM brand b WHERE b.name = d."品牌")
+"""
+
+
+def rpc_missing_brand_names(conn, since=None):
+    return [{"name": row[0]} for row in conn.execute(MISSING_BRAND_NAMES_SQL, {"since": since})]
+
+
+RPC_FUNCTIONS = {
+    "missing_brand_names": rpc_missing_brand_names,
+}
+
+
+class SQLiteClient:
+    """Drop-in for supabase.Client backed by one SQLite database file."""
+
+    def __init__(self, db_path, schema=SCHEMA):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        if db_path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        if schema:
+            self.conn.executescript(schema)
+
+    def table(self, table_name):
+        return QueryBuilder(self, table_name)
+
+    def from_(self, table_name):
+        return self.table(table_name)
+
+    def rpc(self, name, params=None):
+        return RPCBuilder(self, name, params)
+
+
+def create_client(url, key=None):
+    """Creates a client from "sqlite:///path/to/file.db", "sqlite:path" or "sqlite::memory:"."""
+    if not url.startswith("sqlite:"):
+        raise ValueError(f"Not a sqlite URL: {url}")
+    path = url[len("sqlite:"):]
+    if path.startswith("//"):
+        path = path[2:]
+    return SQLiteClient(path or ":memory:")
@@ -1,52 +1,14 @@
 import os
 import json
-import google.generativeai as genai
 from PIL import Image
-from dotenv import load_dotenv, find_dotenv
 import sys
 import time
 import re
+import math
+import unicodedata
+import clients
 
-# Load environment variables from the root .env file
-script_dir = os.path.dirname(__file__)  # Get the directory containing analyzer.py
-dotenv_path = os.path.join(script_dir, '..', '.env') # Go up one level to the root directory
-load_dotenv(dotenv_path=dotenv_path) # Load the environment variables
-
-# Get the Gemini API key from the root .env file
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
-    # Add instructions on where the .env file should be
-    raise ValueError("GEMINI_API_KEY not found in environment variables. Ensure a .env file exists in the dzdp_crawler directory with this key.")
-
-# 清理API密钥（移除可能的空格或换行符）
-gemini_api_key = gemini_api_key.strip()
-
-# 配置Gemini API
-try:
-    # 使用正确的SDK接口
-    genai.configure(api_key=gemini_api_key)
-    
-    # 尝试简单调用测试连接
-    models = genai.list_models()
-    print("成功连接到Gemini API")
-except Exception as e:
-    print(f"连接Gemini API失败: {e}")
-    print("请检查API密钥是否正确，或尝试重新生成API密钥")
-    sys.exit(1)
-
-# 使用Gemini 2.0 Flash-Lite模型
-try:
-    model = genai.GenerativeModel('gemini-2.0-flash-lite')
-    print(f"成功加载模型 gemini-2.0-flash-lite")
-except Exception as e:
-    print(f"加载模型失败: {e}")
-    print("尝试使用备用模型...")
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        print("成功加载备用模型 gemini-1.5-flash")
-    except Exception as e2:
-        print(f"加载备用模型也失败: {e2}")
-        sys.exit(1)
+# Gemini客户端在第一次使用时由 clients.py 创建（导入本模块不会连接网络）
 
 # 分析提示词
 PROMPT = """帮我识别这些店铺所在的榜单（一个橙色高亮的文字。一般在"大众点评榜单"的正下方的栏目里面，以菜系或者食物种类命名），
@@ -59,27 +21,33 @@ PROMPT = """帮我识别这些店铺所在的榜单（一个橙色高亮的文
 价格（在"¥"后面，"人"之前，储存为int）。
 以json数组的形式返回给我。"""
 
+# 发送前将截图缩放到的最长边像素（None表示发送原图）
+MAX_IMAGE_SIDE = None
+
+# 模型路由：先用快速、便宜的模型；结果校验不通过的文件夹才升级到更强的模型
+MODEL_ROUTE = [clients.PRIMARY_MODEL, "gemini-2.0-flash"]
+
+# 每个模型的使用统计: {模型: {"requests", "failed_requests", "folders", "accepted", "latencies", "retry_sleep_s"}}
+# latencies 只包含模型调用本身的耗时，重试前的等待时间单独累计在 retry_sleep_s 中
+MODEL_STATS = {}
+
+# 每类榜单保留的条数
+MAIN_RANKING_LIMIT = 30
+CATEGORY_RANKING_LIMIT = 10
+
 # 自然排序函数
 def natural_sort_key(s):
     """提取数字用于自然排序"""
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
-def process_folder(folder_path):
-    """处理文件夹中的所有图片并一次性发送到Gemini API"""
-    # 检查文件夹是否存在
-    if not os.path.exists(folder_path):
-        print(f"文件夹不存在: {folder_path}")
-        return []
-    
-    # 获取文件夹中的所有图片文件
+def list_image_files(folder_path):
+    """按截图序号返回文件夹中的图片文件名"""
     image_files = [f for f in os.listdir(folder_path) if f.endswith('.png') or f.endswith('.jpg')]
     image_files.sort(key=lambda x: int(x.split('.')[0]) if x.split('.')[0].isdigit() else -1)
-    
-    if not image_files:
-        print(f"文件夹中没有图片: {folder_path}")
-        return []
-    
-    # 加载所有图片
+    return image_files
+
+def load_images(folder_path, image_files):
+    """加载并校验图片，返回成功加载的图片对象列表"""
     images = []
     for image_file in image_files:
         image_path = os.path.join(folder_path, image_file)
@@ -93,14 +61,38 @@ def process_folder(folder_path):
             print(f"已加载图片: {image_path}")
         except Exception as e:
             print(f"加载图片 {image_path} 时出错: {e}")
-    
-    if not images:
-        print("没有成功加载任何图片")
-        return []
-    
+    return images
+
+def resize_images(images, max_side):
+    """按最长边缩放图片（max_side为空时原样返回），用于比较不同图片尺寸的识别效果"""
+    if not max_side:
+        return images
+    resized = []
+    for img in images:
+        if max(img.size) > max_side:
+            img = img.copy()
+            img.thumbnail((max_side, max_side))
+        resized.append(img)
+    return resized
+
+def get_model_stats(model_name):
+    """返回（必要时创建）模型的使用统计"""
+    return MODEL_STATS.setdefault(model_name or clients.PRIMARY_MODEL, {
+        "requests": 0, "failed_requests": 0, "folders": 0, "accepted": 0, "latencies": [], "retry_sleep_s": 0.0,
+    })
+
+def retry_sleep(stats, seconds):
+    """重试前等待，并把等待时间计入模型统计（不计入请求延迟）"""
+    print(f"等待{seconds}秒后重试...")
+    stats["retry_sleep_s"] += seconds
+    time.sleep(seconds)
+
+def request_analysis_text(images, model_name=None):
+    """将一组图片一次性发送到Gemini API，返回原始响应文本（失败返回None）"""
+    stats = get_model_stats(model_name)
     # 构建请求内容
     content_parts = [PROMPT]
-    content_parts.extend(images)
+    content_parts.extend(resize_images(images, MAX_IMAGE_SIDE))
     
     # 重试机制
     max_retries = 3
@@ -110,27 +102,59 @@ def process_folder(folder_path):
             print(f"正在发送 {len(images)} 张图片到Gemini API进行分析... (尝试 {attempt+1}/{max_retries})")
             
             # 使用正确的API调用方式
-            response = model.generate_content(content_parts)
+            stats["requests"] += 1
+            start_time = time.perf_counter()
+            response = clients.get_gemini_model(model_name).generate_content(content_parts)
+            stats["latencies"].append(time.perf_counter() - start_time)
             
             # 检查响应是否有效
             if response.text and len(response.text) > 0:
                 print("分析完成，正在处理结果...")
-                return extract_json_from_response(response.text)
+                return response.text
             else:
                 print(f"API返回空响应 (尝试 {attempt+1}/{max_retries})")
                 if attempt < max_retries - 1:
-                    print("等待2秒后重试...")
-                    time.sleep(2)
+                    retry_sleep(stats, 2)
                     continue
         except Exception as e:
             print(f"API调用出错 (尝试 {attempt+1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
-                print("等待3秒后重试...")
-                time.sleep(3)
+                retry_sleep(stats, 3)
                 continue
     
+    stats["failed_requests"] += 1
     print(f"在 {max_retries} 次尝试后仍无法成功调用API，跳过当前文件夹")
-    return []
+    return None
+
+def analyze_images(images, model_name=None):
+    """将一组图片发送到Gemini API，返回解析后的记录列表"""
+    response_text = request_analysis_text(images, model_name)
+    if not response_text:
+        return []
+    return extract_json_from_response(response_text)
+
+def process_folder(folder_path, model_name=None):
+    """处理文件夹中的所有图片并一次性发送到Gemini API"""
+    # 检查文件夹是否存在
+    if not os.path.exists(folder_path):
+        print(f"文件夹不存在: {folder_path}")
+        return []
+    
+    # 获取文件夹中的所有图片文件
+    image_files = list_image_files(folder_path)
+    
+    if not image_files:
+        print(f"文件夹中没有图片: {folder_path}")
+        return []
+    
+    # 加载所有图片
+    images = load_images(folder_path, image_files)
+    
+    if not images:
+        print("没有成功加载任何图片")
+        return []
+    
+    return analyze_images(images, model_name)
 
 def extract_json_from_response(response_text):
     """从Gemini的响应中提取JSON数据"""
@@ -163,6 +187,204 @@ def determine_json_filename(data):
     
     return f"{banner_name}.json"
 
+def get_rank_limit(ranking_type):
+    """返回榜单需要保留的条数（主榜单30条，细分榜单10条），未知类型返回None"""
+    if ranking_type == "主榜单":
+        return MAIN_RANKING_LIMIT
+    if ranking_type.startswith("细分榜单"):
+        return CATEGORY_RANKING_LIMIT
+    return None
+
+def parse_rank(record):
+    """将记录中的排名转换为int，无法解析时返回None"""
+    try:
+        return int(str(record.get("排名", "")).strip())
+    except (TypeError, ValueError):
+        return None
+
+def normalize_shop_name(name):
+    """归一化店铺名称，用于识别相邻截图重叠产生的重复店铺"""
+    if not name:
+        return ""
+    # 全角/半角统一，并去掉所有空白
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', str(name))).lower()
+
+def merge_records(records):
+    """
+    合并多张截图识别出的记录:
+    - 按 (排名, 归一化店铺名称) 去重，保留第一次出现的记录
+    - 按排名排序，排名无法解析的记录放在最后
+    """
+    merged = []
+    seen_keys = set()
+    duplicate_count = 0
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        key = (parse_rank(record), normalize_shop_name(record.get("店铺名称")))
+        if key in seen_keys:
+            duplicate_count += 1
+            continue
+        seen_keys.add(key)
+        merged.append(record)
+
+    if duplicate_count > 0:
+        print(f"已合并 {duplicate_count} 条重复记录（截图重叠）")
+
+    # sort是稳定的，同一排名的记录保持原有顺序
+    merged.sort(key=lambda r: (parse_rank(r) is None, parse_rank(r) or 0))
+    return merged
+
+def find_rank_gaps(records, limit):
+    """返回 1..limit 中缺失的排名"""
+    present = {parse_rank(r) for r in records}
+    return [rank for rank in range(1, limit + 1) if rank not in present]
+
+def screenshots_for_ranks(image_files, records, missing_ranks):
+    """
+    估算覆盖缺失排名的截图。
+    截图按顺序覆盖连续的排名，按已识别的最大排名平均分配到每张截图上；
+    相邻截图存在重叠，所以同时包含估算位置的下一张截图。
+    """
+    if not image_files or not missing_ranks:
+        return []
+    known_ranks = [rank for rank in (parse_rank(r) for r in records) if rank is not None]
+    max_rank = max(known_ranks + list(missing_ranks))
+    ranks_per_image = max(1, math.ceil(max_rank / len(image_files)))
+
+    selected = set()
+    for rank in missing_ranks:
+        index = min(len(image_files) - 1, (rank - 1) // ranks_per_image)
+        selected.add(index)
+        if index + 1 < len(image_files):
+            selected.add(index + 1)
+    return [image_files[i] for i in sorted(selected)]
+
+def repair_rank_gaps(folder_path, records, ranking_type, model_name=None):
+    """
+    合并记录并修复排名缺口:
+    只重新分析覆盖缺失排名的截图（每张单独发送），而不是整个文件夹。
+    """
+    records = merge_records(records)
+    limit = get_rank_limit(ranking_type)
+    if not limit or not records:
+        return records
+
+    missing_ranks = find_rank_gaps(records, limit)
+    if not missing_ranks:
+        return records
+
+    print(f"{ranking_type} 缺失排名: {missing_ranks}")
+    image_files = screenshots_for_ranks(list_image_files(folder_path), records, missing_ranks)
+    print(f"重新分析覆盖缺失排名的截图: {image_files}")
+
+    for image_file in image_files:
+        images = load_images(folder_path, [image_file])
+        if not images:
+            continue
+        # 只补充缺失排名的记录，已有排名保持不变
+        recovered = [r for r in analyze_images(images, model_name) if isinstance(r, dict) and parse_rank(r) in missing_ranks]
+        if recovered:
+            records = merge_records(records + recovered)
+            missing_ranks = find_rank_gaps(records, limit)
+            print(f"从 {image_file} 补充了 {len(recovered)} 条记录，剩余缺失排名: {missing_ranks}")
+        if not missing_ranks:
+            break
+
+    if missing_ranks:
+        print(f"警告: 重新分析后仍缺失排名: {missing_ranks}")
+    return records
+
+def is_finite_number(value):
+    """值能转换为有限数字时返回 True（模型返回的 "inf"、"nan" 也算不是数字）"""
+    try:
+        return math.isfinite(float(str(value if value is not None else "").strip()))
+    except (ValueError, OverflowError):
+        return False
+
+def validate_records(records, ranking_type):
+    """
+    校验将被保存的记录，返回问题列表（空列表表示通过）:
+    - 排名连续（1..N 无缺口）
+    - 评分、价格为数字
+    - 品牌非空
+    """
+    if not records:
+        return ["没有识别出任何记录"]
+
+    limit = get_rank_limit(ranking_type)
+    kept = records[:limit] if limit else records
+    issues = []
+
+    # 只检查已识别排名范围内的缺口，榜单本身不足N条时不算错误
+    known_ranks = [rank for rank in (parse_rank(r) for r in kept) if rank is not None]
+    max_rank = max(known_ranks) if known_ranks else 0
+    missing_ranks = find_rank_gaps(kept, min(limit, max_rank) if limit else max_rank)
+    if missing_ranks:
+        issues.append(f"排名不连续，缺失: {missing_ranks}")
+
+    for record in kept:
+        label = f"排名 {record.get('排名')} {record.get('店铺名称', '')}"
+        if not is_finite_number(record.get("评分")):
+            issues.append(f"{label}: 评分不是数字 ({record.get('评分')!r})")
+        if not is_finite_number(record.get("价格")):
+            issues.append(f"{label}: 价格不是数字 ({record.get('价格')!r})")
+        if not str(record.get("品牌") or "").strip():
+            issues.append(f"{label}: 品牌为空")
+    return issues
+
+def analyze_folder(folder_path, ranking_type):
+    """
+    按 MODEL_ROUTE 分析一个榜单文件夹:
+    先用最快的模型，结果校验不通过时才用下一个（更强的）模型重新分析这个文件夹。
+    所有模型都不通过时，返回问题最少的结果。
+    """
+    best_records, best_issues = [], None
+    for model_name in MODEL_ROUTE:
+        stats = get_model_stats(model_name)
+        stats["folders"] += 1
+        print(f"使用模型 {model_name} 分析: {folder_path}")
+
+        records = process_folder(folder_path, model_name)
+        records = repair_rank_gaps(folder_path, records, ranking_type, model_name)
+        issues = validate_records(records, ranking_type)
+
+        if best_issues is None or len(issues) < len(best_issues):
+            best_records, best_issues = records, issues
+        if not issues:
+            stats["accepted"] += 1
+            return records
+
+        print(f"模型 {model_name} 的结果未通过校验 ({len(issues)} 个问题):")
+        for issue in issues[:5]:
+            print(f"  - {issue}")
+
+    print(f"警告: 所有模型的结果都未通过校验，保留问题最少的结果 ({len(best_issues)} 个问题)")
+    return best_records
+
+def print_model_stats():
+    """打印每个模型的使用次数、通过率和请求延迟"""
+    if not MODEL_STATS:
+        return
+    print("\n===== 模型使用统计 =====")
+    for model_name, stats in MODEL_STATS.items():
+        latencies = sorted(stats["latencies"])
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            latency_str = f"平均 {sum(latencies) / len(latencies):.2f}s, p50 {p50:.2f}s, 最大 {latencies[-1]:.2f}s"
+        else:
+            latency_str = "无成功请求"
+        print(f"{model_name}: 分析文件夹 {stats['folders']} 个, 通过校验 {stats['accepted']} 个, "
+              f"请求 {stats['requests']} 次 (失败 {stats['failed_requests']} 次), 延迟: {latency_str}, "
+              f"重试等待 {stats['retry_sleep_s']:.0f}s")
+
+def records_to_save(data, ranking_type):
+    """save_results 实际写入的记录：去重、按排名排序后按榜单类型截断"""
+    # 截断前先去重并按排名排序，避免重复店铺挤掉真实排名
+    data = merge_records(data)
+    limit = get_rank_limit(ranking_type)
+    return data[:limit] if limit else data
+
 def save_results(data, output_folder, ranking_type):
     """保存JSON结果到文件"""
     if not data:
@@ -170,12 +392,10 @@ def save_results(data, output_folder, ranking_type):
         return
 
     # Filter data based on ranking type
-    if ranking_type == "主榜单":
-        data = data[:30]
-        print(f"已筛选主榜单数据，保留前 30 条")
-    elif ranking_type.startswith("细分榜单"):
-        data = data[:10]
-        print(f"已筛选 {ranking_type} 数据，保留前 10 条")
+    data = records_to_save(data, ranking_type)
+    limit = get_rank_limit(ranking_type)
+    if limit:
+        print(f"已筛选 {ranking_type} 数据，保留前 {limit} 条")
 
     # 创建输出文件夹（如果不存在）
     if not os.path.exists(output_folder):
@@ -214,7 +434,7 @@ def process_folder_for_analysis(input_folder):
     main_ranking_folder = os.path.join(input_folder, "主榜单")
     if os.path.exists(main_ranking_folder):
         print(f"\nProcessing Main Ranking: {main_ranking_folder}")
-        main_ranking_results = process_folder(main_ranking_folder) # process_folder calls Gemini
+        main_ranking_results = analyze_folder(main_ranking_folder, "主榜单") # calls Gemini, escalating models if needed
         save_results(main_ranking_results, city_output_folder, "主榜单")
         folder_count += 1
     else:
@@ -237,7 +457,7 @@ def process_folder_for_analysis(input_folder):
     for item in subdirectories:
         item_path = os.path.join(input_folder, item)
         print(f"\nProcessing Category Ranking: {item_path}")
-        category_results = process_folder(item_path) # process_folder calls Gemini
+        category_results = analyze_folder(item_path, item) # calls Gemini, escalating models if needed
         # Pass item name (e.g., "细分榜单1") to save_results to determine filename
         save_results(category_results, city_output_folder, item)
         folder_count += 1
@@ -248,6 +468,9 @@ def process_folder_for_analysis(input_folder):
 def main():
     # Reverted by AI: Look for directories in the same level as the script
     print("Starting Dianping Screenshot Analyzer...")
+    if not clients.require_healthy(["gemini"]):
+        print("请检查API密钥是否正确，或尝试重新生成API密钥")
+        sys.exit(1)
     script_dir = os.path.dirname(__file__)
     screenshot_root = os.path.join(script_dir, "搜索结果截图") # Use current dir
     analysis_root = os.path.join(script_dir, "分析结果文件")    # Use current dir
@@ -287,6 +510,7 @@ def main():
         process_folder_for_analysis(city_folder_path)
         total_processed += 1
     
+    print_model_stats()
     print(f"\n===== Analysis Complete. Processed {total_processed} city folders. =====")
     print(f"JSON results saved in subdirectories under '{analysis_root}'.")
 
@@ -2,32 +2,53 @@ import os
 import json
 import sys
 import re
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import math
+import time
+import argparse
 import traceback
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+import clients
 
-# Load environment variables from the root .env file
-script_dir = os.path.dirname(__file__)
-dotenv_path = os.path.join(script_dir, '..', '.env')
-load_dotenv(dotenv_path=dotenv_path)
+# Shared modules live in the project-root common/ directory
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+from common.outbox import Outbox
+from common.paginate import iter_rows
+from common.brand_names import display_name
 
-# Get Supabase credentials from the root .env file
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-
-# 检查API密钥是否存在
-if not supabase_url or not supabase_key:
-    print("错误: 未找到Supabase凭据。请在 .env 文件中添加 SUPABASE_URL 和 SUPABASE_KEY (文件应位于 dzdp_crawler 目录中)")
-    sys.exit(1)
-
-# Initialize Supabase client
-supabase: Client = create_client(supabase_url, supabase_key)
+# The Supabase client is created lazily by clients.py on first upload
+# (importing this module has no side effects).
+# By default records are written through the durable local outbox (common/outbox.py):
+# they are appended to SQLite first and flushed in the background, so a network drop
+# never loses rows and rerunning the script resumes the pending flush.
+# Uploads are diff-based (see sql/001_dzdpdata_last_seen_date.sql): each city's new ranking rows
+# are compared with that city's previous snapshot, loaded once. Only new or changed
+# (城市, 榜单, 排名, 品牌) entries are written as full rows; unchanged entries only extend
+# last_seen_date of the existing row. --full writes every row as before.
 
 # Required fields that must be present in each record
 REQUIRED_FIELDS = ["榜单", "品牌"]
 
+# Bulk upsert settings: records from all city folders are upserted once, in bounded chunks
+UPSERT_CHUNK_ROWS = 500 # Max records per upsert request
+UPSERT_CHUNK_BYTES = 1024 * 1024 # Max approximate JSON payload per request (1 MiB)
+UPSERT_WORKERS = 1 # Chunks submitted in parallel (1 = sequential)
+UPSERT_MAX_RETRIES = 3 # Attempts per chunk
+UPSERT_RETRY_BASE_SECONDS = 2 # Backoff before retry n is base * 2^(n-1)
+OUTBOX_DRAIN_TIMEOUT = 600 # Seconds to wait for the outbox to flush before exiting
+OUTBOX_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox.sqlite3") # Not shared with other scripts
+
+# Diff-based upload settings
+SNAPSHOT_PAGE_SIZE = 1000 # Rows per request when loading a city's previous snapshot
+DIFF_IGNORED_FIELDS = {"create_date", "last_seen_date"} # Fields that never make a row "changed"
+# Markers are UPDATEs keyed on the primary key; the last column becomes an IN filter, so all markers
+# of one ranking and create_date are a single request
+MARKER_MATCH_COLUMNS = ["榜单", "create_date", "品牌"]
+MARKER_BRANDS_PER_REQUEST = 200 # Brands per "品牌 in (...)" filter (keeps request URLs short)
+
 def extract_city_from_path(file_path):
     """从文件路径中提取城市名称"""
     # 解析文件路径获取目录名
@@ -47,26 +68,18 @@ def extract_city_from_path(file_path):
 def rename_brand_name(records):
     """
     重置品牌名的值，基于店铺名称更准确地提取品牌
-    - 如果店铺名称包含"·"、"（"或"("，则品牌名为这些字符前面的部分
-    - 如果不包含这些字符，则品牌名等于店铺名称
+    - 使用共享的品牌名规范化 (common/brand_names.py): 全角转半角、去掉"·"、"（"、"("等分店后缀、解析别名
+    - 没有店铺名称时，规范化已有的品牌名
     """
     renamed_count = 0
     for record in records:
-        if "店铺名称" in record:
-            shop_name = record["店铺名称"]
+        source = record.get("店铺名称") or record.get("品牌")
+        if source:
             old_brand = record.get("品牌", "")
-            
-            # 尝试提取品牌名
-            new_brand = shop_name
-            
-            # 检查是否包含分隔符并提取前面部分
-            for delimiter in ["·", "（", "("]:
-                if delimiter in shop_name:
-                    new_brand = shop_name.split(delimiter)[0].strip()
-                    break
+            new_brand = display_name(source)
             
             # 更新品牌名（如果有变化）
-            if new_brand != old_brand:
+            if new_brand and new_brand != old_brand:
                 record["品牌"] = new_brand
                 renamed_count += 1
                 print(f"  更新品牌: '{old_brand}' → '{new_brand}'")
@@ -195,17 +208,46 @@ def process_json_file(file_path):
     
     return data
 
+def dedupe_records(records):
+    """
+    Dedupes records from all files/cities on the table key (榜单, 品牌, create_date).
+    The last record wins, matching what sequential per-file upserts used to leave in the table;
+    a single upsert statement must not contain the same key twice.
+    """
+    deduped = {}
+    for record in records:
+        deduped[(record["榜单"], record["品牌"], record["create_date"])] = record
+    duplicate_count = len(records) - len(deduped)
+    if duplicate_count > 0:
+        print(f"Dropped {duplicate_count} records sharing a (榜单, 品牌, create_date) key with a later record.")
+    return list(deduped.values())
+
+def chunk_records(records, max_rows=None, max_bytes=None):
+    """Splits records into chunks bounded by row count and by approximate JSON payload size."""
+    max_rows = max_rows or UPSERT_CHUNK_ROWS
+    max_bytes = max_bytes or UPSERT_CHUNK_BYTES
+    chunks = []
+    current = []
+    current_bytes = 0
+    for record in records:
+        record_bytes = len(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        if current and (len(current) >= max_rows or current_bytes + record_bytes > max_bytes):
+            chunks.append(current)
+            current = []
+            current_bytes = 0
+        current.append(record)
+        current_bytes += record_bytes
+    if current:
+        chunks.append(current)
+    return chunks
+
 def upload_to_supabase(data):
     try:
         # Validate data before uploading
         validate_data(data)
         
-        # Print first record for debugging
-        if data:
-            print(f"Sample record: {json.dumps(data[0], ensure_ascii=False)}")
-        
         # Upload data to Supabase - use lowercase table name
-        result = supabase.table("dzdpdata").upsert(data).execute()
+        result = clients.get_supabase_client().table("dzdpdata").upsert(data).execute()
         return result
     except Exception as e:
         # Capture and re-raise with more details
@@ -214,14 +256,52 @@ def upload_to_supabase(data):
         traceback.print_exc()  # Print the full stack trace
         raise Exception(error_details)
 
+def upload_chunk(chunk, chunk_number, total_chunks):
+    """Upserts one chunk, retrying with exponential backoff. Returns True on success."""
+    for attempt in range(1, UPSERT_MAX_RETRIES + 1):
+        try:
+            upload_to_supabase(chunk)
+            print(f"  Chunk {chunk_number}/{total_chunks}: upserted {len(chunk)} records.")
+            return True
+        except Exception as e:
+            print(f"  Chunk {chunk_number}/{total_chunks} failed (attempt {attempt}/{UPSERT_MAX_RETRIES}): {e}")
+            if attempt < UPSERT_MAX_RETRIES:
+                time.sleep(UPSERT_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    return False
+
+def upsert_records(records, chunk_size=None, workers=1):
+    """
+    Upserts all records in size-bounded chunks, optionally submitting chunks in parallel.
+    Returns (uploaded_record_count, failed_chunks).
+    """
+    chunks = chunk_records(records, max_rows=chunk_size)
+    if not chunks:
+        return 0, []
+    print(f"Upserting {len(records)} records in {len(chunks)} chunk(s) with {workers} worker(s)...")
+
+    uploaded = 0
+    failed_chunks = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(upload_chunk, chunk, i + 1, len(chunks)): chunk
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            if future.result():
+                uploaded += len(chunk)
+            else:
+                failed_chunks.append(chunk)
+    return uploaded, failed_chunks
+
 def process_directory(directory_path):
-    """Processes all JSON files within a given city's results directory."""
+    """Processes all JSON files within a given city's results directory and returns the normalized records."""
     if not os.path.exists(directory_path):
         print(f"Directory not found: {directory_path}")
-        return 0 # Return 0 processed records
+        return [] # No records
     
-    # Keep track of total records processed for this directory
-    total_records_in_dir = 0
+    # Keep track of records processed for this directory
+    records_in_dir = []
     total_files_in_dir = 0
     successful_files_in_dir = 0
     failed_files_in_dir = 0
@@ -240,16 +320,12 @@ def process_directory(directory_path):
                         # Process JSON file and get modified data
                         data = process_json_file(file_path)
                         
-                        # Upload to Supabase
-                        result = upload_to_supabase(data)
-                        
                         if data: # Only count if data was successfully processed and not empty
-                           num_records = len(data)
-                           total_records_in_dir += num_records
+                           validate_data(data)
+                           records_in_dir.extend(data)
                            successful_files_in_dir += 1
-                           print(f"Successfully uploaded {num_records} records from {file}")
                         else:
-                           print(f"Skipped upload for {file} (no valid data after processing)")
+                           print(f"Skipped {file} (no valid data after processing)")
                            failed_files_in_dir += 1
                            
                     except ValueError as ve:
@@ -258,18 +334,171 @@ def process_directory(directory_path):
                         print(f"Skipping file {file} due to data error: {ve}")
                     except Exception as e:
                         failed_files_in_dir += 1
-                        print(f"Error processing/uploading {file}: {repr(e)}")
+                        print(f"Error processing {file}: {repr(e)}")
                         # Optionally print traceback for deeper debugging
                         # traceback.print_exc()
                         
     print(f"Finished processing directory: {directory_path}")
-    print(f"  Summary: {total_files_in_dir} files found, {successful_files_in_dir} uploaded, {failed_files_in_dir} failed/skipped, {total_records_in_dir} records total.")
-    return total_records_in_dir # Return total records uploaded from this directory
+    print(f"  Summary: {total_files_in_dir} files found, {successful_files_in_dir} processed, {failed_files_in_dir} failed/skipped, {len(records_in_dir)} records total.")
+    return records_in_dir
+
+def diff_key(record):
+    """Identity of a ranking entry within one city snapshot: (榜单, 排名, 品牌)."""
+    return (record.get("榜单"), str(record.get("排名", "")).strip(), record.get("品牌"))
+
+def normalize_diff_value(value):
+    """Compares values the way they round-trip through Supabase (e.g. 4.5 vs "4.5", 106 vs 106.0)."""
+    if value is None:
+        return ""
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    # Numbers compare numerically, so an integer never differs from the same value in a float column
+    return number if math.isfinite(number) else text
+
+def get_previous_snapshot_date(city, today):
+    """Returns the most recent snapshot date (<= today) stored for the city, or None."""
+    supabase = clients.get_supabase_client()
+    latest = None
+    for column in ("create_date", "last_seen_date"):
+        response = supabase.table("dzdpdata").select(column)\
+                           .eq("城市", city)\
+                           .lte(column, today)\
+                           .order(column, desc=True)\
+                           .limit(1)\
+                           .execute()
+        if response.data and response.data[0].get(column):
+            value = response.data[0][column]
+            latest = value if latest is None or value > latest else latest
+    return latest
+
+def load_previous_snapshot(city, today):
+    """
+    Loads the city's previous snapshot once.
+    Returns (snapshot_date, {diff_key: row}); ({} if the city has no earlier data).
+    """
+    snapshot_date = get_previous_snapshot_date(city, today)
+    if snapshot_date is None:
+        return None, {}
+
+    # Rows whose date range ends on snapshot_date (NULL last_seen_date means create_date)
+    filters = lambda query: query.eq("城市", city)\
+                                 .lte("create_date", snapshot_date)\
+                                 .or_(f"last_seen_date.eq.{snapshot_date},and(last_seen_date.is.null,create_date.eq.{snapshot_date})")
+    rows = iter_rows(clients.get_supabase_client(), "dzdpdata", "*", filters=filters,
+                     order=["榜单", "品牌", "create_date"], page_size=SNAPSHOT_PAGE_SIZE)
+    return snapshot_date, {diff_key(row): row for row in rows}
+
+def diff_against_snapshot(records, snapshot, today):
+    """
+    Splits a city's records into (changed_rows, carry_forward_markers).
+    changed_rows are full rows for new or changed entries. carry_forward_markers are compact
+    rows {榜单, 品牌, create_date, last_seen_date} that extend an unchanged existing row to today.
+    They are applied as UPDATEs (never as partial upserts, which Postgres would check against the
+    NOT NULL columns they leave out).
+    """
+    changed = []
+    markers = []
+    for record in records:
+        record["last_seen_date"] = today
+        previous = snapshot.get(diff_key(record))
+        if previous is not None and previous.get("create_date") != today:
+            fields = set(record) - DIFF_IGNORED_FIELDS
+            if all(normalize_diff_value(record.get(f)) == normalize_diff_value(previous.get(f)) for f in fields):
+                markers.append({
+                    "榜单": previous["榜单"],
+                    "品牌": previous["品牌"],
+                    "create_date": previous["create_date"],
+                    "last_seen_date": today,
+                })
+                continue
+        changed.append(record)
+    return changed, markers
+
+def diff_records(records, today):
+    """
+    Diffs all records city by city against the previous snapshots.
+    Returns (changed_rows, carry_forward_markers).
+    """
+    by_city = defaultdict(list)
+    for record in records:
+        by_city[record.get("城市")].append(record)
+
+    all_changed = []
+    all_markers = []
+    for city, city_records in by_city.items():
+        snapshot_date, snapshot = load_previous_snapshot(city, today)
+        changed, markers = diff_against_snapshot(city_records, snapshot, today)
+        print(f"  {city}: {len(city_records)} records vs snapshot {snapshot_date or '(none)'} "
+              f"({len(snapshot)} rows) -> {len(changed)} new/changed, {len(markers)} unchanged")
+        all_changed.extend(changed)
+        all_markers.extend(markers)
+    return all_changed, all_markers
+
+def extend_last_seen(markers):
+    """
+    Applies carry-forward markers directly (--direct): markers with the same 榜单, create_date and
+    last_seen_date are one UPDATE ... WHERE 品牌 IN (...), retried with exponential backoff.
+    Returns (updated_marker_count, failed_marker_chunks).
+    """
+    groups = defaultdict(list)
+    for marker in markers:
+        groups[(marker["榜单"], marker["create_date"], marker["last_seen_date"])].append(marker)
+    print(f"Extending last_seen_date of {len(markers)} unchanged records in {len(groups)} group(s)...")
+
+    supabase = clients.get_supabase_client()
+    updated = 0
+    failed_chunks = []
+    for (ranking, create_date, last_seen_date), group in groups.items():
+        for i in range(0, len(group), MARKER_BRANDS_PER_REQUEST):
+            chunk = group[i:i + MARKER_BRANDS_PER_REQUEST]
+            for attempt in range(1, UPSERT_MAX_RETRIES + 1):
+                try:
+                    supabase.table("dzdpdata").update({"last_seen_date": last_seen_date})\
+                            .eq("榜单", ranking)\
+                            .eq("create_date", create_date)\
+                            .in_("品牌", [marker["品牌"] for marker in chunk])\
+                            .execute()
+                    updated += len(chunk)
+                    break
+                except Exception as e:
+                    print(f"  Marker update for {ranking} ({create_date}) failed (attempt {attempt}/{UPSERT_MAX_RETRIES}): {e}")
+                    if attempt < UPSERT_MAX_RETRIES:
+                        time.sleep(UPSERT_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+            else:
+                failed_chunks.append(chunk)
+    return updated, failed_chunks
+
+def enqueue_markers(outbox, markers):
+    """Appends carry-forward markers to the outbox as updates keyed on (榜单, 品牌, create_date)."""
+    return outbox.enqueue("dzdpdata", markers, key_fields=["榜单", "品牌", "create_date"],
+                          op="update", match_on=MARKER_MATCH_COLUMNS)
+
+def enqueue_records(outbox, records):
+    """Validates records and appends them to the outbox keyed on (榜单, 品牌, create_date)."""
+    validate_data(records)
+    return outbox.enqueue("dzdpdata", records, key_fields=["榜单", "品牌", "create_date"])
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Upload analyzed Dianping ranking JSON files to Supabase in bulk.')
+    parser.add_argument('--chunk-size', type=int, default=UPSERT_CHUNK_ROWS, help='Maximum records per upsert request')
+    parser.add_argument('--workers', type=int, default=UPSERT_WORKERS, help='Number of chunks submitted in parallel (--direct only)')
+    parser.add_argument('--direct', action='store_true', help='Upsert directly instead of going through the local outbox')
+    parser.add_argument('--full', action='store_true', help='Write every row instead of only rows that changed since the previous snapshot')
+    parser.add_argument('--drain-timeout', type=int, default=OUTBOX_DRAIN_TIMEOUT, help='Seconds to wait for the outbox to flush before exiting')
+    args = parser.parse_args()
+
     # Reverted by AI: Look for directories in the same level as the script
     print("Starting Dianping Data Upload Script...")
+    try:
+        clients.get_supabase_client()
+    except Exception as e:
+        # 检查API密钥是否存在
+        print(f"错误: 无法创建Supabase客户端 ({e})。请在根目录的 .env 文件中添加 SUPABASE_URL 和 SUPABASE_KEY")
+        sys.exit(1)
     script_dir = os.path.dirname(__file__)
     analysis_root = os.path.join(script_dir, "分析结果文件") # Use current dir
 
@@ -296,16 +525,64 @@ def main():
     for folder in city_folders_to_process:
         print(f"  - {folder}")
         
-    grand_total_records = 0
-    # Process each found city folder
+    # Gather normalized records from all city folders first, then upload once
+    all_records = []
     for city_folder_path in city_folders_to_process:
-        print(f"\n===== Uploading data from City Folder: {os.path.basename(city_folder_path)} =====")
-        records_uploaded = process_directory(city_folder_path)
-        grand_total_records += records_uploaded
-    
-    print(f"\n===== Upload Complete. Processed {len(city_folders_to_process)} city folders. =====")
-    print(f"Grand total records uploaded across all folders: {grand_total_records}")
+        print(f"\n===== Reading data from City Folder: {os.path.basename(city_folder_path)} =====")
+        all_records.extend(process_directory(city_folder_path))
+
+    all_records = dedupe_records(all_records)
+    if not all_records:
+        print("No valid records to upload.")
+        sys.exit(0)
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    markers = []
+    if args.full:
+        for record in all_records:
+            record["last_seen_date"] = today
+    else:
+        print(f"\n===== Diffing {len(all_records)} records against the previous snapshots =====")
+        try:
+            all_records, markers = diff_records(all_records, today)
+        except Exception as e:
+            print(f"Could not load previous snapshots ({e}). Falling back to a full upload.")
+            for record in all_records:
+                record["last_seen_date"] = today
+
+    if args.direct:
+        print(f"\n===== Uploading {len(all_records)} records and {len(markers)} carry-forward markers from {len(city_folders_to_process)} city folders =====")
+        # Full rows and markers have different columns, so they are never mixed in one request
+        grand_total_records, failed_chunks = upsert_records(all_records, chunk_size=args.chunk_size, workers=args.workers)
+        marker_total, failed_marker_chunks = extend_last_seen(markers)
+        grand_total_records += marker_total
+        failed_chunks += failed_marker_chunks
+
+        print(f"\n===== Upload Complete. Processed {len(city_folders_to_process)} city folders. =====")
+        print(f"Grand total records uploaded across all folders: {grand_total_records}")
+        if failed_chunks:
+            print(f"Failed to upload {sum(len(c) for c in failed_chunks)} records in {len(failed_chunks)} chunk(s) after retries.")
+            sys.exit(1)
+        return
 
+    outbox = Outbox(client_factory=clients.get_supabase_client, db_path=OUTBOX_DB_PATH, batch_size=args.chunk_size)
+    requeued = outbox.requeue_failed() # Rows rejected in earlier runs get another chance (e.g. after a schema fix)
+    if requeued:
+        print(f"Retrying {requeued} records that were rejected in earlier runs.")
+    outbox.start()
+    queued = enqueue_records(outbox, all_records) if all_records else 0
+    queued += enqueue_markers(outbox, markers) if markers else 0
+    print(f"\n===== Queued {queued} rows ({len(markers)} carry-forward markers) from {len(city_folders_to_process)} city folders in the outbox =====")
+    pending = outbox.close(timeout=args.drain_timeout)
+
+    print(f"\n===== Upload Complete. Processed {len(city_folders_to_process)} city folders. =====")
+    print(f"Records sent to Supabase this run: {outbox.sent_rows}")
+    if pending:
+        print(f"{pending} records are still pending in the outbox; rerun Upload.py to resume flushing.")
+    if outbox.failed_rows:
+        print(f"{outbox.failed_rows} records were rejected by Supabase and parked as failed in {OUTBOX_DB_PATH}.")
+    if pending or outbox.failed_rows:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,368 @@
+# dzdp_crawler/benchmark.py
+# Golden-set benchmark for the screenshot Analyzer.
+# Runs the production pipeline (Analyzer.analyze_folder: model routing, rank-gap repair and
+# validation, then the same dedupe/truncation as save_results) over hand-labelled screenshot
+# folders and reports per-field accuracy, model-call latency percentiles, retry wait time
+# (reported separately, never counted as latency), bytes sent, estimated tokens and estimated
+# cost, so that prompt, model and image-size changes can be compared.
+#
+# Golden set layout (default: dzdp_crawler/benchmark_cases):
+#   benchmark_cases/<case>/0.png, 1.png, ...      screenshots of one ranking folder
+#   benchmark_cases/<case>/expected.json          hand-labelled records, either a list or
+#                                                 {"ranking_type": "主榜单", "records": [...]}
+#   benchmark_cases/<case>/recorded/<route>.json  every Gemini call of a run (written with --record)
+#
+# The golden set is not generated: to add a case, copy one 主榜单 or 细分榜单N screenshot folder
+# from a crawl into benchmark_cases/<case>/, copy the matching file from 分析结果文件 to
+# expected.json and correct every record by hand against the screenshots. Then run --record
+# once so later --replay runs are offline and deterministic.
+#
+# Usage:
+#   python benchmark.py --record                                   # production MODEL_ROUTE, saves responses
+#   python benchmark.py --replay                                   # offline, uses recorded responses
+#   python benchmark.py --model gemini-1.5-flash --max-side 1024   # single model, downscaled screenshots
+
+import os
+import io
+import sys
+import json
+import math
+import argparse
+import unicodedata
+
+import Analyzer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CASES_DIR = os.path.join(SCRIPT_DIR, "benchmark_cases")
+
+# Fields compared against expected.json
+FIELDS = ["榜单", "排名", "店铺名称", "品牌", "评分", "位置", "细分榜单", "价格"]
+
+# USD per 1M tokens (input, output). Update when pricing changes.
+MODEL_PRICES_PER_M_TOKENS = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+}
+
+# Gemini bills images as 258 tokens per 768x768 tile (small images count as one tile)
+IMAGE_TILE_SIZE = 768
+TOKENS_PER_IMAGE_TILE = 258
+
+
+def estimate_text_tokens(text):
+    """Rough token estimate: one token per CJK character, ~4 characters per token otherwise."""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_image_tokens(size):
+    """Estimates the tokens billed for one image of the given (width, height)."""
+    width, height = size
+    if width <= 384 and height <= 384:
+        return TOKENS_PER_IMAGE_TILE
+    tiles_x = -(-width // IMAGE_TILE_SIZE)
+    tiles_y = -(-height // IMAGE_TILE_SIZE)
+    return tiles_x * tiles_y * TOKENS_PER_IMAGE_TILE
+
+
+def encoded_size(img):
+    """Size in bytes of the image as PNG, i.e. roughly what is uploaded per request."""
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.tell()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def normalize_value(field, value):
+    """Normalizes a field value for comparison."""
+    if value is None:
+        return None
+    if field in ("排名", "价格"):
+        try:
+            return int(float(str(value).strip()))
+        except ValueError:
+            return str(value).strip()
+    if field == "评分":
+        try:
+            return round(float(str(value).strip()), 1)
+        except ValueError:
+            return str(value).strip()
+    return unicodedata.normalize('NFKC', str(value)).strip()
+
+
+def load_case(case_dir):
+    """Loads expected.json of a case. Returns (ranking_type, records)."""
+    with open(os.path.join(case_dir, "expected.json"), 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    if isinstance(expected, dict):
+        return expected.get("ranking_type") or os.path.basename(case_dir), expected.get("records", [])
+    return os.path.basename(case_dir), expected
+
+
+def score_case(predicted, expected):
+    """
+    Matches predicted records to expected records by rank and counts correct fields.
+    Returns (field_correct, field_total, extra_predictions).
+    """
+    predicted_by_rank = {}
+    for record in predicted:
+        rank = Analyzer.parse_rank(record)
+        if rank is not None and rank not in predicted_by_rank:
+            predicted_by_rank[rank] = record
+
+    field_correct = {field: 0 for field in FIELDS}
+    field_total = {field: 0 for field in FIELDS}
+    expected_ranks = set()
+    for record in expected:
+        rank = Analyzer.parse_rank(record)
+        expected_ranks.add(rank)
+        match = predicted_by_rank.get(rank, {})
+        for field in FIELDS:
+            if field not in record:
+                continue
+            field_total[field] += 1
+            if normalize_value(field, match.get(field)) == normalize_value(field, record[field]):
+                field_correct[field] += 1
+
+    extra = len([rank for rank in predicted_by_rank if rank not in expected_ranks])
+    return field_correct, field_total, extra
+
+
+def image_names(images):
+    """File names of the loaded screenshots, used to match recorded calls on --replay."""
+    return [os.path.basename(getattr(img, "filename", "") or "") for img in images]
+
+
+def run_case(case_dir, ranking_type, recorded_calls=None):
+    """
+    Runs Analyzer.analyze_folder over one case with the current MODEL_ROUTE and MAX_IMAGE_SIDE.
+    Every Gemini request goes through request_analysis_text, which is wrapped here to record
+    the call (live) or to answer it from recorded_calls (replay).
+    Returns (records as save_results would write them, calls).
+    """
+    calls = []
+    pending = {}
+    for call in recorded_calls or []:
+        pending.setdefault((call["model"], tuple(call["images"])), []).append(call)
+    request_analysis_text = Analyzer.request_analysis_text
+
+    def request(images, model_name=None):
+        model_name = model_name or Analyzer.clients.PRIMARY_MODEL
+        names = image_names(images)
+        if recorded_calls is not None:
+            queue = pending.get((model_name, tuple(names)))
+            if not queue:
+                print(f"No recorded call for {model_name} {names}, treating it as a failed request")
+                call = {"model": model_name, "images": names, "response_text": None,
+                        "latencies_s": [], "retry_sleep_s": 0.0, "bytes_sent": 0, "image_tokens": 0}
+            else:
+                call = queue.pop(0)
+        else:
+            stats = Analyzer.get_model_stats(model_name)
+            latency_count, slept = len(stats["latencies"]), stats["retry_sleep_s"]
+            sent = Analyzer.resize_images(images, Analyzer.MAX_IMAGE_SIDE)
+            response_text = request_analysis_text(images, model_name)
+            call = {
+                "model": model_name,
+                "images": names,
+                "response_text": response_text,
+                "latencies_s": stats["latencies"][latency_count:],
+                "retry_sleep_s": stats["retry_sleep_s"] - slept,
+                "bytes_sent": sum(encoded_size(img) for img in sent),
+                "image_tokens": sum(estimate_image_tokens(img.size) for img in sent),
+            }
+        calls.append(call)
+        return call["response_text"]
+
+    Analyzer.request_analysis_text = request
+    try:
+        records = Analyzer.analyze_folder(case_dir, ranking_type)
+    finally:
+        Analyzer.request_analysis_text = request_analysis_text
+    return Analyzer.records_to_save(records, ranking_type), calls
+
+
+def recording_path(case_dir, route, max_side):
+    suffix = f"_{max_side}" if max_side else ""
+    return os.path.join(case_dir, "recorded", f"{'+'.join(route)}{suffix}.json")
+
+
+def run_benchmark(cases_dir, model_name=None, replay=False, record=False, max_side=None):
+    """
+    Runs all cases and returns a report dict. Without model_name the production
+    MODEL_ROUTE is benchmarked; with it, only that model is used.
+    """
+    if not os.path.isdir(cases_dir):
+        print(f"Benchmark cases directory not found: {cases_dir}")
+        return None
+
+    case_dirs = sorted(
+        (os.path.join(cases_dir, d) for d in os.listdir(cases_dir)
+         if os.path.isfile(os.path.join(cases_dir, d, "expected.json"))),
+        key=Analyzer.natural_sort_key,
+    )
+    if not case_dirs:
+        print(f"No cases with expected.json found in {cases_dir}. See the header of benchmark.py for how to add them.")
+        return None
+
+    route = [model_name] if model_name else list(Analyzer.MODEL_ROUTE)
+    max_side = max_side or Analyzer.MAX_IMAGE_SIDE
+    saved_route, saved_max_side = Analyzer.MODEL_ROUTE, Analyzer.MAX_IMAGE_SIDE
+    Analyzer.MODEL_ROUTE, Analyzer.MAX_IMAGE_SIDE = route, max_side
+    try:
+        return _run_cases(case_dirs, route, replay, record, max_side)
+    finally:
+        Analyzer.MODEL_ROUTE, Analyzer.MAX_IMAGE_SIDE = saved_route, saved_max_side
+
+
+def _run_cases(case_dirs, route, replay, record, max_side):
+    field_correct = {field: 0 for field in FIELDS}
+    field_total = {field: 0 for field in FIELDS}
+    latencies = []
+    requests_per_model = {}
+    total_retry_sleep = 0.0
+    total_bytes = 0
+    total_input_tokens = 0
+    total_output_tokens = 0
+    total_cost = 0.0
+    total_extra = 0
+    escalated = 0
+    case_results = []
+
+    for case_dir in case_dirs:
+        case_name = os.path.basename(case_dir)
+        ranking_type, expected = load_case(case_dir)
+        path = recording_path(case_dir, route, max_side)
+
+        if replay:
+            if not os.path.exists(path):
+                print(f"[{case_name}] No recorded response at {path}. Skipping.")
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                predicted, calls = run_case(case_dir, ranking_type, json.load(f)["calls"])
+        else:
+            if not Analyzer.list_image_files(case_dir):
+                print(f"[{case_name}] No screenshots found. Skipping.")
+                continue
+            predicted, calls = run_case(case_dir, ranking_type)
+            if record:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump({"route": route, "max_side": max_side, "calls": calls}, f, ensure_ascii=False, indent=4)
+
+        correct, total, extra = score_case(predicted, expected)
+        for field in FIELDS:
+            field_correct[field] += correct[field]
+            field_total[field] += total[field]
+        total_extra += extra
+
+        models_used = []
+        case_latency = 0.0
+        case_retry_sleep = 0.0
+        for call in calls:
+            if call["model"] not in models_used:
+                models_used.append(call["model"])
+            requests_per_model[call["model"]] = requests_per_model.get(call["model"], 0) + 1
+            # Every completed round trip is billed for the prompt and images; the output is the returned text
+            attempts = len(call["latencies_s"])
+            input_tokens = attempts * (estimate_text_tokens(Analyzer.PROMPT) + call.get("image_tokens", 0))
+            output_tokens = estimate_text_tokens(call["response_text"])
+            input_price, output_price = MODEL_PRICES_PER_M_TOKENS.get(call["model"], (0.0, 0.0))
+            total_cost += (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+            total_input_tokens += input_tokens
+            total_output_tokens += output_tokens
+            total_bytes += attempts * call.get("bytes_sent", 0)
+            latencies.extend(call["latencies_s"])
+            case_latency += sum(call["latencies_s"])
+            case_retry_sleep += call.get("retry_sleep_s", 0.0)
+        total_retry_sleep += case_retry_sleep
+        if len(models_used) > 1:
+            escalated += 1
+
+        case_accuracy = sum(correct.values()) / max(1, sum(total.values()))
+        case_results.append({
+            "case": case_name,
+            "accuracy": case_accuracy,
+            "requests": len(calls),
+            "models": models_used,
+            "model_latency_s": case_latency,
+            "retry_sleep_s": case_retry_sleep,
+            "extra_records": extra,
+        })
+        print(f"[{case_name}] accuracy {case_accuracy:.1%}, {len(calls)} requests via {' -> '.join(models_used) or 'none'}, "
+              f"model latency {case_latency:.2f}s, retry wait {case_retry_sleep:.0f}s, "
+              f"{len(predicted)} records ({extra} not in expected)")
+
+    return {
+        "route": route,
+        "max_side": max_side,
+        "mode": "replay" if replay else "live",
+        "cases": case_results,
+        "field_accuracy": {field: (field_correct[field] / field_total[field] if field_total[field] else None) for field in FIELDS},
+        "latency_s": {"p50": percentile(latencies, 50), "p90": percentile(latencies, 90), "p99": percentile(latencies, 99), "max": max(latencies) if latencies else None},
+        "requests_per_model": requests_per_model,
+        "escalated_cases": escalated,
+        "retry_sleep_s": total_retry_sleep,
+        "bytes_sent": total_bytes,
+        "estimated_input_tokens": total_input_tokens,
+        "estimated_output_tokens": total_output_tokens,
+        "estimated_cost_usd": total_cost,
+        "extra_records": total_extra,
+    }
+
+
+def print_report(report):
+    print(f"\n===== Analyzer Benchmark: {' -> '.join(report['route'])} ({report['mode']}, max_side={report['max_side']}) =====")
+    print(f"Cases: {len(report['cases'])} ({report['escalated_cases']} escalated to a later model)")
+    print("Per-field accuracy:")
+    for field, accuracy in report["field_accuracy"].items():
+        print(f"  {field}: {'n/a' if accuracy is None else f'{accuracy:.1%}'}")
+    latency = report["latency_s"]
+    if latency["p50"] is not None:
+        print(f"Model latency per request: p50 {latency['p50']:.2f}s, p90 {latency['p90']:.2f}s, p99 {latency['p99']:.2f}s, max {latency['max']:.2f}s")
+    print(f"Requests: {', '.join(f'{model} {count}' for model, count in report['requests_per_model'].items())}")
+    print(f"Retry wait (not included in latency): {report['retry_sleep_s']:.0f}s")
+    print(f"Bytes sent: {report['bytes_sent'] / 1024:.1f} KiB")
+    print(f"Estimated tokens: {report['estimated_input_tokens']} in / {report['estimated_output_tokens']} out")
+    print(f"Estimated cost: ${report['estimated_cost_usd']:.4f}")
+    print(f"Records not in expected: {report['extra_records']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DZDP screenshot Analyzer against a hand-labelled golden set.')
+    parser.add_argument('--cases', default=DEFAULT_CASES_DIR, help='Directory containing benchmark case folders')
+    parser.add_argument('--model', help='Benchmark only this Gemini model instead of the production MODEL_ROUTE')
+    parser.add_argument('--replay', action='store_true', help='Use recorded responses instead of calling the API (offline)')
+    parser.add_argument('--record', action='store_true', help='Save live responses for later --replay runs')
+    parser.add_argument('--max-side', type=int, default=None, help='Downscale screenshots so the longest side is at most this many pixels')
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    if args.replay and args.record:
+        print("--replay and --record cannot be combined.")
+        sys.exit(1)
+
+    report = run_benchmark(args.cases, args.model, replay=args.replay, record=args.record, max_side=args.max_side)
+    if report is None:
+        sys.exit(1)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# dzdp_crawler/clients.py
+# Lazy, per-process factory for the external clients used by the DZDP scripts.
+# Nothing is configured or connected at import time: the Gemini model and the
+# Supabase client are created on first use and memoized, so importing
+# Analyzer.py / Upload.py / refresh.py (e.g. from tests or main/main.py) is
+# side-effect-free. health_check() performs the network round trips explicitly.
+# SUPABASE_URL=sqlite:///path/to/file.db selects the offline SQLite stand-in
+# (common/sqlite_rest.py) instead of Supabase; no SUPABASE_KEY is needed then.
+
+import os
+import sys
+import threading
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Gemini models: primary model and the fallback used if the primary fails to load
+PRIMARY_MODEL = "gemini-2.0-flash-lite"
+FALLBACK_MODEL = "gemini-1.5-flash"
+
+_lock = threading.RLock()
+_env_loaded = False
+_genai_configured = False
+_models = {}
+_supabase_client = None
+
+
+def load_env():
+    """Loads the root .env file once per process."""
+    global _env_loaded
+    with _lock:
+        if _env_loaded:
+            return
+        from dotenv import load_dotenv
+        script_dir = os.path.dirname(__file__)
+        dotenv_path = os.path.join(script_dir, '..', '.env')
+        load_dotenv(dotenv_path=dotenv_path)
+        _env_loaded = True
+
+
+def _configure_genai():
+    """Configures the Gemini SDK with GEMINI_API_KEY (no network call)."""
+    global _genai_configured
+    with _lock:
+        if _genai_configured:
+            return
+        load_env()
+        gemini_api_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables. Ensure the root .env file contains this key.")
+        import google.generativeai as genai
+        # 清理API密钥（移除可能的空格或换行符）
+        genai.configure(api_key=gemini_api_key.strip())
+        _genai_configured = True
+
+
+def get_gemini_model(model_name=None):
+    """
+    Returns a memoized GenerativeModel. Without a model_name the primary model is
+    used, falling back to FALLBACK_MODEL if the primary cannot be created.
+    """
+    with _lock:
+        key = model_name or PRIMARY_MODEL
+        if key in _models:
+            return _models[key]
+
+        _configure_genai()
+        import google.generativeai as genai
+        try:
+            model = genai.GenerativeModel(key)
+            print(f"成功加载模型 {key}")
+        except Exception as e:
+            if model_name is not None:
+                raise
+            print(f"加载模型失败: {e}")
+            print(f"尝试使用备用模型 {FALLBACK_MODEL}...")
+            model = genai.GenerativeModel(FALLBACK_MODEL)
+            print(f"成功加载备用模型 {FALLBACK_MODEL}")
+        _models[key] = model
+        return model
+
+
+def get_supabase_client():
+    """Returns the memoized Supabase client, creating it on first use."""
+    global _supabase_client
+    with _lock:
+        if _supabase_client is not None:
+            return _supabase_client
+
+        load_env()
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+        if supabase_url and supabase_url.startswith("sqlite:"):
+            if PROJECT_ROOT not in sys.path:
+                sys.path.insert(0, PROJECT_ROOT)
+            from common.sqlite_rest import create_client as create_sqlite_client
+            _supabase_client = create_sqlite_client(supabase_url)
+            print(f"Using local SQLite stand-in for Supabase: {supabase_url}")
+            return _supabase_client
+        if not supabase_url or not supabase_key:
+            raise ValueError("Supabase URL or Key not found in root .env file (SUPABASE_URL, SUPABASE_KEY)")
+
+        from supabase import create_client
+        _supabase_client = create_client(supabase_url, supabase_key)
+        print("Supabase client created successfully.")
+        return _supabase_client
+
+
+def health_check(services=("gemini", "supabase")):
+    """
+    Checks that the requested services are reachable.
+    Returns a dict {service: (ok, message)}.
+    """
+    results = {}
+    if "gemini" in services:
+        try:
+            _configure_genai()
+            import google.generativeai as genai
+            # list_models is a network round trip, so it only runs here
+            next(iter(genai.list_models()), None)
+            results["gemini"] = (True, "成功连接到Gemini API")
+        except Exception as e:
+            results["gemini"] = (False, f"连接Gemini API失败: {e}")
+    if "supabase" in services:
+        try:
+            client = get_supabase_client()
+            client.table("dzdpdata").select("create_date").limit(1).execute()
+            results["supabase"] = (True, "Supabase connection OK")
+        except Exception as e:
+            results["supabase"] = (False, f"Supabase connection failed: {e}")
+    return results
+
+
+def require_healthy(services=("gemini", "supabase")):
+    """Runs health_check, prints the results and returns True only if all services are OK."""
+    all_ok = True
+    for service, (ok, message) in health_check(services).items():
+        print(message)
+        all_ok = all_ok and ok
+    return all_ok
+
+
+def reset():
+    """Drops all memoized clients (e.g. after changing environment variables)."""
+    global _env_loaded, _genai_configured, _supabase_client
+    with _lock:
+        _env_loaded = False
+        _genai_configured = False
+        _models.clear()
+        _supabase_client = None
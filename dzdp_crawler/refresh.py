@@ -3,150 +3,240 @@
 # Contains function to refresh the 'brand' table with all unique brands from 'dzdpdata'.
 # Moved from main/refresh.py to dzdp_crawler/refresh.py.
 # Updated to include pagination for fetching existing brands from brand table.
+# The Supabase client is now created lazily on first use instead of at import time.
+# Incremental refresh: the newest processed create_date is kept as a high-watermark in
+# .refresh_state.json, and each run fetches only dzdpdata rows with create_date >= watermark and
+# checks only those names against the brand table. Use --full to rescan the whole table.
+# When the missing_brand_names RPC exists (sql/002_brand_diff.sql), the database returns only the
+# dzdpdata names that are not literally in brand, instead of every dzdpdata row, and only the keys
+# of those candidates are looked up in brand.name_key. Otherwise the names are read page by page below.
+# Either way brands are compared by common/brand_names.py keys, so width, case, branch-suffix and
+# alias variants of an existing brand are not inserted again.
 
 import os
 import sys
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import json
+import argparse
 import traceback
+import clients
 
-# --- Supabase Client Initialization ---
-def get_supabase_client():
-    """Initializes and returns the Supabase client."""
-    # Load environment variables from the root .env file
-    script_dir = os.path.dirname(__file__)
-    dotenv_path = os.path.join(script_dir, '..', '.env')
-    load_dotenv(dotenv_path=dotenv_path)
+# Shared modules live in the project-root common/ directory
+if clients.PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, clients.PROJECT_ROOT)
+from common.paginate import iter_pages, iter_rows_keyset
+from common.brand_names import display_name, brand_key
 
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY") # Assumes service key for inserts
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".refresh_state.json")
+PAGE_SIZE = 1000 # Supabase default limit per request
+PAGE_WORKERS = 4 # Concurrent page requests when reading dzdpdata
+NAME_LOOKUP_CHUNK = 200 # Brand names per "name in (...)" lookup (keeps request URLs short)
 
-    if not supabase_url or not supabase_key:
-        raise ValueError("Supabase URL or Key not found in root .env file")
+# --- Supabase Client Initialization ---
+def get_supabase_client():
+    """Returns the shared, lazily created Supabase client (see clients.py)."""
+    return clients.get_supabase_client()
+# --- End Supabase Client Initialization ---
 
+def load_watermark():
+    """Returns the last processed create_date (YYYY-MM-DD) or None if there is no state yet."""
+    if not os.path.exists(STATE_FILE):
+        return None
     try:
-        supabase: Client = create_client(supabase_url, supabase_key)
-        print("Supabase client created successfully.")
-        return supabase
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get("watermark")
     except Exception as e:
-        print(f"Error creating Supabase client: {e}")
-        sys.exit(1)
-
-supabase = get_supabase_client()
-# --- End Supabase Client Initialization ---
-
-def refresh_brand_table():
-    """Fetches distinct brands from dzdpdata, handling pagination, and inserts new ones into the brand table."""
+        print(f"Warning: Could not read {STATE_FILE} ({e}). Doing a full rescan.")
+        return None
+
+def save_watermark(watermark):
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"watermark": watermark}, f, ensure_ascii=False, indent=4)
+    print(f"Saved refresh watermark: {watermark}")
+
+def fetch_dzdp_brands(supabase, since=None):
+    """
+    Fetches distinct, non-empty brand names from dzdpdata, handling pagination.
+    With since, only rows with create_date >= since are read.
+    Returns (brand_names, newest_create_date).
+    """
+    brands = set()
+    newest_date = None
+    filters = (lambda query: query.gte("create_date", since)) if since else None
+
+    # Ordering by the primary key keeps the concurrently fetched range pages consistent
+    for page in iter_pages(supabase, "dzdpdata", "品牌, create_date", filters=filters,
+                           order=["create_date", "榜单", "品牌"], page_size=PAGE_SIZE, workers=PAGE_WORKERS):
+        print(f"Fetched {len(page)} dzdpdata rows...")
+        for item in page:
+            if item.get('品牌') and str(item.get('品牌')).strip(): # Also ensure not just whitespace
+                brands.add(item['品牌'])
+            if item.get('create_date') and (newest_date is None or item['create_date'] > newest_date):
+                newest_date = item['create_date']
+
+    return brands, newest_date
+
+def fetch_all_existing_brands(supabase):
+    """Fetches all brand names from the brand table (keyset pagination on brand_id)."""
+    return {item['name'] for item in iter_rows_keyset(supabase, "brand", "name", key="brand_id", page_size=PAGE_SIZE)}
+
+def fetch_existing_brands_among(supabase, names):
+    """Returns the brand table names matching names (as given or in display form)."""
+    names = sorted(set(names) | {display_name(name) for name in names})
+    existing_brands = set()
+    for i in range(0, len(names), NAME_LOOKUP_CHUNK):
+        chunk = names[i:i + NAME_LOOKUP_CHUNK]
+        response = supabase.table("brand").select("name").in_("name", chunk).execute()
+        existing_brands.update(item['name'] for item in response.data or [])
+    return existing_brands
+
+def get_newest_create_date(supabase):
+    response = supabase.table("dzdpdata").select("create_date").order("create_date", desc=True).limit(1).execute()
+    return response.data[0]['create_date'] if response.data else None
+
+def fetch_candidate_brands_server_side(supabase, since=None):
+    """
+    dzdpdata names not literally in brand, from the missing_brand_names RPC.
+    Returns a set of names, or None if the RPC is not available.
+    """
+    try:
+        response = supabase.rpc("missing_brand_names", {"since": since}).execute()
+    except Exception as e:
+        print(f"Server-side brand diff unavailable ({e}). Reading dzdpdata instead.")
+        return None
+    return {item['name'] for item in response.data or [] if item.get('name') and str(item['name']).strip()}
+
+def backfill_brand_keys(supabase):
+    """Fills brand.name_key of rows inserted without one (before sql/002 or by other tools). Returns the number of rows."""
+    rows = list(iter_rows_keyset(supabase, "brand", "brand_id, name", key="brand_id",
+                                 filters=lambda query: query.is_("name_key", "null"), page_size=PAGE_SIZE))
+    for row in rows:
+        supabase.table("brand").update({"name_key": brand_key(row['name'])}).eq("brand_id", row['brand_id']).execute()
+    if rows:
+        print(f"Filled name_key of {len(rows)} brands.")
+    return len(rows)
+
+def fetch_existing_keys_among(supabase, keys):
+    """Returns the brand keys among keys that are already in brand.name_key."""
+    keys = sorted(keys)
+    existing_keys = set()
+    for i in range(0, len(keys), NAME_LOOKUP_CHUNK):
+        chunk = keys[i:i + NAME_LOOKUP_CHUNK]
+        response = supabase.table("brand").select("name_key").in_("name_key", chunk).execute()
+        existing_keys.update(item['name_key'] for item in response.data or [])
+    return existing_keys
+
+def insert_brands(supabase, new_brands, with_keys=False):
+    """Inserts brand names (with their name_key if with_keys), ignoring names that already exist (brand.name is unique)."""
+    records_to_insert = [{'name': brand_name, 'name_key': brand_key(brand_name)} if with_keys else {'name': brand_name}
+                         for brand_name in sorted(new_brands)]
+    print(f"Inserting new brands: {records_to_insert[:10]}...") # Print first few
+    return supabase.table("brand").upsert(records_to_insert, on_conflict="name", ignore_duplicates=True).execute()
+
+def refresh_brand_table(full=False):
+    """
+    Inserts brands from dzdpdata that are missing from the brand table.
+    Incremental by default: only dzdpdata rows at or after the stored create_date watermark are read.
+    Returns True on success.
+    """
     print("\n--- Refreshing Brand Table ---")
     try:
-        # 1. Get distinct, non-null brand names from dzdpdata, handling pagination
-        print("Fetching all distinct brands from dzdpdata (handling pagination)...")
-        all_dzdp_brands_data = []
-        current_page = 0
-        page_size = 1000 # Supabase default limit per request
-
-        while True:
-            start_index = current_page * page_size
-            end_index = start_index + page_size - 1
-            print(f"Fetching brands: rows {start_index} to {end_index}...")
-            response = supabase.table("dzdpdata").select("品牌", count='exact').range(start_index, end_index).execute()
-
-            # Check for errors (basic)
-            if hasattr(response, 'error') and response.error:
-                print(f"Error fetching data page {current_page}: {response.error}")
-                # Decide whether to stop or continue based on error type if needed
-                break 
-                
-            if response.data:
-                all_dzdp_brands_data.extend(response.data)
-            
-            # Determine if we've reached the end
-            # Check if the number of items returned is less than the page size,
-            # or if the total count (if available and reliable) is reached.
-            # Using returned data length is generally safer.
-            if len(response.data) < page_size:
-                 print("Fetched last page of data.")
-                 break # Exit loop if last page fetched
-
-            current_page += 1
-            # Safety break to prevent infinite loops in unexpected scenarios
-            if current_page > 100: # Adjust limit as needed based on expected data size
-                print("Warning: Reached maximum page limit (100). Stopping fetch.")
-                break
-                
-        print(f"Total raw brand entries fetched: {len(all_dzdp_brands_data)}")
-
-        if not all_dzdp_brands_data:
-            print("No brands found in dzdpdata table after fetching all pages.")
-            return
-
-        # Extract unique, non-empty brand names from the *complete* dataset
-        dzdp_brands = set(item['品牌'] for item in all_dzdp_brands_data if item.get('品牌') and str(item.get('品牌')).strip()) # Also ensure not just whitespace
-        print(f"Found {len(dzdp_brands)} unique, non-empty brands in dzdpdata after processing all pages.")
+        supabase = get_supabase_client()
+
+        watermark = None if full else load_watermark()
+        if watermark:
+            print(f"Incremental refresh: considering dzdpdata rows with create_date >= {watermark}")
+        else:
+            print("Full refresh: considering all dzdpdata rows...")
+
+        # 1. Get distinct, non-null brand names from dzdpdata. The RPC already leaves out names that
+        # are literally in brand; only those candidates come back over the wire.
+        newest_date = get_newest_create_date(supabase)
+        dzdp_brands = fetch_candidate_brands_server_side(supabase, since=watermark)
+        server_side = dzdp_brands is not None
+        if server_side:
+            print(f"Found {len(dzdp_brands)} dzdpdata brand names not literally in the brand table.")
+        else:
+            dzdp_brands, newest_date = fetch_dzdp_brands(supabase, since=watermark)
+            print(f"Found {len(dzdp_brands)} unique, non-empty brands in dzdpdata.")
 
         if not dzdp_brands:
-            print("No valid brand names extracted from dzdpdata.")
-            return
-
-        # 2. Get existing brand names from the brand table (with pagination)
-        print("Fetching existing brands from brand table (handling pagination)...")
-        existing_brands = set()
-        current_page = 0
-        
-        while True:
-            start_index = current_page * page_size
-            end_index = start_index + page_size - 1
-            print(f"Fetching existing brands: rows {start_index} to {end_index}...")
-            existing_brands_response = supabase.table("brand").select("name").range(start_index, end_index).execute()
-            
-            if hasattr(existing_brands_response, 'error') and existing_brands_response.error:
-                print(f"Error fetching existing brands page {current_page}: {existing_brands_response.error}")
-                break
-                
-            if existing_brands_response.data:
-                # Add brand names to our set
-                existing_brands.update(item['name'] for item in existing_brands_response.data)
-            
-            if len(existing_brands_response.data) < page_size:
-                 print("Fetched last page of existing brands.")
-                 break
-                 
-            current_page += 1
-            if current_page > 100:
-                print("Warning: Reached maximum page limit (100). Stopping fetch of existing brands.")
-                break
-                
-        print(f"Found {len(existing_brands)} existing brands.")
-
-        # 3. Determine which brands are new
-        new_brands = dzdp_brands - existing_brands
+            print("No new brand names found in dzdpdata.")
+            if newest_date and (watermark is None or newest_date > watermark):
+                save_watermark(newest_date)
+            return True
+
+        # 2. Get the keys of existing brands: only the candidates' keys (brand.name_key) after the
+        # RPC, only the fetched names for incremental client-side runs
+        existing_keys = None
+        with_keys = server_side
+        if with_keys:
+            try:
+                backfill_brand_keys(supabase)
+                existing_keys = fetch_existing_keys_among(supabase, {brand_key(name) for name in dzdp_brands})
+                print(f"Found {len(existing_keys)} of the candidates' brand keys in the brand table.")
+            except Exception as e:
+                # Candidates may be variants stored under another spelling, so compare with all names
+                print(f"brand.name_key unavailable ({e}). Comparing with all brand names instead.")
+                with_keys = False
+        if existing_keys is None:
+            if watermark and not server_side:
+                existing_brands = fetch_existing_brands_among(supabase, dzdp_brands)
+            else:
+                print("Fetching existing brands from brand table (handling pagination)...")
+                existing_brands = fetch_all_existing_brands(supabase)
+            print(f"Found {len(existing_brands)} existing brands.")
+            existing_keys = {brand_key(name) for name in existing_brands}
+
+        # 3. Determine which brands are new (compared by normalized brand key)
+        new_brands = {}
+        for name in dzdp_brands:
+            key = brand_key(name)
+            if key and key not in existing_keys:
+                new_brands.setdefault(key, display_name(name))
+        new_brands = set(new_brands.values())
         print(f"Found {len(new_brands)} new brands to insert.")
 
         # 4. Insert new brands into the brand table
         if new_brands:
-            records_to_insert = [{'name': brand_name} for brand_name in new_brands]
-            print(f"Inserting new brands: {list(new_brands)[:10]}...") # Print first few
-            insert_response = supabase.table("brand").insert(records_to_insert).execute()
+            insert_response = insert_brands(supabase, new_brands, with_keys=with_keys)
             
             # Basic check on response (might need adjustment based on actual response)
             if hasattr(insert_response, 'data') and insert_response.data: 
                 print(f"Successfully inserted {len(insert_response.data)} new brands.")
             elif hasattr(insert_response, 'error') and insert_response.error:
                  print(f"Error inserting brands: {insert_response.error}")
+                 return False
             else:
                  # Handle cases where insertion might have partially succeeded or failed silently
                  print("Insertion completed. Verify results in Supabase.")
         else:
             print("No new brands to insert.")
 
+        # 5. Advance the watermark only after the new brands were inserted.
+        # The watermark is inclusive (>=), so rows added later on the same day are still seen.
+        if newest_date and (watermark is None or newest_date > watermark):
+            save_watermark(newest_date)
+
         print("Brand table refresh process finished.")
+        return True
 
     except Exception as e:
         print(f"Error during brand table refresh: {e}")
         traceback.print_exc()
+        return False
 
 # --- Main Execution --- 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Insert brands from dzdpdata that are missing from the brand table.')
+    parser.add_argument('--full', action='store_true', help='Rescan all of dzdpdata and the brand table instead of using the create_date watermark')
+    args = parser.parse_args()
+
     print("Running Brand Table Refresh Script...")
-    refresh_brand_table()
-    print("\nBrand Table Refresh Script finished.") 
\ No newline at end of file
+    try:
+        get_supabase_client()
+    except Exception as e:
+        print(f"Error creating Supabase client: {e}")
+        sys.exit(1)
+    if not refresh_brand_table(full=args.full):
+        sys.exit(1)
+    print("\nBrand Table Refresh Script finished.")
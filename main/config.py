@@ -25,6 +25,19 @@ CITIES = [#"上海",
           #"长沙"
           ]
 
+# --- XHS Brand Prioritization (xhs_crawler/brand_priority.py) ---
+# get_brand.py orders the XHS BRANDS list by score and keeps the brands that fit the click budget.
+
+# Detail clicks one XHS crawl run may spend (the crawler allows 300 clicks per hour). None = no budget.
+XHS_CRAWL_CLICK_BUDGET = 600
+
+# Score weights: ranking position, time since last crawl, related-post yield, never-crawled bonus.
+BRAND_PRIORITY_WEIGHTS = {"rank": 0.35, "staleness": 0.30, "yield": 0.20, "new": 0.15}
+
+# Brands crawled within this many hours are not queued again. Below 24 on purpose: the finish time of
+# yesterday's crawl is usually less than 24h before today's pipeline start on a daily schedule.
+BRAND_MIN_RECRAWL_HOURS = 20
+
 # --- Automation Settings ---
 
 # Set to True to automatically relocate the emulator at the start, False to skip.
@@ -0,0 +1,19 @@
+-- sql/001_dzdpdata_last_seen_date.sql
+-- Diff-based DZDP upload (dzdp_crawler/Upload.py).
+-- A dzdpdata row now covers a date range: it was observed, unchanged, in every daily snapshot
+-- from create_date through last_seen_date. Upload.py writes a new row only when a
+-- (城市, 榜单, 排名, 品牌) entry is new or changed; for unchanged entries it only moves
+-- last_seen_date of the existing row forward.
+--
+-- Rows written before this migration have last_seen_date = NULL, which means last_seen_date = create_date.
+-- The snapshot of day D is therefore:
+--   create_date <= D AND COALESCE(last_seen_date, create_date) >= D
+
+ALTER TABLE dzdpdata ADD COLUMN IF NOT EXISTS last_seen_date date;
+
+CREATE INDEX IF NOT EXISTS dzdpdata_city_last_seen_idx ON dzdpdata ("城市", last_seen_date);
+
+-- Convenience view for readers that want "the rows of snapshot D" without the range logic.
+CREATE OR REPLACE VIEW dzdpdata_snapshot_range AS
+SELECT *, COALESCE(last_seen_date, create_date) AS snapshot_end
+FROM dzdpdata;
@@ -0,0 +1,37 @@
+-- sql/002_brand_diff.sql
+-- Server-side brand diff for dzdp_crawler/refresh.py.
+-- Instead of downloading every dzdpdata."品牌" value, refresh.py calls missing_brand_names(since),
+-- which returns only the distinct names that are not literally in brand. refresh.py computes the
+-- common/brand_names.py key of these candidates (case, width, branch suffix, aliases), looks up only
+-- those keys in brand.name_key and inserts the brands that are really new, together with their key.
+-- The key needs the alias file, so it is computed by refresh.py, not in SQL; refresh.py also fills
+-- name_key of rows inserted without one. common/sqlite_rest.py re-implements the function for offline runs.
+
+-- Insert-ignore needs a unique name. Remove duplicate names first if this fails:
+--   DELETE FROM brand a USING brand b WHERE a.name = b.name AND a.brand_id > b.brand_id;
+CREATE UNIQUE INDEX IF NOT EXISTS brand_name_key ON brand (name);
+
+-- Normalized brand key (common/brand_names.py brand_key). Not unique: brands stored before this
+-- migration may already contain variants of one brand.
+ALTER TABLE brand ADD COLUMN IF NOT EXISTS name_key text;
+CREATE INDEX IF NOT EXISTS brand_key_idx ON brand (name_key);
+
+-- Supports the create_date watermark filter
+CREATE INDEX IF NOT EXISTS dzdpdata_create_date_idx ON dzdpdata (create_date);
+
+-- Distinct dzdpdata brand names (optionally only from rows with create_date >= since) that are not in brand
+CREATE OR REPLACE FUNCTION missing_brand_names(since date DEFAULT NULL)
+RETURNS TABLE (name text)
+LANGUAGE sql STABLE
+AS $$
+    SELECT DISTINCT d."品牌"
+    FROM dzdpdata d
+    WHERE d."品牌" IS NOT NULL AND btrim(d."品牌") <> ''
+      AND (since IS NULL OR d.create_date >= since)
+      AND NOT EXISTS (SELECT 1 FROM brand b WHERE b.name = d."品牌");
+$$;
+
+-- Compared raw names only (inserted case/alias variants of existing brands); not used anymore
+DROP FUNCTION IF EXISTS insert_missing_brands(date);
+
+GRANT EXECUTE ON FUNCTION missing_brand_names(date) TO anon, authenticated, service_role;
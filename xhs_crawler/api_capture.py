@@ -0,0 +1,171 @@
+# xhs_crawler/api_capture.py
+# Network-interception mode for crawler.py.
+# The search result page already loads its cards from the web API as JSON. FeedCapture listens to
+# page.on('response') and parses those responses into records, so card data (post id, title,
+# author, likes, publish time, cover) is a byproduct of scrolling instead of per-card DOM reads.
+#   search/notes   -> one card record per note item, kept in result order
+#   feed           -> note detail (content, image list, like/collect/comment counts)
+# The request body of the latest search/notes call is kept as last_search, so crawler.py can check
+# which keyword, sort order and note type the page actually searched for.
+# crawler.py looks cards up by note id and falls back to DOM scraping when nothing was captured
+# (e.g. the API shape changed or the response arrived before the listener was attached).
+
+import json
+import re
+from datetime import datetime
+
+SEARCH_NOTES_PATTERN = re.compile(r"/api/sns/web/v\d+/search/notes")
+FEED_PATTERN = re.compile(r"/api/sns/web/v\d+/feed(\?|$)")
+
+
+def parse_count(value):
+    """Parses XHS count strings: 1234, "1234", "1.2万", "10万+", "1,234", "" / "赞" (= 0)."""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace(",", "").rstrip("+")
+    if not text:
+        return 0
+    try:
+        if text.endswith("万"):
+            return int(float(text[:-1]) * 10000)
+        if text.endswith("亿"):
+            return int(float(text[:-1]) * 100000000)
+        return int(float(text))
+    except ValueError:
+        return 0
+
+
+def parse_search_item(item):
+    """Converts one search/notes item into a card record, or None for non-note items (ads, queries)."""
+    if not isinstance(item, dict) or item.get("model_type") != "note":
+        return None
+    card = item.get("note_card") or {}
+    note_id = item.get("id") or card.get("note_id")
+    if not note_id:
+        return None
+    user = card.get("user") or {}
+    interact = card.get("interact_info") or {}
+    cover = card.get("cover") or {}
+    publish_date = None
+    for tag in card.get("corner_tag_info") or []:
+        if tag.get("type") == "publish_time":
+            publish_date = tag.get("text")
+    return {
+        "post_id": note_id,
+        "title": card.get("display_title") or card.get("title") or "",
+        "author": user.get("nickname") or user.get("nick_name") or "",
+        "publish_date": publish_date,
+        "likes": parse_count(interact.get("liked_count")),
+        "cover_url": cover.get("url_default") or cover.get("url") or "",
+        "note_type": card.get("type"),
+        "xsec_token": item.get("xsec_token"),
+    }
+
+
+def parse_feed_item(item):
+    """Converts one feed item (note detail) into a detail record, or None."""
+    card = (item or {}).get("note_card") or {}
+    note_id = (item or {}).get("id") or card.get("note_id")
+    if not note_id:
+        return None
+    interact = card.get("interact_info") or {}
+    images = [img.get("url_default") or img.get("url") for img in card.get("image_list") or []]
+    publish_date = None
+    if card.get("time"):
+        publish_date = datetime.fromtimestamp(card["time"] / 1000).strftime("%Y-%m-%d")
+    return {
+        "post_id": note_id,
+        "title": card.get("title") or "",
+        "content": card.get("desc") or "",
+        "images": [url for url in images if url],
+        "likes": parse_count(interact.get("liked_count")),
+        "collections": parse_count(interact.get("collected_count")),
+        "comments": parse_count(interact.get("comment_count")),
+        "publish_date": publish_date,
+    }
+
+
+class FeedCapture:
+    """Collects search cards and note details from API responses of one page."""
+
+    def __init__(self):
+        self.page = None
+        self.cards = {} # post_id -> card record
+        self.card_order = [] # post_ids in result order
+        self.details = {} # post_id -> detail record
+        self.last_search = None # Request body of the latest search/notes call (keyword, sort, note_type)
+        self.responses_seen = 0
+        self.parse_errors = 0
+
+    def attach(self, page):
+        if self.page is page:
+            return
+        self.detach()
+        self.page = page
+        page.on("response", self._on_response)
+
+    def detach(self):
+        if self.page is not None:
+            try:
+                self.page.remove_listener("response", self._on_response)
+            except Exception:
+                pass
+        self.page = None
+
+    def reset(self):
+        """Forgets the cards of the previous search (details are kept; they are per post)."""
+        self.cards.clear()
+        self.card_order.clear()
+        self.last_search = None
+
+    def card(self, post_id):
+        return self.cards.get(post_id)
+
+    def detail(self, post_id):
+        return self.details.get(post_id)
+
+    async def _on_response(self, response):
+        url = response.url
+        is_search = SEARCH_NOTES_PATTERN.search(url)
+        is_feed = FEED_PATTERN.search(url)
+        if not (is_search or is_feed):
+            return
+        self.responses_seen += 1
+        if is_search:
+            try:
+                self.last_search = response.request.post_data_json
+            except Exception:
+                pass
+        try:
+            payload = await response.json()
+        except Exception:
+            # Body unavailable (e.g. page navigated away) or not JSON
+            self.parse_errors += 1
+            return
+        try:
+            self.ingest(payload, "search" if is_search else "feed")
+        except Exception as e:
+            self.parse_errors += 1
+            print(f"[api_capture] Could not parse {url.split('?')[0]}: {e}")
+
+    def ingest(self, payload, kind):
+        """Adds the items of one search/notes or feed JSON payload. Returns the number of records."""
+        if isinstance(payload, (str, bytes)):
+            payload = json.loads(payload)
+        items = ((payload or {}).get("data") or {}).get("items") or []
+        added = 0
+        for item in items:
+            if kind == "search":
+                record = parse_search_item(item)
+                if record and record["post_id"] not in self.cards:
+                    self.cards[record["post_id"]] = record
+                    self.card_order.append(record["post_id"])
+                    added += 1
+            else:
+                record = parse_feed_item(item)
+                if record:
+                    self.details[record["post_id"]] = record
+                    added += 1
+        return added
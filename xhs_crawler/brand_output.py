@@ -0,0 +1,191 @@
+# xhs_crawler/brand_output.py
+# Crash-safe per-brand output for crawler.py.
+# Every post is appended to data/<brand>.jsonl as soon as its detail is parsed. The file is
+# fsynced every FSYNC_EVERY posts, and after each fsync the resume marker
+# state/resume/<brand>.json is updated with the last data-index and the post_ids written so far.
+# When the brand finishes, crawler.py writes the usual data/<brand>.json (what content_filter.py,
+# upload.py and image_direct_upload.py read), removes the JSONL file and marks the brand done.
+# After a crash the next run skips brands that are done and continues partial brands from their
+# JSONL file, without opening the posts that are already in it. Every marker records the crawl
+# date (the day its run started); a run only resumes markers of its own crawl date, so the next
+# daily crawl starts fresh even if yesterday's run left unfinished brands (and their markers)
+# behind. run() removes markers of other crawl dates at the start and all markers at the end.
+
+import os
+import re
+import json
+import shutil
+from datetime import date, datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESUME_DIR = os.path.join(SCRIPT_DIR, "state", "resume")
+FSYNC_EVERY = 10 # Posts per fsync (and marker update)
+
+
+def sanitize_brand_name(brand):
+    """File name stem for a brand (same rule as the <brand>.json files)."""
+    return re.sub(r'[\\/:*?"<>|]', '_', brand)[:100]
+
+
+def _write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def today_crawl_date():
+    return date.today().isoformat()
+
+
+def clear_resume_markers(resume_dir=RESUME_DIR):
+    """Removes all resume markers (called after a run finished every brand)."""
+    if os.path.isdir(resume_dir):
+        shutil.rmtree(resume_dir, ignore_errors=True)
+
+
+def clear_stale_markers(crawl_date, data_dir=None, resume_dir=RESUME_DIR):
+    """Removes markers of other crawl dates (and, with data_dir, their partial JSONL files). Returns the number removed."""
+    if not os.path.isdir(resume_dir):
+        return 0
+    removed = 0
+    for file_name in os.listdir(resume_dir):
+        if not file_name.endswith(".json"):
+            continue
+        marker_path = os.path.join(resume_dir, file_name)
+        try:
+            with open(marker_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("crawl_date") == crawl_date:
+                    continue
+        except (OSError, ValueError):
+            pass # Unreadable marker: stale as well
+        os.remove(marker_path)
+        if data_dir is not None:
+            jsonl_path = os.path.join(str(data_dir), file_name[:-len(".json")] + ".jsonl")
+            if os.path.exists(jsonl_path):
+                os.remove(jsonl_path)
+        removed += 1
+    return removed
+
+
+def all_brands_done(brands, crawl_date, resume_dir=RESUME_DIR):
+    """True if every brand has a marker of this crawl date that is marked done."""
+    for brand in brands:
+        marker_path = os.path.join(resume_dir, f"{sanitize_brand_name(brand)}.json")
+        try:
+            with open(marker_path, 'r', encoding='utf-8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not marker.get("done") or marker.get("crawl_date") != crawl_date:
+            return False
+    return True
+
+
+class BrandOutput:
+    def __init__(self, data_dir, brand, crawl_date, resume_dir=RESUME_DIR, fsync_every=FSYNC_EVERY):
+        self.brand = brand
+        self.crawl_date = crawl_date
+        stem = sanitize_brand_name(brand)
+        self.jsonl_path = os.path.join(str(data_dir), f"{stem}.jsonl")
+        self.marker_path = os.path.join(resume_dir, f"{stem}.json")
+        self.fsync_every = max(1, fsync_every)
+        self.marker = self._load_marker()
+        self.records = self._read_jsonl() if self.marker is not None else []
+        if self.marker is None and os.path.exists(self.jsonl_path):
+            os.remove(self.jsonl_path) # Leftover of an outdated crawl
+        self.seen_post_ids = {r["post_id"] for r in self.records if r.get("post_id")}
+        self.last_index = self.marker.get("last_index", -1) if self.marker else -1
+        self._file = None
+        self._unsynced = 0
+
+    def _load_marker(self):
+        if not os.path.exists(self.marker_path):
+            return None
+        try:
+            with open(self.marker_path, 'r', encoding='utf-8') as f:
+                marker = json.load(f)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable resume marker {self.marker_path}: {e}")
+            return None
+        if marker.get("crawl_date") != self.crawl_date:
+            return None # Left behind by an earlier crawl
+        return marker
+
+    def _read_jsonl(self):
+        """Records already written for this brand (a torn last line from a crash is dropped)."""
+        records = []
+        if not os.path.exists(self.jsonl_path):
+            return records
+        with open(self.jsonl_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    @property
+    def is_done(self):
+        return bool(self.marker and self.marker.get("done"))
+
+    @property
+    def is_partial(self):
+        return bool(self.marker) and not self.is_done and bool(self.records)
+
+    def is_seen(self, post_id):
+        return bool(post_id) and post_id in self.seen_post_ids
+
+    def _save_marker(self, done=False):
+        self.marker = {
+            "brand": self.brand,
+            "last_index": self.last_index,
+            "seen_post_ids": sorted(self.seen_post_ids),
+            "done": done,
+            "crawl_date": self.crawl_date,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        _write_json_atomic(self.marker_path, self.marker)
+
+    def _sync(self):
+        if self._file and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._save_marker()
+
+    def append(self, record, data_index):
+        """Appends one post; fsyncs and updates the resume marker every fsync_every posts."""
+        if self._file is None:
+            if self.records:
+                # Rewrite without a torn last line before appending to it
+                with open(self.jsonl_path, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in self.records)
+            self._file = open(self.jsonl_path, 'a', encoding='utf-8')
+            if self.marker is None:
+                self._save_marker() # From now on a crash leaves a resumable brand
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.records.append(record)
+        if record.get("post_id"):
+            self.seen_post_ids.add(record["post_id"])
+        self.last_index = max(self.last_index, data_index)
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self._sync()
+
+    def close(self):
+        """Fsyncs pending posts and updates the marker (the brand stays resumable)."""
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """Marks the brand done (after data/<brand>.json was written) and removes the JSONL file."""
+        self.close()
+        self._save_marker(done=True)
+        if os.path.exists(self.jsonl_path):
+            os.remove(self.jsonl_path)
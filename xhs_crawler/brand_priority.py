@@ -0,0 +1,136 @@
+# xhs_crawler/brand_priority.py
+# Brand crawl prioritization for the XHS click budget.
+# crawler.py opens at most 300 post details per hour, so the order of config.BRANDS decides
+# which brands get crawled at all. This module scores every candidate brand and returns an
+# ordered queue that fits the click budget of one crawl run:
+#   - ranking position: best 排名 of the brand across the selected dzdpdata rankings
+#   - staleness: time since the brand was last crawled on XHS
+#   - yield: related posts (content_filter keywords) per detail click in earlier crawls
+#   - new arrivals: brands that have never been crawled
+# crawler.py records every finished brand in state/crawl_history.json (record_crawl), which
+# feeds the staleness, yield and expected-click estimates of the next run.
+# Weights and budget come from main/config.py (see get_brand.py).
+
+import os
+import json
+from datetime import datetime
+
+from content_filter import contains_keywords
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = os.path.join(SCRIPT_DIR, "state", "crawl_history.json")
+
+DEFAULT_WEIGHTS = {"rank": 0.35, "staleness": 0.30, "yield": 0.20, "new": 0.15}
+DEFAULT_CLICK_BUDGET = 600 # Detail clicks per crawl run (2 hours at 300 clicks/hour)
+DEFAULT_CLICKS_PER_BRAND = 20 # Expected clicks for a brand without history
+MIN_RECRAWL_HOURS = 20 # Brands crawled more recently than this are not queued (< 24h, see main/config.py)
+STALE_AFTER_DAYS = 7 # Staleness score reaches 1.0 after this many days
+RANK_DEPTH = 30 # Rank 1 scores 1.0, rank RANK_DEPTH and below score ~0
+
+# Yield prior: a brand without history is assumed to have PRIOR_YIELD related posts per click,
+# weighted like PRIOR_CLICKS clicks, so one small crawl does not swing the estimate
+PRIOR_YIELD = 0.5
+PRIOR_CLICKS = 10
+
+
+def load_history(path=HISTORY_FILE):
+    """Returns {brand: entry} from the crawl history file ({} if missing or unreadable)."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read crawl history {path}: {e}")
+        return {}
+
+
+def save_history(history, path=HISTORY_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def record_crawl(brand, posts, clicks, path=HISTORY_FILE, now=None):
+    """Adds one finished brand crawl (posts saved, detail clicks spent) to the history file."""
+    history = load_history(path)
+    related = sum(1 for post in posts if contains_keywords(post.get("content")))
+    entry = history.setdefault(brand, {"crawls": 0, "posts": 0, "related": 0, "clicks": 0})
+    entry["crawls"] += 1
+    entry["posts"] += len(posts)
+    entry["related"] += related
+    entry["clicks"] += clicks
+    entry["last_clicks"] = clicks
+    entry["last_crawled"] = (now or datetime.now()).isoformat(timespec="seconds")
+    save_history(history, path)
+    return entry
+
+
+def hours_since_crawl(entry, now):
+    if not entry or not entry.get("last_crawled"):
+        return None
+    return (now - datetime.fromisoformat(entry["last_crawled"])).total_seconds() / 3600
+
+
+def expected_clicks(entry, default=DEFAULT_CLICKS_PER_BRAND):
+    """Clicks a brand is expected to cost: average of earlier crawls, else the default."""
+    if entry and entry.get("crawls"):
+        return max(1, round(entry["clicks"] / entry["crawls"]))
+    return default
+
+
+def score_brand(best_rank, entry, now, weights=None):
+    """Returns (score, components) for one brand. Every component is in [0, 1]."""
+    weights = weights or DEFAULT_WEIGHTS
+    rank_score = max(0.0, 1 - (best_rank - 1) / RANK_DEPTH) if best_rank else 0.0
+    hours = hours_since_crawl(entry, now)
+    staleness = 1.0 if hours is None else min(1.0, hours / (STALE_AFTER_DAYS * 24))
+    clicks = (entry or {}).get("clicks", 0)
+    related = (entry or {}).get("related", 0)
+    yield_score = min(1.0, (related + PRIOR_YIELD * PRIOR_CLICKS) / (clicks + PRIOR_CLICKS))
+    new = 1.0 if hours is None else 0.0
+
+    components = {"rank": rank_score, "staleness": staleness, "yield": yield_score, "new": new}
+    score = sum(weights.get(name, 0) * value for name, value in components.items())
+    return score, components
+
+
+def build_crawl_queue(brand_ranks, history=None, budget=DEFAULT_CLICK_BUDGET, weights=None,
+                      min_recrawl_hours=MIN_RECRAWL_HOURS, default_clicks=DEFAULT_CLICKS_PER_BRAND, now=None):
+    """
+    Orders candidate brands ({brand: best_rank}) by score and keeps the best ones that fit into
+    budget expected clicks (None = no budget). Brands crawled within min_recrawl_hours are skipped.
+    Returns a list of dicts {brand, score, expected_clicks, components}, highest score first.
+    """
+    history = load_history() if history is None else history
+    now = now or datetime.now()
+
+    scored = []
+    for brand, best_rank in brand_ranks.items():
+        entry = history.get(brand)
+        hours = hours_since_crawl(entry, now)
+        if hours is not None and hours < min_recrawl_hours:
+            continue
+        score, components = score_brand(best_rank, entry, now, weights)
+        scored.append({"brand": brand, "score": score,
+                       "expected_clicks": expected_clicks(entry, default_clicks), "components": components})
+    scored.sort(key=lambda item: (-item["score"], item["brand"]))
+
+    queue = []
+    spent = 0
+    for item in scored:
+        if budget is not None and queue and spent + item["expected_clicks"] > budget:
+            continue # A cheaper, lower-scored brand may still fit
+        queue.append(item)
+        spent += item["expected_clicks"]
+    return queue
+
+
+def print_queue(queue, skipped=0):
+    total = sum(item["expected_clicks"] for item in queue)
+    print(f"Crawl queue: {len(queue)} brands, ~{total} expected clicks ({skipped} candidates not queued)")
+    for i, item in enumerate(queue, 1):
+        parts = ", ".join(f"{name} {value:.2f}" for name, value in item["components"].items())
+        print(f"  {i:>3}. {item['brand']}  score {item['score']:.3f}  ~{item['expected_clicks']} clicks  ({parts})")
@@ -0,0 +1,80 @@
+# xhs_crawler/card_feed.py
+# Event-driven card detection for crawl_posts.
+# An in-page MutationObserver (xhs_selectors.card_observer_script) reports every result card that
+# is rendered or changes through page.expose_binding. CardFeed keeps the latest payload per
+# data-index and wakes up waiters through an asyncio queue, so crawl_posts waits exactly until the
+# card it needs arrives instead of polling with timeouts, and decides when to scroll from the
+# number of rendered cards it has not processed yet (pending_after).
+# If the binding cannot be installed, active stays False and crawl_posts uses scan_cards().
+
+import asyncio
+
+import xhs_selectors
+
+
+class CardFeed:
+    def __init__(self, note_id_from_href):
+        self.note_id_from_href = note_id_from_href
+        self.page = None
+        self.active = False
+        self.cards = {} # data-index -> latest card payload
+        self.queue = asyncio.Queue() # data-indexes in arrival order
+        self.events = 0
+        self._installed = [] # Pages that already have the binding (it can only be exposed once per page)
+
+    async def attach(self, page):
+        """Installs the binding and observer on page (once per page; the init script covers navigations)."""
+        if self.page is page:
+            return
+        self.page = page
+        self.active = False
+        if any(p is page for p in self._installed):
+            self.active = True # Switched back to a page that still has the binding and observer
+            return
+        self._installed = [p for p in self._installed if not p.is_closed()]
+        await page.expose_binding(xhs_selectors.CARD_BINDING, self._on_cards)
+        await page.add_init_script(xhs_selectors.card_observer_script())
+        self._installed.append(page)
+        await page.evaluate(xhs_selectors.card_observer_script()) # Document that is already loaded
+        self.active = True
+
+    def _on_cards(self, source, cards):
+        # Bindings are called for every frame of the page; only the top document has the results
+        if source.get("frame") is not None and self.page is not None and source["frame"] != self.page.main_frame:
+            return
+        for card in cards or []:
+            if not card.get("visible"):
+                continue
+            card["note_id"] = self.note_id_from_href(card.get("href"))
+            self.cards[card["index"]] = card
+            self.queue.put_nowait(card["index"])
+            self.events += 1
+
+    async def reset(self):
+        """Forgets the cards of the previous result list (call before a new search or sort) and has the page resend what it shows."""
+        self.cards.clear()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        if self.active and self.page is not None and not self.page.is_closed():
+            try:
+                await self.page.evaluate(xhs_selectors.CARD_RESEND_JS)
+            except Exception:
+                pass # Page is navigating; the init script starts a fresh observer
+
+    def pending_after(self, index):
+        """Rendered cards after index that have not been processed yet."""
+        return sum(1 for i in self.cards if i > index)
+
+    async def wait_for(self, index, timeout):
+        """Returns the card with data-index index as soon as it is reported, or None after timeout seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while index not in self.cards:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+        return self.cards[index]
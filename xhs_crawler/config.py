@@ -25,6 +25,47 @@ BRANDS = [
 # Minimum number of likes required for a post to be crawled
 LIKE_THRESHOLD = 500
 
+# Read card and detail data from the search/feed API responses the page loads (crawler.py
+# falls back to DOM scraping for posts that were not captured). Set to False to always scrape the DOM.
+USE_API_CAPTURE = True
+
+# Number of browser tabs crawling brands in parallel (crawler.py worker pool). Every tab has its
+# own brand queue; the click limit and pacing below are shared by all tabs (pacing.py).
+CRAWL_WORKERS = 1
+
+# Account-wide detail-open rate (token bucket, state kept in state/click_bucket.json) and anti-burst pacing
+CLICK_RATE_PER_HOUR = 300 # Average detail opens per hour
+CLICK_BURST = 20 # Detail opens allowed back to back after an idle period
+MIN_CLICK_INTERVAL_SECONDS = 4.0 # Minimum gap between two detail opens of any tabs
+MIN_ACTION_INTERVAL_SECONDS = 1.5 # Minimum gap between two searches/navigations of any tabs
+
+# Posts whose detail was stored within this many days are not opened again; only their card-level
+# likes are saved (state/known_posts.json). 0 opens every post.
+KNOWN_POST_REFRESH_DAYS = 7
+
+# Resource types aborted by request routing (resource_policy.py); the crawler reads image URLs, not
+# image bytes. An empty list turns routing off (routing also bypasses the browser's HTTP cache).
+BLOCK_RESOURCE_TYPES = ["image", "media", "font"]
+# Let blocked resource types load while a post detail is open
+ALLOW_RESOURCES_IN_DETAIL = False
+
+# Open search results directly by URL instead of typing the brand, clicking the 图文 tab and the
+# 最多点赞 filter. The result is verified against the captured search request (needs USE_API_CAPTURE);
+# on failure crawler.py falls back to the UI flow. Override SEARCH_URL_PARAMS /
+# SEARCH_EXPECTED_REQUEST here if XHS changes its URL parameters.
+DIRECT_SEARCH = True
+
+# Load the next brand's search results on a second tab while the current brand is crawled
+PREFETCH_NEXT_BRAND = True
+
+# Detect rendered result cards with an in-page MutationObserver (card_feed.py) instead of scanning
+USE_CARD_OBSERVER = True
+
+# Replace the crawler's tab with a fresh one of the same browser context (login is kept) every
+# PAGE_RECYCLE_EVERY_BRANDS brands, or when its JS heap exceeds PAGE_RECYCLE_HEAP_MB. 0 disables either.
+PAGE_RECYCLE_EVERY_BRANDS = 25
+PAGE_RECYCLE_HEAP_MB = 400
+
 # Path to the .env file is already stored in DOTENV_PATH
 # The code below that tries to find it again is redundant
 # # DOTENV_PATH = find_dotenv()
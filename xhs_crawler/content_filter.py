@@ -7,11 +7,16 @@
 # Keywords are now hardcoded in this file.
 # Added debugging prints for content checking.
 # Updated to print the specific keyword found.
+# Keeps card-only records (known posts saved without content by crawler.py) unfiltered.
+# Dropped posts are marked in the known posts cache (known_posts.py), so the crawler does not
+# reopen unrelated posts every day (upload.py marks the posts it stores).
 
 import os
 import json
 import sys
 
+import known_posts
+
 # Keywords hardcoded directly into the script
 
 FOOD_RELATED_KEYWORDS = [
@@ -231,11 +236,12 @@ def contains_keywords(text):
             return keyword # Return the specific keyword found
     return None # Return None if loop completes without finding any keyword
 
-def process_json_file(file_path):
+def process_json_file(file_path, dropped_posts=None):
     """Reads a JSON file, filters its content based on keywords, prints found keywords, and overwrites it.
     
     Args:
         file_path (str): The full path to the JSON file.
+        dropped_posts (list): If given, the removed items are appended to it once the file is written.
     """
     basename = os.path.basename(file_path)
     try:
@@ -252,6 +258,7 @@ def process_json_file(file_path):
 
         original_count = len(data)
         filtered_data = []
+        removed_items = []
         removed_count_debug = 0 # For debugging print
         
         print(f"  Checking {original_count} items in {basename}...") # Debug print
@@ -261,6 +268,11 @@ def process_json_file(file_path):
                 print(f"    Item {index}: Skipping non-dictionary item.") # Debug print
                 continue 
                 
+            # Card-only records (known posts, no detail opened) have no content; they only update likes
+            if item.get('card_only'):
+                filtered_data.append(item)
+                continue
+
             content = item.get('content', None)
             
             # --- Debugging Print: Show content being checked ---
@@ -275,6 +287,7 @@ def process_json_file(file_path):
                 print(f"    Item {index}: Kept (Found keyword: '{found_keyword}') Content snippet: '{str(content)[:50]}...'") 
             else:
                  removed_count_debug += 1
+                 removed_items.append(item)
                  # Optional: Print removed items if needed for deep debugging
                  # print(f"    Item {index}: Removing (No keyword found). Content snippet: '{str(content)[:50]}...'")
 
@@ -290,6 +303,8 @@ def process_json_file(file_path):
             try:
                 with open(file_path, 'w', encoding='utf-8') as f:
                     json.dump(filtered_data, f, ensure_ascii=False, indent=4)
+                if dropped_posts is not None:
+                    dropped_posts.extend(removed_items)
             except IOError as e:
                 print(f"  Error writing to {basename}: {e}")
         else:
@@ -318,12 +333,13 @@ def filter_json_files(data_directory):
         return
 
     processed_files = 0
+    dropped_posts = []
     for filename in os.listdir(data_directory):
         if filename.lower().endswith('.json'):
             file_path = os.path.join(data_directory, filename)
             if os.path.isfile(file_path):
                 print(f"\nProcessing file: {filename}...") # Add newline for better readability per file
-                process_json_file(file_path)
+                process_json_file(file_path, dropped_posts)
                 processed_files += 1
             else:
                 print(f"Skipping {filename}, not a file.")
@@ -333,6 +349,12 @@ def filter_json_files(data_directory):
             pass
             
     print(f"\nContent filtering complete. Processed {processed_files} JSON files in '{data_directory}'.")
+    if dropped_posts:
+        try:
+            known_posts.mark_and_save(dropped_posts)
+            print(f"Marked {len(dropped_posts)} unrelated posts as known (not reopened for a while).")
+        except OSError as e:
+            print(f"Warning: Could not update the known posts cache: {e}")
 
 if __name__ == "__main__":
     # Assume the script is in xhs_crawler and data is a subdirectory
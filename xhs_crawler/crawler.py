@@ -10,6 +10,32 @@
 # - Corrected config variable from BRANDS_TO_SEARCH back to BRANDS.
 # - Added simplified random_like_post function (1/3 chance, no active check) called from open_post_detail.
 # - Implemented 60-minute timer and 300-post click limit logic in extract_post_data.
+# - Records each finished brand (posts, detail clicks) in state/crawl_history.json for brand_priority.py.
+# - API capture mode (api_capture.py): card and detail data come from the search/notes and feed JSON
+#   the page loads anyway; the per-card DOM reads and detail DOM reads are the fallback.
+# - crawl_posts reads all rendered cards with one page.evaluate per scroll (xhs_selectors.py)
+#   and clicks covers through locators instead of per-card element handles.
+# - open_post_detail reads the detail mask with one evaluate (versioned DETAIL_SELECTOR_VERSIONS).
+# - Worker-pool mode (config.CRAWL_WORKERS > 1): several tabs of the same context crawl their own
+#   brand queues; the click limit and anti-burst pacing are global (pacing.py).
+# - The fixed 300-clicks-per-hour window is replaced by a persisted token bucket (pacing.TokenBucket);
+#   a token is taken right before the cover click and refunded if the click fails.
+# - Known posts (known_posts.py) refreshed recently are saved as card-only records (likes) without
+#   opening their detail. Posts become known when upload.py stored them, not when they are crawled.
+# - Posts are appended to data/<brand>.jsonl as they are parsed (brand_output.py, fsync batching and
+#   resume markers); <brand>.json is written when the brand completes. After a crash, finished
+#   brands are skipped and partial brands continue without reopening saved posts (markers of the
+#   same crawl date only; the next day's run starts fresh).
+# - Request routing (resource_policy.py) aborts image/media/font requests while crawling.
+# - search_brand opens the search results URL directly (keyword, note type and sort as query
+#   parameters), verified against the captured search request; the click-through flow is the fallback.
+# - The next brand's results are prefetched on a secondary page while the current brand is crawled.
+# - New cards are pushed by an in-page MutationObserver (card_feed.py) instead of polled; scrolling
+#   follows the number of rendered, unprocessed cards.
+# - Details parsed in this run are kept by post_id; a post found again under another brand reuses
+#   the detail and only adds the brand (post_brand relation on upload).
+# - No ElementHandles are kept: cards and details are read with evaluate() and clicked through
+#   locators. The page is recycled every PAGE_RECYCLE_EVERY_BRANDS brands or above PAGE_RECYCLE_HEAP_MB.
 
 import asyncio
 import json
@@ -20,13 +46,33 @@ import time
 from datetime import datetime
 from playwright.async_api import async_playwright, Error as PlaywrightError, Playwright
 import config
+import brand_priority
+import api_capture
+import xhs_selectors
+import pacing
+import known_posts
+import brand_output
+import resource_policy
+import card_feed
 from tqdm import tqdm
 import re # Ensure re is imported
 import shutil # Add shutil import for potential future use, and helps group os/pathlib
 from pathlib import Path # Ensure Path is imported
+from urllib.parse import urlencode
+
+SEARCH_RESULT_URL = "https://www.xiaohongshu.com/search_result"
+# Query parameters of the direct search URL (keyword is added per brand), and the values the
+# resulting search/notes request must have: sort by most likes, image-and-text notes only
+DEFAULT_SEARCH_URL_PARAMS = {"source": "web_search_result_notes", "type": "51", "sort": "popularity_descending", "note_type": "2"}
+DEFAULT_SEARCH_EXPECTED_REQUEST = {"sort": "popularity_descending", "note_type": 2}
+DIRECT_SEARCH_MAX_FAILURES = 3 # Consecutive failures before the run sticks to the search UI
+FEED_WAIT_SECONDS = 3.0 # Longest wait for the observer to report the expected card before scrolling
+FEED_LOW_WATERMARK = 4 # Scroll ahead when fewer unprocessed cards than this are rendered
+# Fields of a parsed detail that a post found again under another brand reuses
+DETAIL_FIELDS = ("post_id", "content", "images", "collections", "comments")
 
 class XHSCrawler:
-    def __init__(self):
+    def __init__(self, pacer=None, worker_id=0, known=None, run_details=None, crawl_date=None):
         self.browser = None
         self.context = None
         self.page = None
@@ -40,10 +86,67 @@ class XHSCrawler:
         self.data_dir = script_dir / "data" # Make 'data' relative to the script's dir
         # --- End change ---
         self.data_dir.mkdir(parents=True, exist_ok=True) # Ensure directory exists
-        self.post_click_count = 0
-        self.window_start_time = 0 # Will be set in run()
-        self.POST_CLICK_LIMIT = 300
-        self.TIME_WINDOW_SECONDS = 3600 # 60 minutes
+        self.brand_click_count = 0 # Detail clicks spent on the current brand (crawl history)
+        # Click limit and anti-burst pacing are shared by all workers (tabs) of a run
+        self.pacer = pacer or pacing.GlobalPacer(
+            rate_per_hour=getattr(config, "CLICK_RATE_PER_HOUR", pacing.DEFAULT_CLICK_RATE_PER_HOUR),
+            burst=getattr(config, "CLICK_BURST", pacing.DEFAULT_CLICK_BURST),
+            min_click_interval=getattr(config, "MIN_CLICK_INTERVAL_SECONDS", pacing.DEFAULT_MIN_CLICK_INTERVAL),
+            min_action_interval=getattr(config, "MIN_ACTION_INTERVAL_SECONDS", pacing.DEFAULT_MIN_ACTION_INTERVAL))
+        # Posts whose detail was stored recently only get a card-level record (shared by all workers)
+        self.known = known or known_posts.KnownPosts(
+            refresh_days=getattr(config, "KNOWN_POST_REFRESH_DAYS", known_posts.DEFAULT_REFRESH_DAYS))
+        # post_id -> parsed detail of every post opened in this run (shared by all workers), so a post
+        # found again under another brand reuses its detail instead of being opened again
+        self.run_details = run_details if run_details is not None else {}
+        self.reused_details = 0
+        # Day the run started; resume markers of other days are not resumed (see brand_output.py)
+        self.crawl_date = crawl_date or brand_output.today_crawl_date()
+        self.direct_search_failures = 0 # Consecutive direct search failures (fallback to the UI flow)
+        self.prefetcher = None # Crawler on the secondary page that loads the next brand's results
+        self.prefetch_task = None
+        self.prefetch_brand = None
+        self.page_brands = 0 # Brands crawled on the current page (page recycling)
+        self.worker_id = worker_id
+        self.worker_tag = f" [worker {worker_id}]" if worker_id else ""
+        # Card/detail data from intercepted API responses (DOM scraping is the fallback)
+        self.use_api_capture = getattr(config, "USE_API_CAPTURE", True)
+        # Direct search URLs are verified against the captured search request, so they need API capture
+        self.use_direct_search = getattr(config, "DIRECT_SEARCH", True) and self.use_api_capture
+        self.capture = api_capture.FeedCapture()
+        self.capture_stats = {"api_cards": 0, "dom_cards": 0, "api_details": 0, "dom_details": 0}
+        # Newly rendered result cards pushed from the page (see card_feed.py); scan_cards() is the fallback
+        self.use_card_observer = getattr(config, "USE_CARD_OBSERVER", True)
+        self.feed = card_feed.CardFeed(self.note_id_from_href)
+        # Images, media and fonts are not needed for scraping (see resource_policy.py)
+        self.resources = resource_policy.ResourcePolicy(
+            blocked_types=getattr(config, "BLOCK_RESOURCE_TYPES", resource_policy.DEFAULT_BLOCKED_TYPES),
+            allow_in_detail=getattr(config, "ALLOW_RESOURCES_IN_DETAIL", False))
+
+    async def _prepare_page(self, page):
+        """Attaches listeners and routes to the page the crawler works on. Called whenever self.page is (re)set."""
+        if self.use_api_capture:
+            self.capture.attach(page)
+        try:
+            await self.resources.attach(page)
+        except Exception as route_err:
+            print(f"Warning: Could not install request routing: {route_err}")
+        if self.use_card_observer:
+            try:
+                await self.feed.attach(page)
+            except Exception as observer_err:
+                print(f"Warning: Could not install the card observer: {observer_err}. Scanning cards instead.")
+
+    async def reset_results(self):
+        """Forgets captured cards of the previous result list (call before a new search or sort)."""
+        self.capture.reset()
+        await self.feed.reset()
+
+    @staticmethod
+    def note_id_from_href(href):
+        """Extracts the 24-hex note id from a card or detail URL."""
+        match = re.search(r"/(?:explore|search_result|discovery/item)/([0-9a-fA-F]{24})", href or "")
+        return match.group(1) if match else None
         
     async def connect_to_existing_browser(self, p: Playwright):
         """Connect to an already running browser instance and use its existing page."""
@@ -105,6 +208,7 @@ class XHSCrawler:
             # --- End: Revised logic - Use existing page --- 
 
             print("Successfully connected to existing browser and page is ready.")
+            await self._prepare_page(self.page)
             # Verify login state on the page we are using
             try:
                 await self.page.wait_for_selector("li.user.side-bar-component", timeout=10000, state="visible")
@@ -144,6 +248,17 @@ class XHSCrawler:
         
         self.current_brand = brand_name
         print(f"Searching for brand: {brand_name}")
+
+        # Fast path: open the results URL with keyword, note type and sort order already set
+        if self.use_direct_search:
+            if await self.search_brand_direct(brand_name):
+                self.direct_search_failures = 0
+                return True
+            self.direct_search_failures += 1
+            if self.direct_search_failures >= DIRECT_SEARCH_MAX_FAILURES:
+                print(f"Direct search URL failed {self.direct_search_failures} times in a row. Using the search UI for the rest of the run.")
+                self.use_direct_search = False
+            print("Falling back to the search UI...")
         
         try:
             # Ensure page is on the explore page before searching
@@ -155,12 +270,16 @@ class XHSCrawler:
             except Exception as nav_err:
                  print(f"Error ensuring base URL before search: {nav_err}. Attempting to continue...")
 
+            # Searches of all workers are spaced by the shared pacer
+            await self.pacer.acquire_action()
+
             # Click search box
             print("Locating search input...")
             search_box = self.page.locator("input.search-input")
             await search_box.wait_for(state="visible", timeout=10000)
             print("Clicking search input...")
             await search_box.click()
+            await self.reset_results()
             print(f"Filling search input with: {brand_name}")
             await search_box.fill(brand_name)
             print("Pressing Enter...")
@@ -225,6 +344,42 @@ class XHSCrawler:
                  print(f"Could not save screenshot: {ss_err}")
             return False
     
+    def search_url(self, brand_name):
+        """Search results URL with the keyword, note type and sort order as query parameters."""
+        params = dict(getattr(config, "SEARCH_URL_PARAMS", DEFAULT_SEARCH_URL_PARAMS))
+        params["keyword"] = brand_name
+        return f"{SEARCH_RESULT_URL}?{urlencode(params)}"
+
+    async def search_brand_direct(self, brand_name):
+        """Opens the search results URL directly and verifies the results are 图文 sorted by most likes."""
+        url = self.search_url(brand_name)
+        try:
+            await self.pacer.acquire_action()
+            await self.reset_results()
+            print(f"Opening search URL: {url}")
+            await self.page.goto(url)
+            await self.page.wait_for_selector(xhs_selectors.CARD_SELECTORS["item"], state="visible", timeout=15000)
+            await self._wait_randomly(1.0, 2.0)
+        except Exception as e:
+            print(f"Direct search URL did not load results for {brand_name}: {e}")
+            return False
+        return self.verify_search(brand_name)
+
+    def verify_search(self, brand_name):
+        """Checks the captured search/notes request: keyword, sort order and note type must match."""
+        search = self.capture.last_search if self.use_api_capture else None
+        if not search:
+            print("Could not verify the direct search (no search request captured).")
+            return False
+        expected = dict(getattr(config, "SEARCH_EXPECTED_REQUEST", DEFAULT_SEARCH_EXPECTED_REQUEST))
+        expected["keyword"] = brand_name
+        mismatched = {key: search.get(key) for key, value in expected.items() if search.get(key) != value}
+        if mismatched:
+            print(f"Direct search returned a different search than requested: {mismatched} (expected {expected}).")
+            return False
+        print(f"Direct search verified: {expected}")
+        return True
+
     async def apply_like_filter(self):
         """Apply filter to sort by most likes"""
         if not self.page or self.page.is_closed():
@@ -242,6 +397,8 @@ class XHSCrawler:
             print("Locating and clicking '最多点赞' option...")
             most_likes_option = self.page.locator('div.filter-panel span:has-text("最多点赞")')
             await most_likes_option.wait_for(state="visible", timeout=10000)
+            # Cards captured so far belong to the default sort order; keep only the sorted results
+            await self.reset_results()
             await most_likes_option.click()
             
             print("Sorted by most likes")
@@ -275,108 +432,107 @@ class XHSCrawler:
         except Exception as e:
             print(f"Error during random like attempt: {e}")
 
-    async def extract_post_data(self, post_element, data_index):
-        """Extract basic data from a post card using ElementHandle methods."""
-        post_data = {"brand": self.current_brand, "data_index": data_index, "likes": 0}
-        post_id_for_error = f"brand_{self.current_brand}_idx_{data_index}" # Default identifier
-
-        # --- Time/Click Limit Check --- BEFORE attempting to click/open
+    async def consume_post_click(self):
+        """Takes one token of the shared click bucket for a detail open, waiting for the pacer if needed."""
         try:
-            current_time = time.monotonic()
-            elapsed_time = current_time - self.window_start_time
-
-            # Check if time window expired
-            if elapsed_time >= self.TIME_WINDOW_SECONDS:
-                print(f"\n*** Time window ({self.TIME_WINDOW_SECONDS}s) elapsed. Resetting post click count ({self.post_click_count} -> 0) and timer. ***")
-                self.post_click_count = 0
-                self.window_start_time = current_time
-                elapsed_time = 0 # Reset elapsed time for the current check
-
-            # Check if post click limit reached
-            if self.post_click_count >= self.POST_CLICK_LIMIT:
-                print(f"\n--- Post click limit ({self.POST_CLICK_LIMIT}) reached. Checking time window... ---")
-                remaining_time = self.TIME_WINDOW_SECONDS - elapsed_time
-                if remaining_time > 0:
-                    print(f"---> Time window has {remaining_time:.2f} seconds remaining.")
-                    print(f"---> PAUSING script for {remaining_time:.2f} seconds to respect limit...")
-                    await asyncio.sleep(remaining_time + 1) # Add 1s buffer
-                    print(f"---> RESUMING script after pause.")
-                else:
-                    print(f"---> Time window already elapsed or finished.")
-                
-                # Reset counter and timer after waiting or if window was already done
-                print(f"---> Resetting post click count ({self.post_click_count} -> 0) and timer.")
-                self.post_click_count = 0
-                self.window_start_time = time.monotonic()
-
-            # Increment count *before* the action that consumes the limit (opening detail)
-            self.post_click_count += 1
-            print(f"[Limit Status] Post Count: {self.post_click_count}/{self.POST_CLICK_LIMIT}, Time Elapsed: {elapsed_time:.2f}/{self.TIME_WINDOW_SECONDS}s")
-
+            await self.pacer.acquire_click(self.worker_tag)
+            self.brand_click_count += 1
+            return True
         except Exception as limit_check_err:
             print(f"Error during post click limit check: {limit_check_err}")
             # Decide if we should continue or stop? For now, let's continue but log.
-        # --- End Time/Click Limit Check ---
+            return False
+
+    def refund_post_click(self):
+        """Returns the token of a detail open that did not happen."""
+        self.pacer.refund_click()
+        self.brand_click_count -= 1
 
+    async def scan_cards(self):
+        """Reads all rendered, visible result cards in one evaluate. Returns {data_index: card}."""
         try:
-            # Use query_selector relative to the post_element (ElementHandle)
-            # Title
-            title_element = await post_element.query_selector('div.footer a.title')
-            if title_element:
-                 post_data["title"] = await title_element.inner_text()
-            
-            # Author
-            author_element = await post_element.query_selector('div.card-bottom-wrapper a.author div.name span.name')
-            if author_element:
-                 post_data["author"] = await author_element.inner_text()
-            
-            # Publish Time
-            time_element = await post_element.query_selector('div.card-bottom-wrapper a.author span.time')
-            if time_element:
-                 post_data["publish_date"] = await time_element.inner_text()
-            
-            # Like Count
-            like_element = await post_element.query_selector('span.like-wrapper span.count') 
-            if like_element:
-                like_text = await like_element.inner_text()
-                like_text = like_text.strip()
-                if like_text:
-                    if "万" in like_text:
-                        like_count = float(like_text.replace('万', '')) * 10000
-                    elif like_text.isdigit(): 
-                        like_count = int(like_text)
-                    else: 
-                        like_count = 0 
-                    post_data["likes"] = int(like_count)
-            
-            # Check like threshold
-            if post_data["likes"] < config.LIKE_THRESHOLD:
-                print(f'Post {data_index} has {post_data["likes"]} likes, below threshold of {config.LIKE_THRESHOLD}')
-                # Clean up handles if query_selector was used
-                if title_element: await title_element.dispose()
-                if author_element: await author_element.dispose()
-                if time_element: await time_element.dispose()
-                if like_element: await like_element.dispose()
-                return None # Signal to stop crawling this brand
-            
-            # Clean up handles
-            if title_element: await title_element.dispose()
-            if author_element: await author_element.dispose()
-            if time_element: await time_element.dispose()
-            if like_element: await like_element.dispose()
-            return post_data
-            
+            cards = await self.page.evaluate(xhs_selectors.CARD_SCAN_JS, xhs_selectors.CARD_SELECTORS)
         except Exception as e:
-            print(f"Error extracting post data for index {data_index}: {e}")
-            # Clean up handles in case of error during processing
-            if 'title_element' in locals() and title_element: await title_element.dispose()
-            if 'author_element' in locals() and author_element: await author_element.dispose()
-            if 'time_element' in locals() and time_element: await time_element.dispose()
-            if 'like_element' in locals() and like_element: await like_element.dispose()
-            return post_data # Return partial data or default likes=0
+            print(f"Error scanning result cards: {e}")
+            return {}
+        for card in cards:
+            card["note_id"] = self.note_id_from_href(card.get("href"))
+        return {card["index"]: card for card in cards}
+
+    async def extract_post_data(self, card):
+        """Builds the basic post data of a scanned card: from the captured API card if available, else from the scan."""
+        data_index = card["index"]
+        post_data = {"brand": self.current_brand, "data_index": data_index, "likes": 0}
+
+        api_card = self.capture.card(card.get("note_id")) if self.use_api_capture else None
+        if api_card:
+            self.capture_stats["api_cards"] += 1
+            post_data.update({
+                "post_id": api_card["post_id"],
+                "title": api_card["title"],
+                "author": api_card["author"],
+                "likes": api_card["likes"],
+            })
+            if api_card.get("publish_date"):
+                post_data["publish_date"] = api_card["publish_date"]
+        else:
+            self.capture_stats["dom_cards"] += 1
+            if card.get("title"):
+                post_data["title"] = card["title"]
+            if card.get("author"):
+                post_data["author"] = card["author"]
+            if card.get("time"):
+                post_data["publish_date"] = card["time"]
+            post_data["likes"] = api_capture.parse_count(card.get("likes"))
+
+        # Check like threshold
+        if post_data["likes"] < config.LIKE_THRESHOLD:
+            print(f'Post {data_index} has {post_data["likes"]} likes, below threshold of {config.LIKE_THRESHOLD}')
+            return None # Signal to stop crawling this brand
+        return post_data
+    
+    async def scan_detail(self):
+        """Reads note id, content, image URLs and count texts of the open detail mask in one evaluate (None if no known mask)."""
+        try:
+            return await self.page.evaluate(xhs_selectors.DETAIL_SCAN_JS, xhs_selectors.DETAIL_SELECTOR_VERSIONS)
+        except Exception as e:
+            print(f"Error scanning note detail: {e}")
+            return None
+
+    def detail_from_scan(self, scan, post_id_for_error):
+        """Builds content, images and counts from a detail scan (fallback when no feed detail was captured)."""
+        post_detail = {}
+        post_detail["content"] = scan.get("content", "")
+        print(f"Extracted content length: {len(post_detail['content'])} (selectors {scan.get('version')})")
+
+        image_srcs_all = scan.get("images") or []
+        print(f"Initially extracted {len(image_srcs_all)} image URLs.")
+
+        # Discard first and last image if more than 2 images were found (slider clones)
+        image_srcs_final = []
+        if len(image_srcs_all) > 2:
+            image_srcs_final = image_srcs_all[1:-1] 
+            print(f"Discarding first and last images. Keeping {len(image_srcs_final)} images.")
+        elif len(image_srcs_all) > 0: 
+             print(f"Found {len(image_srcs_all)} images, discarding them as per rule.")
+
+        # Join the final list with ", " (comma and space)
+        post_detail["images"] = ", ".join(image_srcs_final)
+        print(f"Saved {len(image_srcs_final)} image URLs (comma-space separated).")
+
+        if not scan.get("counts_found"):
+            print(f"Post {post_id_for_error}: Could not find counts area (engage-bar or action-container). Counts will be 0.")
+        post_detail["collections"] = api_capture.parse_count(scan.get("collections"))
+        post_detail["comments"] = api_capture.parse_count(scan.get("comments"))
+        print(f"Collection count: {post_detail['collections']}, Comment count: {post_detail['comments']}")
+        return post_detail
     
-    async def open_post_detail(self, post_element):
-        """Open post detail page and extract additional data using ElementHandle methods."""
+    async def open_post_detail(self, data_index):
+        """Open the detail of the card with the given data-index and extract additional data."""
+        async with self.resources.detail_view():
+            return await self._open_post_detail(data_index)
+
+    async def _open_post_detail(self, data_index):
         if not self.page or self.page.is_closed():
             print("Error: Page is not available or closed before opening post detail.")
             return None
@@ -384,25 +540,22 @@ class XHSCrawler:
         post_detail = {}
         post_id_for_error = "unknown"
         detail_page_selector = "div.note-detail-mask"
-        cover_element = None # Define for potential cleanup
         
         try:
-            # Locate the post cover using query_selector on the element handle
-            cover_element = await post_element.query_selector('a.cover.mask.ld') 
-            if not cover_element:
-                print("Cover element not found using query_selector. This might be an ad or recommendation.")
-                return None
-            
-            # Ensure cover is ready before clicking
-            print("Waiting for post cover to be ready...")
-            # Note: wait_for is not available on ElementHandle, visibility check is implicit in click
-            # We rely on the element being found by query_selector
+            # Click through a locator so Playwright re-resolves the card (the list re-renders while scrolling)
+            cover_locator = self.page.locator(xhs_selectors.card_cover_selector(data_index)).first
             await self._wait_randomly(0.5, 1.0)
                 
+            # --- Click bucket: only real detail opens take a token ---
+            token_taken = await self.consume_post_click()
             print("Clicking post cover...")
-            await cover_element.click()
-            await cover_element.dispose() # Dispose handle after use
-            cover_element = None # Reset
+            try:
+                await cover_locator.click(timeout=5000)
+            except PlaywrightError:
+                print("Cover element not found or not clickable. This might be an ad or recommendation.")
+                if token_taken:
+                    self.refund_post_click()
+                return None
             await self._wait_randomly(2.0, 3.5) # Increased and randomized wait
             # Wait for detail page mask to appear (using wait_for_selector on page)
             print("Waiting for note detail mask to appear...")
@@ -411,15 +564,15 @@ class XHSCrawler:
             detail_mask = self.page.locator(detail_page_selector)
             print("Note detail mask appeared.")
             
-            # Extract note ID from the mask attribute if possible, fallback to URL. 
+            # One evaluate reads the note id, content, images and counts of the mask.
             # In Element, note-id is correct but we call it post-id.
-            post_id = await detail_mask.get_attribute("note-id")
+            scan = await self.scan_detail() or {}
+            post_id = scan.get("note_id") or self.note_id_from_href(scan.get("url"))
             if not post_id:
-                 print("Could not get post-id from mask attribute, trying URL.")
+                 print("Could not get post-id from mask attribute or URL, waiting for item URL.")
                  try:
                       await self.page.wait_for_url("**/discovery/item/**", timeout=5000)
-                      current_url = self.page.url
-                      post_id = current_url.split('/item/')[-1].split('?')[0] if '/item/' in current_url else None
+                      post_id = self.note_id_from_href(self.page.url)
                  except Exception:
                       print("Timeout waiting for item URL.")
                       post_id = None
@@ -431,115 +584,19 @@ class XHSCrawler:
             post_detail["post_id"] = post_id
             print(f"Post ID: {post_id}")
             
-            # --- Refined Content Extraction (Hashtag part removed) --- 
-            content_element = detail_mask.locator('#detail-desc') 
-            full_content = ""
-            if await content_element.count() > 0:
-                # Use JavaScript evaluation to reconstruct content correctly
-                node_data = await content_element.evaluate("""(element) => {
-                    let data = { text: [] }; // Removed hashtags array
-                    element.childNodes.forEach(node => {
-                        if (node.nodeType === Node.TEXT_NODE) { // Text node
-                            data.text.push(node.textContent);
-                        } else if (node.nodeType === Node.ELEMENT_NODE) { // Element node
-                            let text = node.textContent;
-                            if (text) data.text.push(text); // Add text content of element
-                        }
-                    });
-                    // Join text pieces, preserving spaces between elements/nodes
-                    data.fullText = data.text.map(t => t.trim()).filter(t => t).join(' '); 
-                    return data;
-                }""")
-                full_content = node_data.get("fullText", "")
-                print(f"Extracted content length: {len(full_content)}")
+            api_detail = self.capture.detail(post_id) if self.use_api_capture else None
+            if api_detail:
+                # Detail from the intercepted feed response (no slider clones, so all images are kept)
+                self.capture_stats["api_details"] += 1
+                post_detail["content"] = api_detail["content"]
+                post_detail["images"] = ", ".join(api_detail["images"])
+                post_detail["collections"] = api_detail["collections"]
+                post_detail["comments"] = api_detail["comments"]
+                print(f"Using captured feed detail: content length {len(api_detail['content'])}, {len(api_detail['images'])} images, "
+                      f"{api_detail['collections']} collections, {api_detail['comments']} comments")
             else:
-                print("Content element #detail-desc not found.")
-            post_detail["content"] = full_content
-            # --- End Refined Content Extraction --- 
-
-            # --- Start: Modified Image Extraction --- 
-            print("Extracting images...")
-            image_srcs_all = []
-            # Try slider images first
-            image_elements = await detail_mask.locator('div.swiper-slide img.note-slider-img').all()
-            if image_elements:
-                print(f"Found {len(image_elements)} slider image elements.")
-                for img in image_elements:
-                    src = await img.get_attribute('src')
-                    if src:
-                        image_srcs_all.append(src)
-            else: # Fallback for single image notes not in a slider
-                 single_image = detail_mask.locator('img.note-image') # Common class for single image
-                 if await single_image.count() > 0:
-                     print("Found single image element.")
-                     src = await single_image.first.get_attribute('src')
-                     if src: image_srcs_all.append(src)
-                 else:
-                      print("No slider images or single image found.")
-                     
-            print(f"Initially extracted {len(image_srcs_all)} image URLs.")
-
-            # Discard first and last image if more than 2 images were found
-            image_srcs_final = []
-            if len(image_srcs_all) > 2:
-                image_srcs_final = image_srcs_all[1:-1] 
-                print(f"Discarding first and last images. Keeping {len(image_srcs_final)} images.")
-            elif len(image_srcs_all) <= 2 and len(image_srcs_all) > 0: 
-                 print(f"Found {len(image_srcs_all)} images, discarding them as per rule.")
-                 image_srcs_final = [] 
-            else: 
-                 image_srcs_final = []
-                 
-            # Join the final list with ", " (comma and space)
-            post_detail["images"] = ", ".join(image_srcs_final)
-            print(f"Saved {len(image_srcs_final)} image URLs (comma-space separated).")
-            # --- End: Modified Image Extraction --- 
-            
-            # Locate the main actions container
-            counts_area = detail_mask.locator("div.engage-bar") # Updated selector based on screenshots
-            if await counts_area.count() == 0:
-                 # Fallback if engage-bar not found
-                 counts_area = detail_mask.locator("div.action-container")
-                 if await counts_area.count() == 0:
-                     print(f"Post {post_id_for_error}: Could not find counts area (engage-bar or action-container). Counts will be 0.")
-                     counts_area = None # Ensure it's None if not found
-                 else:
-                      print("Using fallback counts area: div.action-container")
-            else:
-                 print("Located counts area: div.engage-bar")
-            
-            # Extract counts using updated selectors within the detail view
-            post_detail["collections"] = 0 # Default
-            post_detail["comments"] = 0 # Default
-
-            if counts_area: # Proceed only if counts_area was found
-                # --- Collections --- #
-                try:
-                    collection_element = counts_area.locator(".collect-wrapper span.count") # Screenshot selector
-                    if await collection_element.count() > 0:
-                        collection_text = await collection_element.first.inner_text()
-                        collection_text = collection_text.strip()
-                        if "万" in collection_text:
-                            post_detail["collections"] = int(float(collection_text.replace('万', '')) * 10000)
-                        elif collection_text.isdigit():
-                            post_detail["collections"] = int(collection_text)
-                    print(f"Collection count: {post_detail['collections']}")
-                except Exception as e:
-                    print(f"Post {post_id_for_error}: Error extracting collection count: {e}")
-                
-                # --- Comments --- #
-                try:
-                    comment_element = counts_area.locator(".chat-wrapper span.count") # Screenshot selector
-                    if await comment_element.count() > 0:
-                        comment_text = await comment_element.first.inner_text()
-                        comment_text = comment_text.strip()
-                        if "万" in comment_text:
-                            post_detail["comments"] = int(float(comment_text.replace('万', '')) * 10000)
-                        elif comment_text.isdigit():
-                            post_detail["comments"] = int(comment_text)
-                    print(f"Comment count: {post_detail['comments']}")
-                except Exception as e:
-                    print(f"Post {post_id_for_error}: Error extracting comment count: {e}")
+                self.capture_stats["dom_details"] += 1
+                post_detail.update(self.detail_from_scan(scan, post_id_for_error))
             
             # --- Attempt Random Like before closing ---
             await self.random_like_post()
@@ -563,8 +620,6 @@ class XHSCrawler:
             return post_detail
         except Exception as e:
             print(f"Error processing post detail for post {post_id_for_error}: {e}")
-            # Clean up handles
-            if cover_element: await cover_element.dispose()
             # Try to close if still open
             try:
                  detail_mask = self.page.locator(detail_page_selector)
@@ -583,8 +638,8 @@ class XHSCrawler:
             
             return None 
     
-    async def scroll_page(self, distance=None):
-        """Scroll the page to load more content"""
+    async def scroll_page(self, distance=None, settle=True):
+        """Scroll the page to load more content. settle waits for the content to render (not needed with the card observer)."""
         if not self.page or self.page.is_closed():
              print("Error: Page is not available or closed before scrolling.")
              return False # Indicate failure
@@ -593,14 +648,15 @@ class XHSCrawler:
         print(f"Scrolling down by {distance} pixels...")
         try:
             await self.page.mouse.wheel(0, distance)
-            await asyncio.sleep(random.uniform(2.0, 3.0)) # Wait longer for content
+            if settle:
+                await asyncio.sleep(random.uniform(2.0, 3.0)) # Wait longer for content
             return True # Indicate success
         except Exception as e:
              print(f"Error during scrolling: {e}")
              return False # Indicate failure
     
-    async def crawl_posts(self):
-        """Crawl posts sequentially using data-index attribute."""
+    async def crawl_posts(self, output=None):
+        """Crawl posts sequentially using data-index attribute. Every post is appended to output (brand_output.BrandOutput) right away."""
         if not self.page or self.page.is_closed():
              print("Error: Page is not available or closed at start of crawl_posts.")
              return []
@@ -609,6 +665,7 @@ class XHSCrawler:
             return []
 
         posts_data = []
+        cards = {} # data-index -> card from the latest scan
         expected_index = 0
         missing_index_attempts = 0
         stop_crawling = False
@@ -621,40 +678,39 @@ class XHSCrawler:
                 stop_crawling = True
                 break
 
-            post_locator = self.page.locator(f'section.note-item[data-index="{expected_index}"]')
-            post_element = None
+            if self.feed.active:
+                # Cards are pushed by the in-page observer; wait just until the expected one arrives
+                card = await self.feed.wait_for(expected_index, timeout=FEED_WAIT_SECONDS)
+            else:
+                # One evaluate per scroll reads every rendered card; rescan only when the expected index is not in it
+                if expected_index not in cards:
+                    cards = await self.scan_cards()
+                card = cards.get(expected_index)
+            if card:
+                print(f"Found post with expected index {expected_index}.")
+            else:
+                print(f"Post with index {expected_index} not rendered/visible yet.")
 
-            try:
-                # Wait briefly for the specific element to potentially appear
-                await post_locator.wait_for(state='attached', timeout=2000) # Wait for element to be in DOM
-                if await post_locator.count() > 0:
-                     # Check visibility as well before proceeding
-                     if await post_locator.is_visible():
-                          post_element = await post_locator.element_handle()
-                          print(f"Found post with expected index {expected_index}.")
-                     else:
-                          print(f"Post with index {expected_index} found but not visible. Might need scroll.")
-                          # Treat as missing for scroll logic
-                # If count is 0 or not visible, post_element remains None
-            except Exception:
-                # Timeout waiting for attached state means it's likely not loaded yet
-                print(f"Post with index {expected_index} not found in DOM yet.")
-                pass # post_element is already None
-
-            if post_element:
+            if card:
                 # Found the expected post
                 missing_index_attempts = 0 # Reset attempts
 
-                # Check if it's a placeholder (no cover link)
-                if await post_locator.locator('a.cover').count() == 0:
+                # Check if it's a placeholder/ad (no cover link or sponsored badge)
+                if card["is_ad"]:
                     print(f"Index {expected_index} is a placeholder/ad. Skipping.")
                     expected_index += 1
                     await self._wait_randomly(0.1, 0.4) # Tiny pause before next index check
                     continue # Move to next expected index
 
-                # Process the valid post element
+                # Saved before a restart (resume): don't open it again
+                if output and output.is_seen(card.get("note_id")):
+                    print(f"Post index {expected_index} (ID: {card['note_id']}) was saved before the restart. Skipping.")
+                    expected_index += 1
+                    continue
+
+                # Process the valid post card
                 print(f"Processing post index {expected_index}...")
-                post_data = await self.extract_post_data(post_element, expected_index)
+                post_data = await self.extract_post_data(card)
 
                 # Check if like threshold met or critical error occurred
                 if post_data is None:
@@ -662,20 +718,55 @@ class XHSCrawler:
                     stop_crawling = True
                     break
 
+                note_id = post_data.get("post_id") or card.get("note_id")
+
+                # Opened earlier in this run for another brand: reuse its detail, only the brand is new
+                run_detail = self.run_details.get(note_id) if note_id else None
+                if run_detail:
+                    post_data.update(run_detail)
+                    del post_data["data_index"]
+                    posts_data.append(post_data)
+                    if output:
+                        output.append(post_data, expected_index)
+                    self.reused_details += 1
+                    print(f"Post index {expected_index} (ID: {note_id}) was opened for another brand in this run. Reused its detail.")
+                    expected_index += 1
+                    await self._wait_randomly(0.1, 0.4)
+                    continue
+
+                # Known post with a recent detail: keep the card-level likes, don't open it again
+                if self.known.is_fresh(note_id):
+                    post_data["post_id"] = note_id
+                    post_data["card_only"] = True
+                    del post_data["data_index"]
+                    posts_data.append(post_data)
+                    if output:
+                        output.append(post_data, expected_index)
+                    print(f"Post index {expected_index} (ID: {note_id}) is known and recent. Saved card-level data only.")
+                    expected_index += 1
+                    await self._wait_randomly(0.1, 0.4)
+                    continue
+
                 # Open detail view
-                post_detail = await self.open_post_detail(post_element)
+                post_detail = await self.open_post_detail(expected_index)
 
                 if post_detail:
                     post_data.update(post_detail)
                     if "data_index" in post_data:
                         del post_data["data_index"] # Remove internal index before saving
                     posts_data.append(post_data)
+                    if output:
+                        output.append(post_data, expected_index)
+                    self.remember_detail(post_detail)
                     print(f"Successfully processed post index {expected_index} (ID: {post_data.get('note_id', 'N/A')}).")
                 else:
                     print(f"Failed to get details for post index {expected_index}. Skipping.")
 
                 # Move to the next expected index
                 expected_index += 1
+                # Few rendered cards left ahead: scroll now so the next ones render during the pause
+                if self.feed.active and self.feed.pending_after(expected_index) < FEED_LOW_WATERMARK:
+                    await self.scroll_page(settle=False)
                 await asyncio.sleep(random.uniform(1.0, 2.0)) # Pause between processing posts
 
             else:
@@ -688,25 +779,33 @@ class XHSCrawler:
                     stop_crawling = True
                     break
 
-                # Scroll down to try and load the missing element
-                if not await self.scroll_page():
+                # Scroll down to try and load the missing element (with the observer there is no blind
+                # wait after scrolling; the next wait_for returns as soon as the card is rendered)
+                if not await self.scroll_page(settle=not self.feed.active):
                     print("Scrolling failed. Stopping crawl.")
                     stop_crawling = True
                     break
+                cards = {} # Rescan after the scroll
                 # Loop will continue and try to find expected_index again after scroll
 
         print(f"Finished sequential crawl for {self.current_brand}. Processed up to index {expected_index -1}. Found {len(posts_data)} valid posts.")
         return posts_data
     
+    def remember_detail(self, post_detail):
+        """Adds a parsed detail to the run-wide post_id -> detail index."""
+        post_id = post_detail.get("post_id")
+        if post_id and not str(post_id).startswith("unknown_"):
+            self.run_details[post_id] = {key: post_detail[key] for key in DETAIL_FIELDS if key in post_detail}
+
     async def save_data_to_json(self, data):
-        """Save data for the current brand to a JSON file, overwriting if exists."""
+        """Save data for the current brand to a JSON file, overwriting if exists. Returns True on success."""
         if not data:
             print(f"No data provided to save for brand {self.current_brand}.")
-            return
+            return False
 
         if not self.current_brand:
             print("Error: Cannot save data, current brand name is not set.")
-            return
+            return False
 
         # Ensure the data directory exists
         try:
@@ -714,11 +813,10 @@ class XHSCrawler:
             # print(f"Ensured data directory exists: {self.data_dir.resolve()}") # Less verbose
         except OSError as e:
             print(f"Error creating data directory {self.data_dir}: {e}")
-            return
+            return False
 
         # Sanitize brand name for filename
-        sanitized_brand_name = re.sub(r'[\\/:*?"<>|]', '_', self.current_brand)
-        sanitized_brand_name = sanitized_brand_name[:100]
+        sanitized_brand_name = brand_output.sanitize_brand_name(self.current_brand)
         filename = self.data_dir / f"{sanitized_brand_name}.json"
 
         # Save the data (overwrite existing file)
@@ -727,11 +825,230 @@ class XHSCrawler:
                 # Directly dump the passed 'data' list (contains only this brand's data)
                 json.dump(data, f, ensure_ascii=False, indent=4)
             print(f"Successfully saved data for {self.current_brand} to {filename}")
+            return True
         except IOError as e:
             print(f"Error writing data to {filename}: {e}")
         except Exception as e:
             print(f"An unexpected error occurred while saving data to {filename}: {e}")
+        return False
     
+    async def crawl_brand(self, brand, next_brand=None):
+        """Searches one brand on this worker's page, crawls its posts and saves them. next_brand is prefetched meanwhile."""
+        output = brand_output.BrandOutput(self.data_dir, brand, self.crawl_date)
+        if output.is_done:
+            print(f"Brand {brand} was already completed before the restart. Skipping.")
+            return
+        if output.is_partial:
+            print(f"Resuming {brand}: {len(output.records)} posts saved before the restart (up to index {output.last_index}).")
+
+        if await self.prepare_brand(brand):
+            self.start_prefetch(next_brand)
+            print(f"Starting post crawl for {brand}{self.worker_tag}...")
+            self.brand_click_count = 0
+            try:
+                await self.crawl_posts(output) # Appends every post to the brand's JSONL file
+            finally:
+                output.close()
+            brand_posts = output.records # Including posts saved before a restart
+            for post in brand_posts:
+                if not post.get("card_only"):
+                    self.remember_detail(post) # Details saved before a restart count for later brands too
+            if not self.page or self.page.is_closed():
+                print(f"Page closed while crawling {brand}. Leaving it resumable ({len(brand_posts)} posts saved).")
+                return
+            if brand_posts:
+                 card_only = sum(1 for post in brand_posts if post.get("card_only"))
+                 print(f"Found {len(brand_posts)} posts for {brand} before saving ({card_only} known posts with card data only).")
+                 if not await self.save_data_to_json(brand_posts): # Pass current brand's posts
+                     return # Keep the JSONL file and marker for the next run
+            else:
+                 print(f"No posts found or extracted for {brand}.")
+            output.finish()
+            try:
+                brand_priority.record_crawl(brand, brand_posts, self.brand_click_count)
+            except Exception as history_err:
+                print(f"Warning: Could not record crawl history for {brand}: {history_err}")
+        else:
+            print(f"Failed to search or set up filter for brand: {brand}. Skipping.")
+
+    async def crawl_brands(self, brands):
+        """Crawls the given brands one after another on this worker's page."""
+        total_brands = len(brands)
+        prefetch = getattr(config, "PREFETCH_NEXT_BRAND", True)
+        try:
+            for i, brand in enumerate(brands):
+                print(f"\n--- Processing Brand {i+1}/{total_brands}{self.worker_tag}: {brand} ---")
+                # Next brand that still needs crawling (finished brands of a resumed run are skipped)
+                next_brand = None
+                if prefetch:
+                    next_brand = next((b for b in brands[i + 1:] if not brand_output.all_brands_done([b], self.crawl_date)), None)
+                try:
+                    await self.crawl_brand(brand, next_brand)
+                except Exception as e:
+                    print(f"Error crawling brand {brand}{self.worker_tag}: {e}")
+                if not self.page or self.page.is_closed():
+                    print(f"Page{self.worker_tag} closed. Stopping this worker.")
+                    break
+                self.page_brands += 1
+                await self.maybe_recycle_page()
+        finally:
+            await self.close_prefetcher()
+
+    # --- Prefetch of the next brand on a secondary page ---
+    # While crawl_posts works on brand N, a second crawler instance (same pacer, own page, capture
+    # and request routing) runs search_brand for brand N+1. prepare_brand then swaps the pages, so
+    # brand N+1 starts on an already loaded, sorted result list. Searches of the prefetch page go
+    # through the shared pacer like every other search.
+
+    def start_prefetch(self, brand):
+        if not brand or self.prefetch_task:
+            return
+        self.prefetch_brand = brand
+        self.prefetch_task = asyncio.create_task(self._prefetch(brand))
+
+    async def _prefetch(self, brand):
+        try:
+            if self.prefetcher is None or not self.prefetcher.page or self.prefetcher.page.is_closed():
+                self.prefetcher = await self.open_worker(self.worker_id)
+                await self.page.bring_to_front() # Background tabs are throttled; keep the crawled page in front
+            print(f"Prefetching search results for next brand {brand}{self.worker_tag}...")
+            return await self.prefetcher.search_brand(brand)
+        except Exception as e:
+            print(f"Prefetch of {brand} failed: {e}")
+            return False
+
+    async def prepare_brand(self, brand):
+        """Makes the result list of brand current: the prefetched page if it is ready, else a search on this page."""
+        task, prefetched_brand = self.prefetch_task, self.prefetch_brand
+        self.prefetch_task, self.prefetch_brand = None, None
+        if task:
+            # Wait for a running prefetch even if it is for another brand (e.g. this brand finished
+            # early on LIKE_THRESHOLD or the prefetched brand was skipped), so the pages are not in use
+            ready = await task
+            if ready and prefetched_brand == brand:
+                self.page, self.prefetcher.page = self.prefetcher.page, self.page
+                self.capture, self.prefetcher.capture = self.prefetcher.capture, self.capture
+                self.resources, self.prefetcher.resources = self.prefetcher.resources, self.resources
+                self.feed, self.prefetcher.feed = self.prefetcher.feed, self.feed
+                self.page_brands, self.prefetcher.page_brands = self.prefetcher.page_brands, self.page_brands
+                self.current_brand = brand
+                await self.page.bring_to_front()
+                print(f"Using prefetched search results for {brand}{self.worker_tag}.")
+                return True
+        return await self.search_brand(brand)
+
+    # --- Page recycling ---
+    # A page that has rendered hundreds of result lists keeps growing in renderer and CDP memory.
+    # Every PAGE_RECYCLE_EVERY_BRANDS brands, or when its JS heap exceeds PAGE_RECYCLE_HEAP_MB, the
+    # page is replaced by a fresh tab of the same context. Cookies and local storage belong to the
+    # (persistent) context, so the login session carries over; the new tab is opened before the old
+    # one is closed, so the browser window never loses its last page.
+
+    async def js_heap_mb(self):
+        """Used JS heap of the current page in MB (None if the browser does not report it)."""
+        try:
+            used = await self.page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : null")
+        except Exception:
+            return None
+        return used / 1024 / 1024 if used else None
+
+    async def maybe_recycle_page(self):
+        every = getattr(config, "PAGE_RECYCLE_EVERY_BRANDS", 0)
+        heap_limit = getattr(config, "PAGE_RECYCLE_HEAP_MB", 0)
+        reason = None
+        if every and self.page_brands >= every:
+            reason = f"{self.page_brands} brands crawled on this page"
+        elif heap_limit:
+            heap_mb = await self.js_heap_mb()
+            if heap_mb and heap_mb > heap_limit:
+                reason = f"JS heap {heap_mb:.0f} MB > {heap_limit} MB"
+        if reason:
+            await self.recycle_page(reason)
+
+    async def recycle_page(self, reason):
+        """Replaces self.page with a fresh tab of the same context."""
+        print(f"Recycling page{self.worker_tag}: {reason}.")
+        old_page = self.page
+        new_page = None
+        try:
+            await self.pacer.acquire_action()
+            new_page = await self.context.new_page()
+            await self._prepare_page(new_page)
+            await new_page.goto(self.base_url)
+            await new_page.wait_for_selector("#app", state="visible", timeout=20000)
+        except Exception as e:
+            print(f"Could not open a replacement page: {e}. Keeping the current page.")
+            if new_page:
+                await self._prepare_page(old_page) # Move listeners and routes back
+                try:
+                    await new_page.close()
+                except Exception:
+                    pass
+            return False
+        self.page = new_page
+        self.page_brands = 0
+        await self.page.bring_to_front()
+        try:
+            await old_page.close()
+        except Exception as close_err:
+            print(f"Error closing the old page: {close_err}")
+        return True
+
+    async def close_prefetcher(self):
+        if self.prefetch_task:
+            await self.prefetch_task
+            self.prefetch_task, self.prefetch_brand = None, None
+        if self.prefetcher and self.prefetcher.page and not self.prefetcher.page.is_closed():
+            try:
+                await self.prefetcher.page.close()
+            except Exception as close_err:
+                print(f"Error closing prefetch page{self.worker_tag}: {close_err}")
+        self.prefetcher = None
+
+    async def open_worker(self, worker_id):
+        """Opens another tab in the connected context and returns a crawler working on it with the shared pacer."""
+        worker = XHSCrawler(pacer=self.pacer, worker_id=worker_id, known=self.known, run_details=self.run_details,
+                            crawl_date=self.crawl_date)
+        worker.browser = self.browser
+        worker.context = self.context
+        await self.pacer.acquire_action()
+        worker.page = await self.context.new_page()
+        await worker._prepare_page(worker.page)
+        await worker.page.goto(self.base_url)
+        await worker.page.wait_for_selector("#app", state="visible", timeout=20000)
+        print(f"Opened page for worker {worker_id}.")
+        return worker
+
+    async def run_worker_pool(self, brands, worker_count):
+        """
+        Crawls brands with worker_count tabs of the same browser context. Brands are dealt out
+        round-robin (keeping the priority order within every queue); each worker waits
+        independently, while detail opens and searches are paced globally by self.pacer.
+        Returns the workers (this crawler first).
+        """
+        self.worker_id = 1
+        self.worker_tag = " [worker 1]"
+        workers = [self]
+        for worker_id in range(2, worker_count + 1):
+            try:
+                workers.append(await self.open_worker(worker_id))
+            except Exception as e:
+                print(f"Could not open page for worker {worker_id}: {e}. Continuing with {len(workers)} worker(s).")
+                break
+
+        queues = [brands[i::len(workers)] for i in range(len(workers))]
+        print(f"Crawling {len(brands)} brands with {len(workers)} workers: " + ", ".join(str(len(q)) for q in queues) + " brands each.")
+        try:
+            await asyncio.gather(*(worker.crawl_brands(queue) for worker, queue in zip(workers, queues)))
+        finally:
+            for worker in workers[1:]:
+                try:
+                    if worker.page and not worker.page.is_closed():
+                        await worker.page.close()
+                except Exception as close_err:
+                    print(f"Error closing page{worker.worker_tag}: {close_err}")
+        return workers
+
     async def run(self):
         """Main method to run the crawler for all brands."""
         async with async_playwright() as p:
@@ -761,7 +1078,6 @@ class XHSCrawler:
                 return
 
             playwright_instance = None
-            brand_counter = 0 # Keep for logging if desired, but not for pausing
 
             try:
                 async with async_playwright() as p:
@@ -772,33 +1088,32 @@ class XHSCrawler:
                         return
 
                     print("\n--- Starting Brand Crawl ---")
-                    self.window_start_time = time.monotonic() # Initialize timer window
-                    print(f"Initialized post click limit timer window. Limit: {self.POST_CLICK_LIMIT} clicks per {self.TIME_WINDOW_SECONDS} seconds.")
+                    print(f"Click pacing: {self.pacer.describe()}")
                     brands = config.BRANDS # Corrected variable name
-                    total_brands = len(brands)
-                    print(f"Found {total_brands} brands in config.")
-
-                    for i, brand in enumerate(brands):
-                        print(f"\n--- Processing Brand {i+1}/{total_brands}: {brand} ---")
-                        brand_counter += 1 # Increment counter for each brand processed
-
-                        # --- Search and Crawl ---
-                        if await self.search_brand(brand):
-                            print(f"Starting post crawl for {brand}...")
-                            brand_posts = await self.crawl_posts() # Returns list of posts for current brand
-                            if brand_posts:
-                                 print(f"Found {len(brand_posts)} posts for {brand} before saving.")
-                                 await self.save_data_to_json(brand_posts) # Pass current brand's posts
-                            else:
-                                 print(f"No posts found or extracted for {brand}.")
-                        else:
-                            print(f"Failed to search or set up filter for brand: {brand}. Skipping.")
-
-                        # --- Pause Logic Removed ---
-                        # The old brand-based pause logic is removed.
-                        # New time/click-based logic is in extract_post_data.
+                    stale = brand_output.clear_stale_markers(self.crawl_date, self.data_dir)
+                    if stale:
+                        print(f"Removed {stale} resume markers of an earlier crawl; those brands are crawled again.")
+                    print(f"Found {len(brands)} brands in config.")
+
+                    worker_count = max(1, min(getattr(config, "CRAWL_WORKERS", 1), len(brands)))
+                    if worker_count == 1:
+                        await self.crawl_brands(brands)
+                        workers = [self]
+                    else:
+                        workers = await self.run_worker_pool(brands, worker_count)
 
                     print("\n--- Brand Crawl Complete ---")
+                    if brand_output.all_brands_done(brands, self.crawl_date):
+                        brand_output.clear_resume_markers() # The next run starts fresh
+                    else:
+                        print("Some brands are unfinished; rerun the crawler to resume them.")
+                    for worker in workers:
+                        stats = worker.capture_stats
+                        print(f"Card data{worker.worker_tag}: {stats['api_cards']} from API capture, {stats['dom_cards']} from DOM. "
+                              f"Details: {stats['api_details']} from API capture, {stats['dom_details']} from DOM.")
+                        print(f"Request routing{worker.worker_tag}: {worker.resources.summary()}")
+                    print(f"Detail opens this run: {self.pacer.total_clicks} ({self.pacer.total_wait_seconds:.0f}s waited for click tokens), "
+                          f"details reused across brands: {sum(worker.reused_details for worker in workers)}")
 
                     # --- Deduplication after all brands are processed --- Removed
                     # print("\n--- Starting Global Deduplication ---")
@@ -5,6 +5,9 @@
 # Contains functions to:
 # 1. Get a unique list of brands from selected rankings in 'dzdpdata'.
 # 2. Update the BRANDS list in xhs_crawler/config.py.
+# Brands are ordered by brand_priority.py (ranking position, staleness, yield, new arrivals) and
+# trimmed to the click budget from main/config.py instead of being sorted alphabetically.
+# Reads the latest dzdpdata snapshot as a date range (create_date .. last_seen_date), see sql/001_dzdpdata_last_seen_date.sql.
 
 import os
 import sys
@@ -12,6 +15,13 @@ import traceback # Keep for error handling
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import re # For apply_to_xhs_config
+import brand_priority
+
+# Shared modules live in the project-root common/ directory
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT) # Appended so main/config.py still wins for "import config"
+from common.brand_names import display_name, brand_key
 
 # Import config from main directory - use absolute path to ensure correct import
 main_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'main'))
@@ -52,56 +62,95 @@ supabase = get_supabase_client()
 
 
 def get_selected_brands():
-    """Gets unique brand names from dzdpdata based on SELECTED_RANKINGS in main/config.py
-       and the most recent create_date in the dzdpdata table."""
+    """Gets unique brand names (sorted) from dzdpdata based on SELECTED_RANKINGS in main/config.py
+       and the most recent snapshot in the dzdpdata table."""
+    return sorted(get_selected_brand_ranks())
+
+def get_selected_brand_ranks():
+    """Same selection as get_selected_brands, returned as {brand: best 排名 across the selected rankings}."""
     print("\n--- Getting Selected Brands for XHS (Latest Date) --- ")
     
     # Ensure SELECTED_RANKINGS exists in main_config
     if not hasattr(main_config, 'SELECTED_RANKINGS'):
         print("Error: SELECTED_RANKINGS not found in main/config.py")
         print("Available attributes in main_config:", dir(main_config))
-        return []
+        return {}
         
     selected_rankings = main_config.SELECTED_RANKINGS
     if not selected_rankings:
         print("Warning: No rankings specified in main/config.py. Returning empty list.")
-        return []
+        return {}
     
     try:
-        # 1. Find the most recent create_date in the dzdpdata table
-        print("Finding the most recent create_date in dzdpdata...")
+        # 1. Find the most recent snapshot date in the dzdpdata table.
+        # Unchanged ranking rows are carried forward by Upload.py via last_seen_date, so the
+        # latest snapshot date is the larger of the newest create_date and last_seen_date.
+        print("Finding the most recent snapshot date in dzdpdata...")
         date_response = supabase.table("dzdpdata").select("create_date").order("create_date", desc=True).limit(1).execute()
         
         if not date_response.data:
             print("Error: Could not find any create_date in dzdpdata table.")
-            return []
+            return {}
             
         most_recent_date = date_response.data[0]['create_date']
-        print(f"Most recent create_date found: {most_recent_date}")
-
-        # 2. Fetch brands matching selected rankings AND the most recent date
+        seen_response = supabase.table("dzdpdata").select("last_seen_date")\
+                                .not_.is_("last_seen_date", "null")\
+                                .order("last_seen_date", desc=True).limit(1).execute()
+        if seen_response.data and seen_response.data[0]['last_seen_date'] > most_recent_date:
+            most_recent_date = seen_response.data[0]['last_seen_date']
+        print(f"Most recent snapshot date found: {most_recent_date}")
+
+        # 2. Fetch brands matching selected rankings in the most recent snapshot:
+        #    create_date <= D <= last_seen_date (a NULL last_seen_date means create_date)
         print(f"Fetching brands from rankings: {selected_rankings} for date: {most_recent_date}")
         response = supabase.table("dzdpdata")\
-                          .select("品牌")\
+                          .select("品牌, 排名")\
                           .in_("榜单", selected_rankings)\
-                          .eq("create_date", most_recent_date)\
+                          .lte("create_date", most_recent_date)\
+                          .or_(f"last_seen_date.gte.{most_recent_date},create_date.eq.{most_recent_date}")\
                           .execute()
 
         if response.data:
-            # Extract unique, non-empty brand names
-            selected_brands = set(item['品牌'] for item in response.data if item.get('品牌') and str(item.get('品牌')).strip())
-            brand_list = sorted(list(selected_brands)) # Sort for consistency
-            print(f"Found {len(brand_list)} unique brands for selected rankings on {most_recent_date}.")
-            # print(f"Selected Brands: {brand_list}") # Optional: print the list
-            return brand_list
+            # Extract unique, non-empty brand names with their best rank.
+            # Variants of one brand (width, case, branch suffix, aliases) share a brand_key and
+            # are crawled once, under their display name.
+            brand_ranks = {}
+            names_by_key = {}
+            for item in response.data:
+                if not item.get('品牌') or not str(item.get('品牌')).strip():
+                    continue
+                brand = names_by_key.setdefault(brand_key(item['品牌']), display_name(item['品牌']))
+                try:
+                    rank = int(str(item.get('排名')).strip())
+                except (TypeError, ValueError):
+                    rank = None
+                best = brand_ranks.get(brand)
+                if brand not in brand_ranks or (rank is not None and (best is None or rank < best)):
+                    brand_ranks[brand] = rank
+            print(f"Found {len(brand_ranks)} unique brands for selected rankings on {most_recent_date}.")
+            return brand_ranks
         else:
             print(f"No brands found matching the selected rankings for date {most_recent_date}.")
-            return []
+            return {}
             
     except Exception as e:
         print(f"Error fetching selected brands: {e}")
         traceback.print_exc()
-        return [] # Return empty list on error
+        return {} # Return empty mapping on error
+
+def get_prioritized_brands():
+    """Selected brands ordered by crawl priority and trimmed to the click budget (see brand_priority.py)."""
+    brand_ranks = get_selected_brand_ranks()
+    if not brand_ranks:
+        return []
+    queue = brand_priority.build_crawl_queue(
+        brand_ranks,
+        budget=getattr(main_config, 'XHS_CRAWL_CLICK_BUDGET', brand_priority.DEFAULT_CLICK_BUDGET),
+        weights=getattr(main_config, 'BRAND_PRIORITY_WEIGHTS', brand_priority.DEFAULT_WEIGHTS),
+        min_recrawl_hours=getattr(main_config, 'BRAND_MIN_RECRAWL_HOURS', brand_priority.MIN_RECRAWL_HOURS),
+    )
+    brand_priority.print_queue(queue, skipped=len(brand_ranks) - len(queue))
+    return [item['brand'] for item in queue]
 
 def apply_to_xhs_config(brand_list):
     """Updates the BRANDS list in xhs_crawler/config.py with the provided list."""
@@ -174,9 +223,9 @@ def apply_to_xhs_config(brand_list):
 if __name__ == "__main__":
     print("Running Brand Processing Script (Get & Apply)...")
     
-    # Step 1: Get brands from selected rankings
+    # Step 1: Get brands from selected rankings, in crawl priority order
     print("\nStep 1: Getting selected brands...")
-    selected_brands = get_selected_brands()
+    selected_brands = get_prioritized_brands()
     
     # Step 2: Apply the selected brands to the XHS config
     if selected_brands: # Only apply if we got some brands
@@ -7,6 +7,7 @@
 # Optimization: Checks Supabase for existing images before downloading.
 # Update: Changed .env file path loading to script's directory.
 # Update: Corrected error message for missing env vars.
+# Update: Skips card-only records (known posts saved without detail by crawler.py).
 
 import os
 import json
@@ -155,6 +156,8 @@ def process_json_file(json_file_path):
         return
 
     for item in data:
+        if item.get('card_only'):
+            continue # Known post saved without detail; its images were uploaded when it was first crawled
         post_id = item.get('post_id')
         images_str = item.get('images')
 
@@ -0,0 +1,80 @@
+# xhs_crawler/known_posts.py
+# Local cache of XHS posts whose detail the crawler has already opened.
+# Top-liked posts show up in the results of the same brands every day; opening their detail
+# again costs 3-6 seconds and a click token for data we already stored. crawler.py reads the
+# note id from the card href and, for a post refreshed within KNOWN_POST_REFRESH_DAYS, saves a
+# card-only record instead (post_id, brand, card-level likes, "card_only": True). upload.py
+# turns card-only records into likes-only updates, content_filter.py keeps them.
+# A post only becomes known once its detail is taken care of: upload.py marks posts whose rows
+# reached Supabase, content_filter.py marks the unrelated posts it drops. A crawled post whose
+# upload did not happen (yet) is opened again on the next crawl, so its detail is never lost.
+# The cache lives in state/known_posts.json: {post_id: {"refreshed_at": iso timestamp, "brands": [...]}}
+
+import os
+import json
+from datetime import datetime, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+KNOWN_POSTS_FILE = os.path.join(SCRIPT_DIR, "state", "known_posts.json")
+DEFAULT_REFRESH_DAYS = 7 # Details older than this are opened again (content/images may have changed)
+
+
+def mark_and_save(posts, path=KNOWN_POSTS_FILE):
+    """Marks the records in posts ({"post_id", "brand"}) refreshed and saves the cache. Returns the number marked."""
+    known = KnownPosts(path)
+    for post in posts:
+        known.mark_refreshed(post.get("post_id"), post.get("brand"))
+    known.save()
+    return len(posts)
+
+
+class KnownPosts:
+    def __init__(self, path=KNOWN_POSTS_FILE, refresh_days=DEFAULT_REFRESH_DAYS):
+        self.path = path
+        self.max_age = timedelta(days=refresh_days)
+        self.posts = self._load()
+        self.dirty = False
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read known posts cache {self.path}: {e}. Starting empty.")
+            return {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.posts, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.posts)
+
+    def is_fresh(self, post_id, now=None):
+        """True if the detail of post_id was stored within the refresh period."""
+        entry = self.posts.get(post_id) if post_id else None
+        if not entry:
+            return False
+        try:
+            refreshed_at = datetime.fromisoformat(entry["refreshed_at"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return (now or datetime.now()) - refreshed_at < self.max_age
+
+    def mark_refreshed(self, post_id, brand=None, now=None):
+        """Records that the detail of post_id was just stored."""
+        if not post_id or str(post_id).startswith("unknown_"):
+            return
+        entry = self.posts.setdefault(post_id, {"brands": []})
+        entry["refreshed_at"] = (now or datetime.now()).isoformat(timespec="seconds")
+        if brand and brand not in entry["brands"]:
+            entry["brands"].append(brand)
+        self.dirty = True
@@ -0,0 +1,142 @@
+# xhs_crawler/pacing.py
+# Global pacing shared by all crawler workers (tabs) of one run.
+# Each worker waits its own random delays between UI actions, but every detail open and every
+# search/navigation goes through one GlobalPacer, so the account-wide rate stays the same no
+# matter how many tabs are open:
+#   acquire_click()   one detail open: takes a token from the click bucket and keeps at least
+#                     min_click_interval seconds (plus jitter) between opens of all workers
+#   refund_click()    gives the token back when the open did not happen (cover not clickable)
+#   acquire_action()  one search/navigation: keeps min_action_interval seconds between workers
+# The click bucket (TokenBucket) refills at rate_per_hour up to burst tokens, so throughput is a
+# steady trickle instead of 300 clicks followed by a long pause. Its state is saved to
+# state/click_bucket.json, so restarting the crawler does not hand out a fresh budget.
+# All state is guarded by asyncio locks; the workers run in one event loop.
+
+import os
+import json
+import time
+import random
+import asyncio
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUCKET_STATE_FILE = os.path.join(SCRIPT_DIR, "state", "click_bucket.json")
+
+DEFAULT_CLICK_RATE_PER_HOUR = 300 # Average detail opens per hour, across all workers
+DEFAULT_CLICK_BURST = 20 # Detail opens allowed back to back after an idle period
+DEFAULT_MIN_CLICK_INTERVAL = 4.0 # Seconds between two detail opens of any workers
+DEFAULT_MIN_ACTION_INTERVAL = 1.5 # Seconds between two searches/navigations of any workers
+JITTER = 0.5 # Intervals are stretched by up to 50% so opens don't form a regular pattern
+
+
+class TokenBucket:
+    """Token bucket refilled at rate_per_hour up to burst tokens, persisted to state_path (None = in memory)."""
+
+    def __init__(self, rate_per_hour=DEFAULT_CLICK_RATE_PER_HOUR, burst=DEFAULT_CLICK_BURST, state_path=BUCKET_STATE_FILE):
+        self.rate = rate_per_hour / 3600.0 # Tokens per second
+        self.burst = burst
+        self.state_path = state_path
+        # Wall-clock time, so the refill across restarts is correct
+        self.tokens, self.updated_at = self._load()
+
+    def _load(self):
+        now = time.time()
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                return min(float(state["tokens"]), self.burst), min(float(state["updated_at"]), now)
+            except Exception as e:
+                print(f"Warning: Could not read click bucket state {self.state_path}: {e}. Starting with an empty bucket.")
+                return 0.0, now
+        return float(self.burst), now
+
+    def _save(self):
+        if not self.state_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"tokens": self.tokens, "updated_at": self.updated_at}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Warning: Could not save click bucket state {self.state_path}: {e}")
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def wait_time(self):
+        """Seconds until one token is available (0 if available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def take(self):
+        """Waits for one token and takes it. Returns the seconds waited."""
+        waited = 0.0
+        delay = self.wait_time()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = self.wait_time()
+        self.tokens -= 1
+        self._save()
+        return waited
+
+    def refund(self):
+        self._refill()
+        self.tokens = min(self.burst, self.tokens + 1)
+        self._save()
+
+
+class GlobalPacer:
+    def __init__(self, rate_per_hour=DEFAULT_CLICK_RATE_PER_HOUR, burst=DEFAULT_CLICK_BURST,
+                 min_click_interval=DEFAULT_MIN_CLICK_INTERVAL, min_action_interval=DEFAULT_MIN_ACTION_INTERVAL,
+                 state_path=BUCKET_STATE_FILE):
+        self.bucket = TokenBucket(rate_per_hour, burst, state_path)
+        self.min_click_interval = min_click_interval
+        self.min_action_interval = min_action_interval
+        self.total_clicks = 0
+        self.total_wait_seconds = 0.0
+        self._next_click_at = 0.0
+        self._next_action_at = 0.0
+        self._click_lock = asyncio.Lock()
+        self._action_lock = asyncio.Lock()
+
+    def describe(self):
+        return (f"{self.bucket.rate * 3600:.0f} clicks/hour, burst {self.bucket.burst}, "
+                f"{self.bucket.available():.1f} tokens available")
+
+    async def _space(self, next_at, interval):
+        """Sleeps until next_at and returns the earliest time of the following call."""
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return time.monotonic() + interval * random.uniform(1.0, 1.0 + JITTER)
+
+    async def acquire_click(self, worker=""):
+        """Waits until one more detail open is allowed and takes its token."""
+        async with self._click_lock:
+            delay = self.bucket.wait_time()
+            if delay > 5:
+                print(f"[Pacer]{worker} Click bucket empty, waiting {delay:.1f}s for the next token...")
+            waited = await self.bucket.take()
+            self._next_click_at = await self._space(self._next_click_at, self.min_click_interval)
+            self.total_clicks += 1
+            self.total_wait_seconds += waited
+            print(f"[Limit Status]{worker} Detail opens this run: {self.total_clicks}, tokens left: {self.bucket.tokens:.1f}/{self.bucket.burst}")
+
+    def refund_click(self):
+        """Returns the token of a detail open that did not happen."""
+        self.bucket.refund()
+        self.total_clicks -= 1
+
+    async def acquire_action(self):
+        """Waits until the next search/navigation of any worker is allowed."""
+        async with self._action_lock:
+            self._next_action_at = await self._space(self._next_action_at, self.min_action_interval)
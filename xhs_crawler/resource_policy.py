@@ -0,0 +1,94 @@
+# xhs_crawler/resource_policy.py
+# Request routing for crawler.py: blocks heavy resources the crawler never looks at.
+# The crawler only needs text, counts and image URLs (the src attributes and the API JSON are
+# there without the image bytes); image_direct_upload.py downloads the images later anyway.
+# ResourcePolicy routes every request of the page and aborts the blocked resource types
+# (image, media, font by default) while scrolling search results. In detail views they are only
+# let through if allow_in_detail is set (crawler.py switches it with detail_view()).
+# Bytes saved are an estimate: blocked requests x average size of that resource type, taken from
+# responses that were let through, or from DEFAULT_AVERAGE_BYTES before any were seen.
+
+from contextlib import asynccontextmanager
+
+DEFAULT_BLOCKED_TYPES = ("image", "media", "font")
+DEFAULT_AVERAGE_BYTES = {"image": 60000, "media": 500000, "font": 40000}
+
+
+class ResourcePolicy:
+    def __init__(self, blocked_types=DEFAULT_BLOCKED_TYPES, allow_in_detail=False):
+        self.blocked_types = set(blocked_types)
+        self.allow_in_detail = allow_in_detail
+        self.in_detail = False
+        self.page = None
+        self.blocked = {} # resource type -> aborted requests
+        self.allowed_bytes = {} # resource type -> (responses, bytes) of let-through heavy resources
+
+    async def attach(self, page):
+        if self.page is page or not self.blocked_types:
+            return
+        await self.detach()
+        self.page = page
+        await page.route("**/*", self._handle)
+        page.on("response", self._on_response)
+
+    async def detach(self):
+        if self.page is None:
+            return
+        try:
+            await self.page.unroute("**/*", self._handle)
+            self.page.remove_listener("response", self._on_response)
+        except Exception:
+            pass # Page already closed
+        self.page = None
+
+    @asynccontextmanager
+    async def detail_view(self):
+        """Marks the time a detail view is open (heavy resources allowed if allow_in_detail)."""
+        self.in_detail = True
+        try:
+            yield
+        finally:
+            self.in_detail = False
+
+    def _blocks(self, resource_type):
+        if resource_type not in self.blocked_types:
+            return False
+        return not (self.in_detail and self.allow_in_detail)
+
+    async def _handle(self, route):
+        resource_type = route.request.resource_type
+        try:
+            if self._blocks(resource_type):
+                self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+                await route.abort("blockedbyclient")
+            else:
+                await route.continue_()
+        except Exception:
+            pass # Request already handled or page closed
+
+    def _on_response(self, response):
+        resource_type = response.request.resource_type
+        if resource_type not in self.blocked_types:
+            return
+        try:
+            size = int(response.headers.get("content-length", 0))
+        except ValueError:
+            return
+        if size > 0:
+            count, total = self.allowed_bytes.get(resource_type, (0, 0))
+            self.allowed_bytes[resource_type] = (count + 1, total + size)
+
+    def average_bytes(self, resource_type):
+        count, total = self.allowed_bytes.get(resource_type, (0, 0))
+        if count:
+            return total / count
+        return DEFAULT_AVERAGE_BYTES.get(resource_type, 0)
+
+    def bytes_saved(self):
+        return int(sum(n * self.average_bytes(t) for t, n in self.blocked.items()))
+
+    def summary(self):
+        if not self.blocked:
+            return "no requests blocked"
+        parts = ", ".join(f"{n} {t}" for t, n in sorted(self.blocked.items()))
+        return f"blocked {parts} (~{self.bytes_saved() / 1024 / 1024:.1f} MB saved)"
@@ -6,9 +6,17 @@
 # Corrected data directory path to be relative to the script location.
 # Added exit(1) if brand_id_map fails to load to prevent inconsistent state.
 # Added .strip() to brand name mapping and lookup to handle potential whitespace issues.
-# Implemented pagination for fetching brand map to handle >1000 brands.
+# Brand lookups use the shared brand_key() from common/brand_names.py (width, case, branch suffix, aliases).
+# Implemented pagination for fetching brand map to handle >1000 brands (shared keyset reader in common/paginate.py).
+# Writes go through the durable local outbox (common/outbox.py): new posts, counter/image updates
+# and post_brand relations are appended to SQLite and flushed in the background as batched upserts,
+# so a network drop never loses rows and rerunning the script resumes the pending flush.
+# Card-only records (known posts the crawler did not reopen, see known_posts.py) only update likes.
+# Posts whose rows reached Supabase are marked in the known posts cache after the flush; only
+# then does the crawler save them as card-only records.
 
 import os
+import sys
 import json
 import glob
 from datetime import datetime
@@ -18,7 +26,15 @@ from tqdm import tqdm
 import re
 from pathlib import Path
 from urllib.parse import quote
-import math # For ceiling batches
+
+# Shared modules live in the project-root common/ directory
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+from common.outbox import Outbox
+from common.paginate import iter_pages_keyset, iter_rows_keyset
+from common.brand_names import brand_key
+import known_posts
 
 # --- Constants ---
 SUPABASE_STORAGE_BASE_URL = "https://wdpeoyugsxqnpwwtkqsl.supabase.co/storage/v1/object/public"
@@ -26,7 +42,9 @@ IMAGE_BUCKET_NAME = "xhs_image"
 BRAND_TABLE_NAME = "brand"
 POSTS_TABLE_NAME = "posts" # Target table for posts
 POST_BRAND_TABLE_NAME = "post_brand" # Target table for relations
-BATCH_SIZE = 100 # Records per batch insert
+BATCH_SIZE = 500 # Records per outbox flush request
+OUTBOX_DRAIN_TIMEOUT = 600 # Seconds to wait for the outbox to flush before exiting
+OUTBOX_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "outbox.sqlite3") # Not shared with other scripts
 # --- End Constants ---
 
 # Load environment variables from the parent directory
@@ -68,40 +86,18 @@ except Exception as e:
 def get_brand_id_map():
     """Fetches ALL brand names and IDs from Supabase using pagination and returns a case-insensitive mapping."""
     brand_map = {}
-    page_size = 1000 # Supabase default limit
-    current_page = 0
     total_fetched = 0
-    print(f"Fetching ALL brand data from table: {BRAND_TABLE_NAME} using pagination (page size: {page_size})...")
+    print(f"Fetching ALL brand data from table: {BRAND_TABLE_NAME} using keyset pagination on brand_id...")
 
     try:
-        while True:
-            start_index = current_page * page_size
-            end_index = start_index + page_size - 1
-            # print(f"Fetching brand page {current_page + 1} (range: {start_index}-{end_index})...")
-            response = supabase.table(BRAND_TABLE_NAME).select("brand_id, name", count='exact').range(start_index, end_index).execute()
-
-            if response.data:
-                for brand in response.data:
-                    # Map lowercased stripped name to brand_id for case-insensitive lookup
-                    if brand.get('name'): # Ensure name exists
-                        brand_map[brand['name'].strip().lower()] = brand['brand_id']
-                    else:
-                        print(f"Warning: Found brand record (page {current_page + 1}) with missing name in database.")
-                total_fetched += len(response.data)
-                # Check if it was the last page
-                if len(response.data) < page_size or (response.count is not None and total_fetched >= response.count):
-                    break
-                current_page += 1
-            else:
-                 # Handle case where no data is returned on a page or error occurs
-                 if hasattr(response, 'error') and response.error:
-                     print(f"API Error fetching brand page {current_page + 1}: {response.error}")
-                     # Decide whether to break or continue, depending on severity
-                     # For now, break to avoid partial map
-                     raise Exception(f"Failed to fetch all brands due to API error: {response.error}")
-                 else:
-                     # No more data found
-                     break # Exit loop if no data and no error
+        for page in iter_pages_keyset(supabase, BRAND_TABLE_NAME, "brand_id, name", key="brand_id"):
+            for brand in page:
+                # Map the normalized brand key to brand_id (the first brand_id wins for duplicate keys)
+                if brand.get('name'): # Ensure name exists
+                    brand_map.setdefault(brand_key(brand['name']), brand['brand_id'])
+                else:
+                    print(f"Warning: Found brand record (brand_id {brand.get('brand_id')}) with missing name in database.")
+            total_fetched += len(page)
 
         print(f"Successfully fetched {total_fetched} brands in total ({len(brand_map)} unique names mapped).")
 
@@ -117,24 +113,8 @@ def get_existing_post_ids():
     existing_ids = set()
     try:
         print(f"Fetching existing post_ids from table: {POSTS_TABLE_NAME}...")
-        # Fetch all post_ids - consider pagination for very large tables
-        current_page = 0
-        page_size = 1000 # Supabase default limit
-        while True:
-            response = supabase.table(POSTS_TABLE_NAME).select("post_id", count='exact').range(current_page * page_size, (current_page + 1) * page_size - 1).execute()
-            if response.data:
-                 for post in response.data:
-                      existing_ids.add(post['post_id'])
-                 # Check if we fetched less than the page size, meaning it's the last page
-                 if len(response.data) < page_size or response.count is not None and len(existing_ids) >= response.count:
-                     break
-                 current_page += 1
-            else:
-                 # No more data or an error occurred
-                 if hasattr(response, 'error') and response.error:
-                      print(f"Error fetching existing post_ids (page {current_page}): {response.error}")
-                 break # Stop fetching if no data or error
-
+        # Keyset pagination on the primary key: one indexed range scan per page
+        existing_ids.update(post['post_id'] for post in iter_rows_keyset(supabase, POSTS_TABLE_NAME, "post_id", key="post_id"))
         print(f"Successfully fetched {len(existing_ids)} existing post_ids.")
     except Exception as e:
         print(f"Error fetching existing post_ids from Supabase: {e}")
@@ -197,10 +177,22 @@ def format_publish_date(date_str):
     print(f"Warning: Unrecognized publish_date format: '{date_str}'")
     return None
 
-def process_and_upload_posts(data, brand_id_map, existing_post_ids):
+def build_post_brand_relation(record, post_id, brand_id_map):
+    """Returns the post_brand row of a record, or None if its brand is not in the brand table."""
+    brand_name = record.get("brand")
+    if not brand_name:
+        return None
+    lookup_key = brand_key(brand_name)
+    brand_id = brand_id_map.get(lookup_key)
+    if not brand_id:
+        print(f"Warning: Brand ID not found for brand '{lookup_key}' (original: '{brand_name}') in record with post_id '{post_id}'. No post_brand relation created.")
+        return None
+    return {"post_id": post_id, "brand_id": brand_id}
+
+def process_and_upload_posts(data, brand_id_map, existing_post_ids, outbox):
     """
     Processes records from JSON, filters duplicates, prepares data for 'posts' and 'post_brand',
-    and uploads them to Supabase tables.
+    and queues them in the outbox. Returns (queued_post_rows, queued_relation_rows).
     """
     if not data:
         print("No data provided for processing.")
@@ -216,6 +208,7 @@ def process_and_upload_posts(data, brand_id_map, existing_post_ids):
     processed_count = 0
     skipped_duplicates = 0
     update_count = 0 # 新增：记录更新的帖子数量
+    card_only_skipped = 0 # Card-only records of posts that are not in the posts table
 
     print("Processing records: filtering duplicates, formatting data, generating image URLs...")
     for record in tqdm(data, desc="Processing records"):
@@ -233,6 +226,19 @@ def process_and_upload_posts(data, brand_id_map, existing_post_ids):
             # Existing post found, proceed to check data for updates
         # --- End Deduplication Check ---
 
+        # --- Card-only records (known posts the crawler did not reopen): likes update only ---
+        if record.get("card_only"):
+            if not is_duplicate:
+                # No content/images to insert; the next full crawl of the post will add it
+                card_only_skipped += 1
+                continue
+            posts_to_update.append({"post_id": post_id, "likes": int(record.get("likes") or 0)})
+            update_count += 1
+            post_brand_payload = build_post_brand_relation(record, post_id, brand_id_map)
+            if post_brand_payload:
+                post_brand_relations_to_insert.append(post_brand_payload)
+            continue
+
         # --- Prepare Post Data (Always needed for comparison or insert) ---
         formatted_publish_date = format_publish_date(record.get("publish_date"))
 
@@ -301,115 +307,29 @@ def process_and_upload_posts(data, brand_id_map, existing_post_ids):
         # --- End Prepare Post Data ---
 
         # --- Prepare Post-Brand Relation Data (Handles both new and existing posts) ---
-        brand_name = record.get("brand")
-        if brand_name:
-            lookup_key = brand_name.strip().lower()
-            brand_id = brand_id_map.get(lookup_key)
-            if brand_id:
-                post_brand_payload = {
-                    "post_id": post_id,
-                    "brand_id": brand_id
-                }
-                # Add to list regardless of whether post is new or duplicate
-                post_brand_relations_to_insert.append(post_brand_payload)
-                # Optional logging added previously handles the duplicate case message
-            else:
-                print(f"Warning: Brand ID not found for brand '{lookup_key}' (original: '{brand_name}') in record with post_id '{post_id}'. No post_brand relation created.")
+        post_brand_payload = build_post_brand_relation(record, post_id, brand_id_map)
+        if post_brand_payload:
+            post_brand_relations_to_insert.append(post_brand_payload)
         # --- End Prepare Post-Brand Relation Data ---
 
     print(f"Processing complete. Found {len(posts_to_insert)} new posts to insert and {update_count} existing posts to update (may include image updates).")
     print(f"Skipped {skipped_duplicates} duplicates (but will update their dynamic data).")
+    if card_only_skipped:
+        print(f"Skipped {card_only_skipped} card-only records of posts that are not in '{POSTS_TABLE_NAME}' yet.")
     print(f"Created {len(post_brand_relations_to_insert)} post-brand relations (including relations for existing posts).")
 
-    # --- Batch Upload Posts ---
-    total_posts = len(posts_to_insert)
-    uploaded_posts_count = 0
-    failed_posts = []
-    if total_posts > 0:
-        print(f"Uploading {total_posts} new records to Supabase table '{POSTS_TABLE_NAME}'...")
-        num_batches = math.ceil(total_posts / BATCH_SIZE)
-        for i in tqdm(range(num_batches), desc=f"Uploading post batches"):
-            batch = posts_to_insert[i*BATCH_SIZE:(i+1)*BATCH_SIZE]
-            try:
-                # Use insert, as duplicates are pre-filtered
-                result = supabase.table(POSTS_TABLE_NAME).insert(batch).execute()
-                # Basic check (response structure might vary)
-                if result.data:
-                    uploaded_posts_count += len(result.data)
-                # Check for errors if the client provides them
-                elif hasattr(result, 'error') and result.error:
-                    print(f"API Error uploading post batch {i + 1}/{num_batches}: {result.error}")
-                    failed_posts.extend(batch)
-            except Exception as e:
-                print(f"Exception uploading post batch {i + 1}/{num_batches}: {e}")
-                failed_posts.extend(batch)
-        print(f"Uploaded {uploaded_posts_count} posts successfully.")
-        if failed_posts:
-            print(f"Failed to upload {len(failed_posts)} posts.")
-            # Optionally save failed records
-            # with open("failed_post_uploads.json", 'w', encoding='utf-8') as f:
-            #     json.dump(failed_posts, f, ensure_ascii=False, indent=4)
-
-    # --- Update Existing Posts (Dynamic Data) ---
-    # 新增：更新已有帖子的动态信息
-    total_updates = len(posts_to_update)
-    updated_posts_count = 0
-    failed_updates = []
-    if total_updates > 0:
-        print(f"Updating {total_updates} existing records in Supabase table '{POSTS_TABLE_NAME}'...")
-        num_batches = math.ceil(total_updates / BATCH_SIZE)
-        for i in tqdm(range(num_batches), desc=f"Updating post batches"):
-            batch = posts_to_update[i*BATCH_SIZE:(i+1)*BATCH_SIZE]
-            try:
-                for post in batch:
-                    post_id = post.get('post_id')
-                    if post_id:
-                        # 使用update而非upsert，因为我们确定记录已存在
-                        update_data = {k: v for k, v in post.items() if k != 'post_id'}
-                        result = supabase.table(POSTS_TABLE_NAME).update(update_data).eq('post_id', post_id).execute()
-                        if result.data:
-                            updated_posts_count += len(result.data)
-                        elif hasattr(result, 'error') and result.error:
-                            print(f"API Error updating post {post_id}: {result.error}")
-                            failed_updates.append(post)
-            except Exception as e:
-                print(f"Exception updating post batch {i + 1}/{num_batches}: {e}")
-                failed_updates.append(batch)
-        print(f"Updated {updated_posts_count} existing posts successfully.")
-        if failed_updates:
-            print(f"Failed to update {len(failed_updates)} posts.")
-            
-    # --- Batch Upload Post-Brand Relations ---
-    total_relations = len(post_brand_relations_to_insert)
-    uploaded_relations_count = 0
-    failed_relations = []
-    if total_relations > 0:
-        print(f"Upserting {total_relations} post-brand relations to Supabase table '{POST_BRAND_TABLE_NAME}'...")
-        num_batches = math.ceil(total_relations / BATCH_SIZE)
-        for i in tqdm(range(num_batches), desc=f"Upserting relation batches"):
-            batch = post_brand_relations_to_insert[i*BATCH_SIZE:(i+1)*BATCH_SIZE]
-            try:
-                # Use upsert for relations to handle potential reruns gracefully
-                result = supabase.table(POST_BRAND_TABLE_NAME).upsert(batch, on_conflict='post_id,brand_id').execute()
-                if result.data:
-                     uploaded_relations_count += len(result.data)
-                elif hasattr(result, 'error') and result.error:
-                     # Ignore pk violation errors if using upsert, could be other errors
-                     if 'duplicate key value violates unique constraint' not in str(result.error):
-                          print(f"API Error upserting relation batch {i + 1}/{num_batches}: {result.error}")
-                          failed_relations.extend(batch)
-
-            except Exception as e:
-                print(f"Exception upserting relation batch {i + 1}/{num_batches}: {e}")
-                failed_relations.extend(batch)
-        print(f"Upserted {uploaded_relations_count} post-brand relations successfully.")
-        if failed_relations:
-            print(f"Failed to upsert {len(failed_relations)} relations.")
-            # Optionally save failed records
-            # with open("failed_relation_uploads.json", 'w', encoding='utf-8') as f:
-            #     json.dump(failed_relations, f, ensure_ascii=False, indent=4)
-
-    return uploaded_posts_count + updated_posts_count, uploaded_relations_count
+    # --- Queue Writes in the Outbox ---
+    # New posts are upserted on post_id rather than inserted, so a batch retried after a lost
+    # response cannot fail on duplicates. Existing posts are updated by post_id (likes,
+    # collections, comments and, if changed, images); a partial upsert would fail on the
+    # NOT NULL columns these rows leave out.
+    queued_posts = outbox.enqueue(POSTS_TABLE_NAME, posts_to_insert, key_fields=["post_id"], on_conflict="post_id")
+    queued_updates = outbox.enqueue(POSTS_TABLE_NAME, posts_to_update, key_fields=["post_id"], op="update", match_on=["post_id"])
+    queued_relations = outbox.enqueue(POST_BRAND_TABLE_NAME, post_brand_relations_to_insert,
+                                      key_fields=["post_id", "brand_id"], on_conflict="post_id,brand_id")
+    print(f"Queued {queued_posts} new posts, {queued_updates} post updates and {queued_relations} post-brand relations in the outbox.")
+
+    return queued_posts + queued_updates, queued_relations
 
 def main():
     """Main function to find JSON files, fetch mappings/existing IDs, process, and upload data."""
@@ -440,27 +360,54 @@ def main():
 
     print(f"Found {len(json_files)} JSON files in '{data_dir}' to process: {json_files}")
 
+    outbox = Outbox(client_factory=lambda: supabase, db_path=OUTBOX_DB_PATH, batch_size=BATCH_SIZE)
+    requeued = outbox.requeue_failed() # Rows rejected in earlier runs get another chance (e.g. after a schema fix)
+    if requeued:
+        print(f"Retrying {requeued} rows that were rejected in earlier runs.")
+    outbox.start()
+
     # Process each file
     total_uploaded_posts = 0
     total_uploaded_relations = 0
+    detail_posts = [] # Records with a full detail, marked known once their rows are sent
     for file_path in tqdm(json_files, desc="Processing files"):
         print(f"\nProcessing {file_path}...")
         data = load_json_file(file_path)
         if data:
             # Pass maps and existing IDs to the processing function
-            posts_count, relations_count = process_and_upload_posts(data, brand_id_map, existing_post_ids)
+            posts_count, relations_count = process_and_upload_posts(data, brand_id_map, existing_post_ids, outbox)
+            detail_posts.extend(post for post in data if post.get('post_id') and not post.get('card_only'))
             total_uploaded_posts += posts_count
             total_uploaded_relations += relations_count
             # Add newly uploaded post IDs to the set to prevent duplicates *within the same run*
             # if processing multiple files that might contain the same new post.
             if posts_count > 0:
-                 newly_added_ids = {post['post_id'] for post in data if post.get('post_id') and post['post_id'] not in existing_post_ids}
+                 newly_added_ids = {post['post_id'] for post in data
+                                    if post.get('post_id') and not post.get('card_only') and post['post_id'] not in existing_post_ids}
                  existing_post_ids.update(newly_added_ids)
 
 
+    pending = outbox.close(timeout=OUTBOX_DRAIN_TIMEOUT)
+
+    # Posts whose rows are still in the outbox are not known yet; the crawler opens them again
+    unsent_post_ids = {row.get("post_id") for row in outbox.unsent_payloads(POSTS_TABLE_NAME)}
+    stored_posts = [post for post in detail_posts if post['post_id'] not in unsent_post_ids]
+    try:
+        known_posts.mark_and_save(stored_posts)
+        print(f"Marked {len(stored_posts)} stored posts as known.")
+    except OSError as e:
+        print(f"Warning: Could not update the known posts cache: {e}")
+
     print(f"\nUpload complete.")
-    print(f"Total new posts uploaded across all files: {total_uploaded_posts}")
-    print(f"Total post-brand relations upserted across all files: {total_uploaded_relations}")
+    print(f"Total post rows queued across all files: {total_uploaded_posts}")
+    print(f"Total post-brand relations queued across all files: {total_uploaded_relations}")
+    print(f"Rows sent to Supabase this run: {outbox.sent_rows}")
+    if pending:
+        print(f"{pending} rows are still pending in the outbox; rerun upload.py to resume flushing.")
+    if outbox.failed_rows:
+        print(f"{outbox.failed_rows} rows were rejected by Supabase and parked as failed in {OUTBOX_DB_PATH}.")
+    if pending or outbox.failed_rows:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+# xhs_crawler/xhs_selectors.py
+# CSS selectors and in-page scripts used by crawler.py. (Not named selectors.py: that would
+# shadow the standard library module asyncio imports.)
+# Each script runs in a single page.evaluate call and returns plain data, so reading a whole
+# set of elements costs one CDP round trip instead of one per element and field.
+# When the XHS layout changes, update the selector dicts here; the scripts only read them.
+
+import json
+
+# --- Search result cards ---
+CARD_SELECTORS = {
+    "item": "section.note-item[data-index]",
+    "cover": "a.cover", # Missing on placeholders and ads
+    "click": "a.cover.mask.ld", # Opens the detail mask
+    "title": "div.footer a.title",
+    "author": "div.card-bottom-wrapper a.author div.name span.name",
+    "time": "div.card-bottom-wrapper a.author span.time",
+    "likes": "span.like-wrapper span.count",
+    "ad": ".ads-tag, .ad-tag", # Sponsored badge
+}
+
+# Reads one card element: {index, href, title, author, time, likes, is_ad, visible}
+_READ_CARD_JS = """(el, sel) => {
+    const text = (selector) => {
+        const found = selector ? el.querySelector(selector) : null;
+        return found ? found.textContent.trim() : "";
+    };
+    const rect = el.getBoundingClientRect();
+    const style = getComputedStyle(el);
+    const cover = el.querySelector(sel.cover);
+    return {
+        index: parseInt(el.getAttribute("data-index"), 10),
+        href: cover ? cover.getAttribute("href") : null,
+        title: text(sel.title),
+        author: text(sel.author),
+        time: text(sel.time),
+        likes: text(sel.likes),
+        is_ad: !cover || (sel.ad ? el.querySelector(sel.ad) !== null : false),
+        visible: rect.width > 0 && rect.height > 0 && style.visibility !== "hidden" && style.display !== "none",
+    };
+}"""
+
+# Returns every rendered, visible card, ordered by data-index.
+CARD_SCAN_JS = """(sel) => {
+    const readCard = %s;
+    return Array.from(document.querySelectorAll(sel.item))
+        .map(el => readCard(el, sel))
+        .filter(card => card.visible)
+        .sort((a, b) => a.index - b.index);
+}""" % _READ_CARD_JS
+
+# Installs a MutationObserver that sends every newly rendered or changed card to the Python
+# binding (one call per animation frame with all cards changed in it). Idempotent per document;
+# registered as an init script, so it also runs on every navigation.
+_CARD_OBSERVER_JS = """(sel, binding) => {
+    if (window.__xhsCardObserver) return;
+    const readCard = %s;
+    const sent = new Map(); // data-index -> signature of the last payload sent
+    let pending = new Set();
+    let scheduled = false;
+    const flush = () => {
+        scheduled = false;
+        const cards = [];
+        for (const el of pending) {
+            if (!el.isConnected) continue;
+            const card = readCard(el, sel);
+            const signature = [card.href, card.title, card.likes, card.is_ad, card.visible].join("|");
+            if (Number.isNaN(card.index) || sent.get(card.index) === signature) continue;
+            sent.set(card.index, signature);
+            cards.push(card);
+        }
+        pending = new Set();
+        if (cards.length && window[binding]) window[binding](cards);
+    };
+    const queue = (el) => {
+        pending.add(el);
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(flush);
+        }
+    };
+    const collect = (node) => {
+        if (!(node instanceof Element)) node = node.parentElement;
+        if (!node) return;
+        const card = node.closest(sel.item);
+        if (card) {
+            queue(card);
+        } else {
+            node.querySelectorAll(sel.item).forEach(queue);
+        }
+    };
+    window.__xhsCardObserver = new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            collect(mutation.target);
+            mutation.addedNodes.forEach(collect);
+        }
+    });
+    // Python forgot its cards (new search/sort): send every rendered card again
+    window.__xhsCardsResend = () => {
+        sent.clear();
+        document.querySelectorAll(sel.item).forEach(queue);
+    };
+    window.__xhsCardObserver.observe(document, { childList: true, subtree: true, characterData: true, attributes: true, attributeFilter: ["data-index", "href"] });
+    document.querySelectorAll(sel.item).forEach(queue); // Cards rendered before the observer
+}""" % _READ_CARD_JS
+
+CARD_BINDING = "__xhsCardsRendered"
+CARD_RESEND_JS = "() => { if (window.__xhsCardsResend) window.__xhsCardsResend(); }"
+
+
+def card_observer_script():
+    """Self-invoking observer script (for add_init_script and evaluate)."""
+    return f"({_CARD_OBSERVER_JS})({json.dumps(CARD_SELECTORS)}, {json.dumps(CARD_BINDING)})"
+
+
+def card_cover_selector(data_index):
+    """Selector of the clickable cover of the card with the given data-index."""
+    return f'section.note-item[data-index="{data_index}"] {CARD_SELECTORS["click"]}'
+
+
+# --- Note detail mask ---
+# Versioned so a layout change is a new entry, not a code change. DETAIL_SCAN_JS uses the first
+# version whose mask is on the page; the version used is returned with the data.
+DETAIL_SELECTOR_VERSIONS = [
+    {
+        "version": "2024-05",
+        "mask": "div.note-detail-mask",
+        "note_id_attr": "note-id",
+        "content": "#detail-desc",
+        "slider_images": "div.swiper-slide img.note-slider-img",
+        "single_image": "img.note-image",
+        "counts_area": ["div.engage-bar", "div.action-container"],
+        "likes": ".like-wrapper span.count",
+        "collections": ".collect-wrapper span.count",
+        "comments": ".chat-wrapper span.count",
+    },
+]
+
+# Returns {version, note_id, url, content, images, likes, collections, comments} (counts as
+# displayed text, e.g. "1.2万"), or null when no known mask is on the page.
+DETAIL_SCAN_JS = """(versions) => {
+    for (const sel of versions) {
+        const mask = document.querySelector(sel.mask);
+        if (!mask) continue;
+        const result = { version: sel.version, url: location.href, content: "", images: [],
+                         likes: "", collections: "", comments: "" };
+        result.note_id = mask.getAttribute(sel.note_id_attr) || null;
+
+        // Text nodes and element texts joined with single spaces (hashtags are plain text here)
+        const desc = mask.querySelector(sel.content);
+        if (desc) {
+            const parts = [];
+            desc.childNodes.forEach(node => {
+                if (node.nodeType === Node.TEXT_NODE || node.nodeType === Node.ELEMENT_NODE) {
+                    const text = (node.textContent || "").trim();
+                    if (text) parts.push(text);
+                }
+            });
+            result.content = parts.join(" ");
+        }
+
+        let images = Array.from(mask.querySelectorAll(sel.slider_images));
+        if (images.length === 0) {
+            const single = mask.querySelector(sel.single_image);
+            images = single ? [single] : [];
+        }
+        result.images = images.map(img => img.getAttribute("src")).filter(src => src);
+
+        let area = null;
+        for (const selector of sel.counts_area) {
+            area = mask.querySelector(selector);
+            if (area) break;
+        }
+        if (area) {
+            for (const field of ["likes", "collections", "comments"]) {
+                const el = area.querySelector(sel[field]);
+                result[field] = el ? el.textContent.trim() : "";
+            }
+        }
+        result.counts_found = area !== null;
+        return result;
+    }
+    return null;
+}"""